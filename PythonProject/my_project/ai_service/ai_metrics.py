@@ -0,0 +1,57 @@
+import json
+import os
+import random
+import time
+from typing import Any, Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+
+# Prometheus metrics and sampled structured logs for ai_server. Metric and helper names match
+# app/instrumentation.py, which covers the API and the Celery workers; this service is deployed
+# on its own, so it keeps its own copy, under a different module name so the two never shadow each
+# other when both directories are on sys.path (benchmarks/suite.py). With several uvicorn workers
+# set PROMETHEUS_MULTIPROC_DIR.
+
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "AI service request duration", ["route", "method", "status"], buckets=LATENCY_BUCKETS
+)
+OPENAI_REQUEST_SECONDS = Histogram(
+    "openai_request_seconds", "Duration of one OpenAI chat completion, including waiting for a slot",
+    ["mode", "outcome"], buckets=LATENCY_BUCKETS
+)
+OPENAI_FIRST_TOKEN_SECONDS = Histogram(
+    "openai_first_token_seconds", "Time to the first streamed content delta", buckets=LATENCY_BUCKETS
+)
+OPENAI_TOKENS = Counter("openai_tokens_total", "Tokens reported in OpenAI usage", ["type"])
+AI_CACHE_LOOKUPS = Counter("ai_cache_lookups_total", "Completion cache lookups by source", ["source"])
+
+
+def metrics_response() -> Tuple[bytes, str]:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def log_event(event: str, sample_rate: float = LOG_SAMPLE_RATE, **fields: Any):
+    # One JSON line for a sample of events, instead of printing every request or completion
+    if sample_rate >= 1 or random.random() < sample_rate:
+        print(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, ensure_ascii=False, default=str))
+
+
+def outcome(error: BaseException) -> str:
+    # Label value for a failed OpenAI call (asyncio and openai timeouts, 429s, cancellation)
+    name = type(error).__name__
+    if name in ("TimeoutError", "APITimeoutError"):
+        return "timeout"
+    if name == "RateLimitError":
+        return "rate_limited"
+    if not isinstance(error, Exception):
+        return "cancelled"
+    return "error"
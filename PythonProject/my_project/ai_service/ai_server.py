@@ -1,10 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Literal, Dict, Any
+from typing import Literal, Dict, Any, Optional
+import asyncio
+import hashlib
+import json
 import openai
 import os
+import re
+import time
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
+from result_cache import CompletionCache, cache_key
+from batcher import MicroBatcher
+from section_stream import SectionStreamParser
+from ai_tracing import parse_traceparent, tracer
+from ai_metrics import (
+    AI_CACHE_LOOKUPS, HTTP_REQUEST_SECONDS, OPENAI_FIRST_TOKEN_SECONDS, OPENAI_REQUEST_SECONDS, OPENAI_TOKENS,
+    log_event, metrics_response, outcome
+)
 
 load_dotenv()
 
@@ -19,8 +34,92 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    # Streaming responses are timed until the headers are sent; the stream itself is in openai_* metrics
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.labels(
+        route.path if route is not None else "unmatched", request.method, response.status_code
+    ).observe(time.perf_counter() - started)
+    return response
+
 # Configure OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# OPENAI_BASE_URL can point at any OpenAI-compatible server (e.g. a local fake for load tests)
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# How often to check whether the caller has gone away while a completion is running
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+# Completion cache: in-process LRU, plus Redis when AI_CACHE_REDIS is on
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() == "true"
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "10000"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "86400"))
+AI_CACHE_REDIS = os.getenv("AI_CACHE_REDIS", "false").lower() == "true"
+AI_CACHE_REDIS_TTL = float(os.getenv("AI_CACHE_REDIS_TTL", str(7 * 86400)))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Micro-batching: concurrent requests are combined into one completion covering several pets
+AI_BATCH_ENABLED = os.getenv("AI_BATCH_ENABLED", "false").lower() == "true"
+AI_BATCH_MAX_SIZE = int(os.getenv("AI_BATCH_MAX_SIZE", "4"))
+AI_BATCH_MAX_WAIT_MS = float(os.getenv("AI_BATCH_MAX_WAIT_MS", "50"))
+
+_openai_client: Optional[openai.AsyncOpenAI] = None
+_openai_slots: Optional[asyncio.Semaphore] = None
+
+
+def get_openai_client() -> openai.AsyncOpenAI:
+    # Created lazily so the app can start without a key; one client (and its connection pool) per process
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=OPENAI_BASE_URL,
+            timeout=OPENAI_TIMEOUT,
+            max_retries=OPENAI_MAX_RETRIES,
+        )
+    return _openai_client
+
+
+def get_openai_slots() -> asyncio.Semaphore:
+    # Must be created inside the running event loop
+    global _openai_slots
+    if _openai_slots is None:
+        _openai_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    return _openai_slots
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+# Totals across all completions, used to compare batched and unbatched prompt token usage
+llm_stats = {
+    "completions": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "batch_fallbacks": 0,
+}
+
+
+SYSTEM_PROMPT = """
+                    You are a talented, expressive pet psychologist skilled in vivid storytelling.Your goal is to analyze pet personalities with creativity, warmth, and humor. Use engaging, charming, and lively language to vividly illustrate each pet's playful, thoughtful, or unique traits.
+                    Descriptions must feel universal, appealing, and delightful, without mentioning breed or animal type.
+
+                    STRICTLY follow these character limits for each section:
+                        Explanations: 150-200 characters.
+                        Personal Speech (as if the pet speaks): 50-75 characters.
+                        Third Person Diagnosis (observer's perspective): 175-216 characters.
+                        "Do" Advice: 100-150 characters.
+                        "Do Not" Advice: 100-150 characters.
+                    
+                    Carefully ensure each section precisely meets these requirements.
+                    """
 
 class MbtiOutput(BaseModel):
     m_label: Literal["Extraversion", "Introversion"]
@@ -148,30 +247,31 @@ def map_score_to_label(score, dimension):
         else:
             return "Perceiving"
 
-@app.post("/ai", response_model=MbtiOutput)
-async def process_ai(input: AIInput):
-    try:
-        # Get input data
-        pet_name = input.input_data["pet_name"]
-        pet_type = input.input_data["pet_type"]
-        pet_breed = input.input_data["pet_breed"]
-        mbti_scores = input.input_data["mbti_scores"]
-        
-        # Generate MBTI description
-        mbti_description = generate_mbti_description(
-            mbti_scores['E/I'],
-            mbti_scores['S/N'],
-            mbti_scores['T/F'],
-            mbti_scores['J/P']
-        )
-        
-        # Build prompt for AI
-        prompt = f"""
-        Analyze the personality of {pet_name} ({pet_type}, breed: {pet_breed}) based on these MBTI characteristics:
-        {mbti_description}
-        
-        Provide your analysis strictly following this structured format and EXACT character limits:
-        [E/I Explanation] (150-200 characters)
+# Section headers the model must emit; extract_section looks these up by name
+SECTION_NAMES = [
+    "E/I Explanation",
+    "S/N Explanation",
+    "T/F Explanation",
+    "J/P Explanation",
+    "Personal Speech",
+    "Third Person Diagnosis",
+    "Do",
+    "Do Not"
+]
+
+# Output field filled from each section
+SECTION_FIELDS = {
+    "E/I Explanation": "m_explanation",
+    "S/N Explanation": "b_explanation",
+    "T/F Explanation": "t_explanation",
+    "J/P Explanation": "i_explanation",
+    "Personal Speech": "personal_speech",
+    "Third Person Diagnosis": "third_person_diagnosis",
+    "Do": "do_suggestion",
+    "Do Not": "do_not_suggestion"
+}
+
+SECTION_FORMAT = """        [E/I Explanation] (150-200 characters)
         Creatively describe the pet's energy level and social interactions vividly and joyfully, making its character sparkle.
 
         [S/N Explanation] (150-200 characters)
@@ -197,82 +297,405 @@ async def process_ai(input: AIInput):
         [Do Not] (100-150 characters)
         Humorously and empathetically describe interactions to avoid, focusing on the pet's dislikes and sensitivities.
         """
+
+
+def build_prompt(pet_name, pet_type, pet_breed, mbti_description):
+    return f"""
+        Analyze the personality of {pet_name} ({pet_type}, breed: {pet_breed}) based on these MBTI characteristics:
+        {mbti_description}
         
-        # Call OpenAI API
-        completion = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": """
-                    You are a talented, expressive pet psychologist skilled in vivid storytelling.Your goal is to analyze pet personalities with creativity, warmth, and humor. Use engaging, charming, and lively language to vividly illustrate each pet's playful, thoughtful, or unique traits.
-                    Descriptions must feel universal, appealing, and delightful, without mentioning breed or animal type.
+        Provide your analysis strictly following this structured format and EXACT character limits:
+""" + SECTION_FORMAT
 
-                    STRICTLY follow these character limits for each section:
-                        Explanations: 150-200 characters.
-                        Personal Speech (as if the pet speaks): 50-75 characters.
-                        Third Person Diagnosis (observer's perspective): 175-216 characters.
-                        "Do" Advice: 100-150 characters.
-                        "Do Not" Advice: 100-150 characters.
-                    
-                    Carefully ensure each section precisely meets these requirements.
-                    """
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        )
+
+# Changes whenever the system prompt or the prompt template changes, so stale cache entries are never served
+PROMPT_VERSION = hashlib.sha256(
+    (SYSTEM_PROMPT + build_prompt("{pet_name}", "{pet_type}", "{pet_breed}", "{mbti_description}")).encode("utf-8")
+).hexdigest()[:16]
+
+completion_cache = CompletionCache(
+    max_size=AI_CACHE_MAX_ENTRIES,
+    ttl=AI_CACHE_TTL,
+    redis_url=REDIS_URL if AI_CACHE_REDIS else None,
+    redis_ttl=AI_CACHE_REDIS_TTL,
+) if AI_CACHE_ENABLED else None
+
+
+def extract_section(content, section_name):
+    start = content.find(f"[{section_name}]")
+    if start == -1:
+        return ""
+    start = content.find("\n", start) + 1
+    end = content.find("\n\n", start)
+    if end == -1:
+        end = len(content)
+    return content[start:end].strip()
+
+
+def build_output(mbti_scores, ai_response):
+    # Create structured output for frontend
+    return {
+        "m_label": map_score_to_label(mbti_scores['E/I'], 'E/I'),
+        "m_score": mbti_scores['E/I'],
+        "m_explanation": extract_section(ai_response, "E/I Explanation"),
+        
+        "b_label": map_score_to_label(mbti_scores['S/N'], 'S/N'),
+        "b_score": mbti_scores['S/N'],
+        "b_explanation": extract_section(ai_response, "S/N Explanation"),
+        
+        "t_label": map_score_to_label(mbti_scores['T/F'], 'T/F'),
+        "t_score": mbti_scores['T/F'],
+        "t_explanation": extract_section(ai_response, "T/F Explanation"),
         
-        # Get AI's response
-        print(completion.choices[0].message.content)
-        ai_response = completion.choices[0].message.content
+        "i_label": map_score_to_label(mbti_scores['J/P'], 'J/P'),
+        "i_score": mbti_scores['J/P'],
+        "i_explanation": extract_section(ai_response, "J/P Explanation"),
         
-        # Parse AI response
-        def extract_section(content, section_name):
-            start = content.find(f"[{section_name}]")
-            if start == -1:
-                return ""
-            start = content.find("\n", start) + 1
-            end = content.find("\n\n", start)
-            if end == -1:
-                end = len(content)
-            return content[start:end].strip()
+        "personal_speech": extract_section(ai_response, "Personal Speech"),
+        "third_person_diagnosis": extract_section(ai_response, "Third Person Diagnosis"),
         
-        # Create structured output for frontend
-        output = {
-            "m_label": map_score_to_label(mbti_scores['E/I'], 'E/I'),
-            "m_score": mbti_scores['E/I'],
-            "m_explanation": extract_section(ai_response, "E/I Explanation"),
+        "do_suggestion": extract_section(ai_response, "Do"),
+        "do_not_suggestion": extract_section(ai_response, "Do Not")
+    }
+
+
+async def create_completion(prompt):
+    started = time.perf_counter()
+    try:
+        completion = await request_completion(prompt)
+    except BaseException as e:
+        OPENAI_REQUEST_SECONDS.labels("completion", outcome(e)).observe(time.perf_counter() - started)
+        raise
+    OPENAI_REQUEST_SECONDS.labels("completion", "ok").observe(time.perf_counter() - started)
+    llm_stats["completions"] += 1
+    if completion.usage is not None:
+        llm_stats["prompt_tokens"] += completion.usage.prompt_tokens
+        llm_stats["completion_tokens"] += completion.usage.completion_tokens
+        OPENAI_TOKENS.labels("prompt").inc(completion.usage.prompt_tokens)
+        OPENAI_TOKENS.labels("completion").inc(completion.usage.completion_tokens)
+    return completion.choices[0].message.content
+
+
+async def request_completion(prompt):
+    async with get_openai_slots():
+        return await asyncio.wait_for(
+            get_openai_client().chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": SYSTEM_PROMPT
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ]
+            ),
+            timeout=OPENAI_TIMEOUT
+        )
+
+
+async def stream_completion(prompt):
+    # Yields content deltas as they arrive; the whole stream shares one OPENAI_TIMEOUT deadline
+    started = time.perf_counter()
+    try:
+        async for delta in stream_deltas(prompt, started):
+            yield delta
+    except BaseException as e:
+        OPENAI_REQUEST_SECONDS.labels("stream", outcome(e)).observe(time.perf_counter() - started)
+        raise
+    OPENAI_REQUEST_SECONDS.labels("stream", "ok").observe(time.perf_counter() - started)
+
+
+async def stream_deltas(prompt, started):
+    loop = asyncio.get_running_loop()
+    first_token = True
+    async with get_openai_slots():
+        deadline = loop.time() + OPENAI_TIMEOUT
+        stream = await asyncio.wait_for(
+            get_openai_client().chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": SYSTEM_PROMPT
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                stream=True,
+                stream_options={"include_usage": True}
+            ),
+            timeout=OPENAI_TIMEOUT
+        )
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=max(0.0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    break
+                if chunk.usage is not None:
+                    llm_stats["prompt_tokens"] += chunk.usage.prompt_tokens
+                    llm_stats["completion_tokens"] += chunk.usage.completion_tokens
+                    OPENAI_TOKENS.labels("prompt").inc(chunk.usage.prompt_tokens)
+                    OPENAI_TOKENS.labels("completion").inc(chunk.usage.completion_tokens)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token:
+                        OPENAI_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+                        first_token = False
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+    llm_stats["completions"] += 1
+
+
+def build_batch_prompt(pets):
+    # pets: list of (pet_name, pet_type, pet_breed, mbti_description)
+    pet_list = "".join(f"""
+        PET {index}: {pet_name} ({pet_type}, breed: {pet_breed}), MBTI characteristics:
+        {mbti_description}
+        """ for index, (pet_name, pet_type, pet_breed, mbti_description) in enumerate(pets, start=1))
+    return f"""
+        Analyze the personalities of the following {len(pets)} pets. Treat every pet independently and never mix traits between pets.
+        {pet_list}
+        For EACH pet, in order, first write a line containing only "### PET <number>", then provide that pet's analysis strictly following this structured format and EXACT character limits:
+""" + SECTION_FORMAT
+
+
+BATCH_MARKER_RE = re.compile(r"^[ \t#*=]*PET\s+(\d+)[ \t#*=:]*$", re.MULTILINE | re.IGNORECASE)
+
+
+def split_batch_response(content, count):
+    # Returns one block per pet (None when the model skipped it); each block is parsed with extract_section
+    blocks = [None] * count
+    markers = list(BATCH_MARKER_RE.finditer(content))
+    for position, marker in enumerate(markers):
+        index = int(marker.group(1)) - 1
+        end = markers[position + 1].start() if position + 1 < len(markers) else len(content)
+        if 0 <= index < count and blocks[index] is None:
+            blocks[index] = content[marker.end():end].strip("\n") + "\n"
+    return blocks
+
+
+def is_complete_analysis(content):
+    return all(extract_section(content, name) for name in SECTION_NAMES)
+
+
+async def run_llm_batch(pets):
+    if len(pets) == 1:
+        return [await create_completion(build_prompt(*pets[0]))]
+
+    try:
+        blocks = split_batch_response(await create_completion(build_batch_prompt(pets)), len(pets))
+    except openai.BadRequestError as e:
+        # Only a batch prompt OpenAI rejects (e.g. too long) is worth retrying per pet. Rate limits, timeouts
+        # and connection errors go to every waiting pet: N single requests would add load while OpenAI is
+        # asking clients to slow down, and the 429 reaches the worker with its Retry-After
+        log_event("batch_fallback", pets=len(pets), error=str(e))
+        blocks = [None] * len(pets)
+
+    # Pets the batch answer didn't cover completely are retried on their own, so one bad block fails nobody else
+    missing = [index for index, block in enumerate(blocks) if block is None or not is_complete_analysis(block)]
+    llm_stats["batch_fallbacks"] += len(missing)
+    retried = await asyncio.gather(
+        *[create_completion(build_prompt(*pets[index])) for index in missing],
+        return_exceptions=True
+    )
+    results = list(blocks)
+    for index, result in zip(missing, retried):
+        if isinstance(result, BaseException) and not isinstance(result, Exception):
+            result = RuntimeError("Completion cancelled")
+        results[index] = result
+    return results
+
+
+batcher = MicroBatcher(
+    run_llm_batch,
+    max_batch_size=AI_BATCH_MAX_SIZE,
+    max_wait=AI_BATCH_MAX_WAIT_MS / 1000
+) if AI_BATCH_ENABLED else None
+
+
+async def complete_analysis(pet_name, pet_type, pet_breed, mbti_description):
+    if batcher is not None:
+        return await batcher.submit((pet_name, pet_type, pet_breed, mbti_description))
+    return await create_completion(build_prompt(pet_name, pet_type, pet_breed, mbti_description))
+
+
+async def run_unless_disconnected(request: Request, coro):
+    # Cancel the in-flight completion as soon as the caller goes away
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+@app.post("/ai", response_model=MbtiOutput)
+async def process_ai(input: AIInput, request: Request, response: Response):
+    # Continues the Celery worker's trace when the request carries a traceparent
+    with tracer.span("ai.handle", parent=parse_traceparent(request.headers.get("traceparent")), root=True) as span:
+        try:
+            # Get input data
+            pet_name = input.input_data["pet_name"]
+            pet_type = input.input_data["pet_type"]
+            pet_breed = input.input_data["pet_breed"]
+            mbti_scores = input.input_data["mbti_scores"]
             
-            "b_label": map_score_to_label(mbti_scores['S/N'], 'S/N'),
-            "b_score": mbti_scores['S/N'],
-            "b_explanation": extract_section(ai_response, "S/N Explanation"),
+            # Generate MBTI description
+            mbti_description = generate_mbti_description(
+                mbti_scores['E/I'],
+                mbti_scores['S/N'],
+                mbti_scores['T/F'],
+                mbti_scores['J/P']
+            )
             
-            "t_label": map_score_to_label(mbti_scores['T/F'], 'T/F'),
-            "t_score": mbti_scores['T/F'],
-            "t_explanation": extract_section(ai_response, "T/F Explanation"),
+            # Build prompt for AI (batched with other pets when AI_BATCH_ENABLED)
+            async def create():
+                # OPENAI_TIMEOUT bounds the whole request (waiting for a slot, batching, per-pet fallback),
+                # so the answer or the 504 arrives before the worker's AI_READ_TIMEOUT and it never retries
+                # while this completion is still running
+                with tracer.span("openai.completion", batched=batcher is not None):
+                    return await asyncio.wait_for(
+                        complete_analysis(pet_name, pet_type, pet_breed, mbti_description), timeout=OPENAI_TIMEOUT
+                    )
             
-            "i_label": map_score_to_label(mbti_scores['J/P'], 'J/P'),
-            "i_score": mbti_scores['J/P'],
-            "i_explanation": extract_section(ai_response, "J/P Explanation"),
+            # Call OpenAI API without blocking the event loop, unless the same input was answered before
+            if completion_cache is not None:
+                key = cache_key(input.input_data, mbti_description, PROMPT_VERSION, OPENAI_MODEL)
+                ai_response, source = await run_unless_disconnected(
+                    request, completion_cache.get_or_create(key, create)
+                )
+                response.headers["X-Cache"] = "MISS" if source == "miss" else "HIT"
+                response.headers["X-Cache-Source"] = source
+                AI_CACHE_LOOKUPS.labels(source).inc()
+            else:
+                ai_response = await run_unless_disconnected(request, create())
+                source = "disabled"
+            span.set(pet_type=pet_type, cache=source)
             
-            "personal_speech": extract_section(ai_response, "Personal Speech"),
-            "third_person_diagnosis": extract_section(ai_response, "Third Person Diagnosis"),
+            output = MbtiOutput(**build_output(mbti_scores, ai_response))
+            log_event("ai_completion", pet_type=pet_type, cache=source, chars=len(ai_response),
+                      empty_sections=sum(1 for name in SECTION_NAMES if not getattr(output, SECTION_FIELDS[name])))
+            return output
             
-            "do_suggestion": extract_section(ai_response, "Do"),
-            "do_not_suggestion": extract_section(ai_response, "Do Not")
-        }
-        
-        return MbtiOutput(**output)
-        
+        except ClientDisconnected:
+            # Nobody is listening any more; 499 only shows up in access logs
+            raise HTTPException(status_code=499, detail="Client disconnected")
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail=f"OpenAI request timed out after {OPENAI_TIMEOUT}s")
+        except openai.RateLimitError as e:
+            # Passed on with OpenAI's Retry-After so the workers back off together instead of failing the task
+            retry_after = e.response.headers.get("retry-after") or "1"
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": retry_after})
+        except openai.APIConnectionError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+def ndjson(event):
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+@app.post("/ai/stream")
+async def process_ai_stream(input: AIInput, request: Request):
+    # Same input and final payload as /ai, but each section is sent as an NDJSON line as soon as it is complete:
+    #   {"event": "section", "section": "E/I Explanation", "field": "m_explanation", "text": "..."}
+    #   {"event": "result", "data": {...MbtiOutput...}}   or   {"event": "error", "detail": "..."}
+    try:
+        pet_name = input.input_data["pet_name"]
+        pet_type = input.input_data["pet_type"]
+        pet_breed = input.input_data["pet_breed"]
+        mbti_scores = input.input_data["mbti_scores"]
+        mbti_description = generate_mbti_description(
+            mbti_scores['E/I'],
+            mbti_scores['S/N'],
+            mbti_scores['T/F'],
+            mbti_scores['J/P']
+        )
+        prompt = build_prompt(pet_name, pet_type, pet_breed, mbti_description)
+        key = cache_key(input.input_data, mbti_description, PROMPT_VERSION, OPENAI_MODEL) if completion_cache is not None else None
+        cached, source = await completion_cache.get(key) if key is not None else (None, "miss")
+        if key is not None:
+            AI_CACHE_LOOKUPS.labels(source).inc()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    parent = parse_traceparent(request.headers.get("traceparent"))
+
+    async def events():
+        with tracer.span("ai.stream", parent=parent, root=True, pet_type=pet_type, cache=source):
+            async for line in stream_events():
+                yield line
+
+    async def stream_events():
+        parser = SectionStreamParser(SECTION_NAMES)
+
+        def section_events(sections):
+            return [
+                ndjson({"event": "section", "section": name, "field": SECTION_FIELDS[name], "text": text})
+                for name, text in sections
+            ]
+
+        try:
+            if cached is not None:
+                ai_response = cached
+                for line in section_events(parser.feed(cached) + parser.finish()):
+                    yield line
+            else:
+                # Streaming bypasses the micro-batcher; the finished text still goes into the cache
+                with tracer.span("openai.stream") as span:
+                    started = time.perf_counter()
+                    async for delta in stream_completion(prompt):
+                        if not parser.text:
+                            span.set(first_token_ms=round((time.perf_counter() - started) * 1000, 1))
+                        for line in section_events(parser.feed(delta)):
+                            yield line
+                for line in section_events(parser.finish()):
+                    yield line
+                ai_response = parser.text
+                if key is not None:
+                    await completion_cache.set(key, ai_response)
+
+            # The final payload is assembled exactly like /ai, from the full completion
+            output = MbtiOutput(**build_output(mbti_scores, ai_response))
+            yield ndjson({"event": "result", "data": jsonable_encoder(output)})
+        except asyncio.TimeoutError:
+            yield ndjson({"event": "error", "detail": f"OpenAI request timed out after {OPENAI_TIMEOUT}s"})
+        except Exception as e:
+            yield ndjson({"event": "error", "detail": str(e)})
+
+    headers = {}
+    if key is not None:
+        headers = {"X-Cache": "MISS" if cached is None else "HIT", "X-Cache-Source": source}
+    return StreamingResponse(events(), media_type="application/x-ndjson", headers=headers)
+
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = metrics_response()
+    return Response(body, headers={"Content-Type": content_type})
+
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "cache": completion_cache.stats() if completion_cache is not None else None,
+        "batching": batcher.stats() if batcher is not None else None,
+        "llm": llm_stats,
+        "tracing": tracer.stats()
+    }
 
 if __name__ == "__main__":
     import uvicorn
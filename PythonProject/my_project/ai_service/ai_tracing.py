@@ -0,0 +1,207 @@
+import atexit
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, NamedTuple, Optional
+import requests
+
+# Spans for ai_server, continuing the trace the Celery worker sends in the W3C traceparent header.
+# Record format, TRACE_EXPORT and TRACE_SAMPLE_RATE match app/tracing.py, which also has the report CLI;
+# this service is deployed on its own, so it keeps its own copy (under its own module name, so it is
+# not shadowed by app/tracing.py when both directories are on sys.path). TRACE_SAMPLE_RATE only
+# applies to requests that arrive without a traceparent.
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_EXPORT = os.getenv(
+    "TRACE_EXPORT",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "traces", "spans.jsonl")
+)
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    try:
+        _, trace_id, span_id, flags = str(value).strip().lower().split("-")[:4]
+        sampled = bool(int(flags, 16) & 1)
+        int(trace_id, 16), int(span_id, 16)
+    except ValueError:
+        return None
+    if len(trace_id) != 32 or len(span_id) != 16 or not int(trace_id, 16) or not int(span_id, 16):
+        return None
+    return SpanContext(trace_id, span_id, sampled)
+
+
+_current: ContextVar[Optional[SpanContext]] = ContextVar("trace_context", default=None)
+
+
+def new_span_id() -> str:
+    return "%016x" % random.getrandbits(64)
+
+
+class Span:
+    __slots__ = ("name", "context", "parent_id", "start", "started", "attrs")
+
+    def __init__(self, name: str, context: SpanContext, parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.attrs = attrs
+
+    def set(self, **attrs: Any):
+        self.attrs.update(attrs)
+
+
+class _NoopSpan:
+    context = None
+
+    def set(self, **attrs: Any):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    spans = []
+    for record in records:
+        start_ns = int(record["start"] * 1e9)
+        spans.append({
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "parentSpanId": record["parent_id"] or "",
+            "name": record["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(record["duration_ms"] * 1e6)),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in record["attrs"].items()],
+            "status": {"code": 2, "message": record["error"]} if record.get("error") else {"code": 1},
+        })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "ai_service"}}]},
+        "scopeSpans": [{"scope": {"name": "fursphere"}, "spans": spans}],
+    }]}
+
+
+class Tracer:
+    # Finished spans go through a queue to a background thread that appends them to a file
+    # (one O_APPEND write per batch) or POSTs them to an OTLP/HTTP collector
+    def __init__(self, target: str, sample_rate: float = 0.01, max_queue: int = 10000, batch_size: int = 512):
+        self.target = target
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.counters = {"exported": 0, "dropped": 0, "export_errors": 0}
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[SpanContext] = None, root: bool = False, **attrs: Any):
+        # With no parent and no current span, only root=True starts a (sampled) trace; otherwise nothing is recorded
+        parent = parent or _current.get()
+        if parent is None:
+            if not root:
+                yield NOOP_SPAN
+                return
+            context = SpanContext("%032x" % random.getrandbits(128), new_span_id(), random.random() < self.sample_rate)
+            parent_id = None
+        else:
+            context = SpanContext(parent.trace_id, new_span_id(), parent.sampled)
+            parent_id = parent.span_id
+        token = _current.set(context)
+        span = Span(name, context, parent_id, attrs) if context.sampled else NOOP_SPAN
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            if isinstance(span, Span):
+                self._export(span, error)
+
+    def _export(self, span: Span, error: Optional[str]):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait({
+                "trace_id": span.context.trace_id,
+                "span_id": span.context.span_id,
+                "parent_id": span.parent_id,
+                "name": span.name,
+                "service": "ai_service",
+                "start": round(span.start, 6),
+                "duration_ms": round((time.perf_counter() - span.started) * 1000, 3),
+                "attrs": span.attrs,
+                "error": error,
+            })
+        except queue.Full:
+            self.counters["dropped"] += 1
+
+    def _drain(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            self._write(self._drain([self._queue.get()]))
+
+    def flush(self):
+        batch = self._drain([])
+        while batch:
+            self._write(batch)
+            batch = self._drain([])
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            with self._lock:
+                if self.target.startswith(("http://", "https://")):
+                    requests.post(self.target, json=otlp_payload(batch), timeout=5).raise_for_status()
+                else:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.target)), exist_ok=True)
+                    data = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in batch)
+                    fd = os.open(self.target, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                    try:
+                        os.write(fd, data.encode("utf-8"))
+                    finally:
+                        os.close(fd)
+            self.counters["exported"] += len(batch)
+        except Exception as e:
+            self.counters["export_errors"] += 1
+            print(f"Error exporting {len(batch)} spans to {self.target}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "target": self.target, "sample_rate": self.sample_rate, "queued": self._queue.qsize()}
+
+
+tracer = Tracer(TRACE_EXPORT, sample_rate=TRACE_SAMPLE_RATE)
+atexit.register(tracer.flush)
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class MicroBatcher:
+    """Collects concurrent submissions for up to max_wait seconds or max_batch_size items and runs them together.
+
+    run_batch receives the list of items and must return one result per item, in order; a result that is an
+    Exception instance fails only that item's caller.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], Awaitable[List[Any]]], max_batch_size: int = 4,
+                 max_wait: float = 0.05):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: List[Tuple[Any, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.counters = {
+            "items": 0,
+            "batches": 0,
+            "failed_items": 0,
+            "queue_wait_seconds": 0.0,
+            "batch_seconds": 0.0,
+        }
+        self.batch_sizes: Dict[int, int] = {}
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Callers that already went away don't take a slot in the batch
+        pending = [entry for entry in self._pending if not entry[1].done()]
+        batch, self._pending = pending[:self.max_batch_size], pending[self.max_batch_size:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        if batch:
+            task = asyncio.ensure_future(self._dispatch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch):
+        started = time.perf_counter()
+        self.counters["batches"] += 1
+        self.counters["items"] += len(batch)
+        self.counters["queue_wait_seconds"] += sum(started - queued_at for _, _, queued_at in batch)
+        self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+        try:
+            results = await self.run_batch([item for item, _, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        self.counters["batch_seconds"] += time.perf_counter() - started
+
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                self.counters["failed_items"] += 1
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self.counters["batches"]
+        items = self.counters["items"]
+        return {
+            **{key: round(value, 6) if isinstance(value, float) else value for key, value in self.counters.items()},
+            "avg_batch_size": round(items / batches, 3) if batches else 0.0,
+            "avg_queue_wait_seconds": round(self.counters["queue_wait_seconds"] / items, 6) if items else 0.0,
+            "avg_batch_seconds": round(self.counters["batch_seconds"] / batches, 6) if batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_seconds": self.max_wait,
+        }
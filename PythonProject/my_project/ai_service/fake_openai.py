@@ -0,0 +1,328 @@
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from functools import lru_cache
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+
+# Local stand-in for the OpenAI chat completions API, for benchmarks and load tests.
+# Every reply is a section-tagged analysis that extract_section accepts; batch prompts
+# ("PET 1: ...", "PET 2: ...") get one "### PET <n>" block per pet. Reply text is derived
+# from a hash of the prompt, so the same input always gets the same text. Latency and
+# injected failures come from one generator seeded with FAKE_OPENAI_SEED, so a run with
+# the same request order sees the same sequence (per worker process).
+#   FAKE_OPENAI_LATENCY_MS=400 FAKE_OPENAI_TOKENS_PER_SECOND=80 python ai_service/fake_openai.py
+#   OPENAI_BASE_URL=http://localhost:8010/v1 OPENAI_API_KEY=fake python ai_service/ai_server.py
+
+# Time to first token: fixed, uniform (LATENCY_MS +- SPREAD ms) or lognormal (median LATENCY_MS, sigma SPREAD)
+FAKE_OPENAI_LATENCY_DIST = os.getenv("FAKE_OPENAI_LATENCY_DIST", "fixed")
+FAKE_OPENAI_LATENCY_MS = float(os.getenv("FAKE_OPENAI_LATENCY_MS", "0"))
+FAKE_OPENAI_LATENCY_SPREAD = float(os.getenv("FAKE_OPENAI_LATENCY_SPREAD", "0"))
+# Completion tokens generated per second after the first one; 0 sends the whole reply at once
+FAKE_OPENAI_TOKENS_PER_SECOND = float(os.getenv("FAKE_OPENAI_TOKENS_PER_SECOND", "0"))
+
+# Fraction of requests answered with a 500, a 429, or a reply cut off with finish_reason "length"
+FAKE_OPENAI_ERROR_RATE = float(os.getenv("FAKE_OPENAI_ERROR_RATE", "0"))
+FAKE_OPENAI_RATE_LIMIT_RATE = float(os.getenv("FAKE_OPENAI_RATE_LIMIT_RATE", "0"))
+FAKE_OPENAI_TRUNCATE_RATE = float(os.getenv("FAKE_OPENAI_TRUNCATE_RATE", "0"))
+# Account limits like the real API's; requests over them get a 429 with Retry-After (0 = unlimited)
+FAKE_OPENAI_RPM = float(os.getenv("FAKE_OPENAI_RPM", "0"))
+FAKE_OPENAI_TPM = float(os.getenv("FAKE_OPENAI_TPM", "0"))
+
+FAKE_OPENAI_SEED = int(os.getenv("FAKE_OPENAI_SEED", "0"))
+FAKE_OPENAI_WORKERS = int(os.getenv("FAKE_OPENAI_WORKERS", "1"))
+
+# (min, max) characters per section, as requested in ai_server.SECTION_FORMAT
+SECTION_LENGTHS = {
+    "E/I Explanation": (150, 200),
+    "S/N Explanation": (150, 200),
+    "T/F Explanation": (150, 200),
+    "J/P Explanation": (150, 200),
+    "Personal Speech": (50, 75),
+    "Third Person Diagnosis": (175, 216),
+    "Do": (100, 150),
+    "Do Not": (100, 150),
+}
+
+WORDS = (
+    "playful curious gentle loyal bouncy calm brave cuddly clever sunny mischievous thoughtful "
+    "zooms naps sniffs explores greets watches wiggles follows guards trots purrs wags "
+    "every morning with friends around the garden near the window on long walks after dinner"
+).split()
+
+PET_RE = re.compile(r"^\s*PET\s+(\d+):", re.MULTILINE)
+
+# Characters per streamed chunk (about four tokens)
+STREAM_CHUNK_CHARS = 16
+
+app = FastAPI()
+
+
+def section_text(rng, min_length, max_length):
+    target = rng.randint(min_length, max_length)
+    words = []
+    length = 0
+    while length < target - 8:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    text = " ".join(words).capitalize()
+    return text[:max_length - 1].rstrip() + "."
+
+
+@lru_cache(maxsize=4096)
+def fake_completion(prompt):
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+    pets = len(PET_RE.findall(prompt)) or 1
+    blocks = []
+    for index in range(1, pets + 1):
+        sections = [
+            f"[{name}]\n{section_text(rng, low, high)}" for name, (low, high) in SECTION_LENGTHS.items()
+        ]
+        body = "\n\n".join(sections)
+        blocks.append(f"### PET {index}\n{body}" if pets > 1 else body)
+    return "\n\n".join(blocks)
+
+
+def count_tokens(text):
+    # Roughly four characters per token, close enough for usage accounting
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Per-minute limit refilled continuously, like the API's RPM/TPM limits."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def take(self, amount: float) -> float:
+        # Returns 0 when the request fits, otherwise the seconds until it would
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if amount <= self.tokens:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class FaultModel:
+    """Samples per-request latency and which failure (if any) to inject."""
+
+    def __init__(self, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.requests = TokenBucket(FAKE_OPENAI_RPM) if FAKE_OPENAI_RPM > 0 else None
+        self.tokens = TokenBucket(FAKE_OPENAI_TPM) if FAKE_OPENAI_TPM > 0 else None
+
+    def first_token_delay(self) -> float:
+        median = FAKE_OPENAI_LATENCY_MS / 1000
+        spread = FAKE_OPENAI_LATENCY_SPREAD
+        if FAKE_OPENAI_LATENCY_DIST == "uniform":
+            return max(0.0, self.rng.uniform(median - spread / 1000, median + spread / 1000))
+        if FAKE_OPENAI_LATENCY_DIST == "lognormal" and median > 0:
+            return self.rng.lognormvariate(math.log(median), spread)
+        return median
+
+    def limit_wait(self, total_tokens: int):
+        # (seconds to wait, which limit) when over a limit; a rejected request uses up nothing
+        if self.requests is not None:
+            wait = self.requests.take(1)
+            if wait > 0:
+                return wait, "requests"
+        if self.tokens is not None:
+            wait = self.tokens.take(total_tokens)
+            if wait > 0:
+                if self.requests is not None:
+                    self.requests.tokens += 1
+                return wait, "tokens"
+        return 0.0, None
+
+    def fault(self):
+        # One draw per request so the rates don't change each other's sequence
+        draw = self.rng.random()
+        if draw < FAKE_OPENAI_ERROR_RATE:
+            return "error"
+        draw -= FAKE_OPENAI_ERROR_RATE
+        if draw < FAKE_OPENAI_RATE_LIMIT_RATE:
+            return "rate_limit"
+        draw -= FAKE_OPENAI_RATE_LIMIT_RATE
+        if draw < FAKE_OPENAI_TRUNCATE_RATE:
+            return "truncate"
+        return None
+
+
+faults = FaultModel(FAKE_OPENAI_SEED)
+
+stats = {
+    "requests": 0,
+    "completions": 0,
+    "streams": 0,
+    "errors": 0,
+    "rate_limited": 0,
+    "truncated": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+}
+
+
+def error_response(status, message, error_type, code, headers=None):
+    return JSONResponse(
+        {"error": {"message": message, "type": error_type, "param": None, "code": code}},
+        status_code=status,
+        headers=headers
+    )
+
+
+def rate_limit_response(retry_after, limit):
+    stats["rate_limited"] += 1
+    return error_response(
+        429, f"Rate limit reached for {limit}. Please try again in {retry_after:.3f}s.", limit, "rate_limit_exceeded",
+        headers={"retry-after": str(math.ceil(retry_after)), "retry-after-ms": str(int(retry_after * 1000))}
+    )
+
+
+def completion_body(completion_id, model, content, prompt_tokens, finish_reason):
+    completion_tokens = count_tokens(content)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0, "finish_reason": finish_reason, "message": {"role": "assistant", "content": content}
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def stream_events(completion_id, model, content, prompt_tokens, finish_reason, include_usage, delay):
+    def chunk(delta, finish=None, usage=None):
+        body = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}] if usage is None else [],
+        }
+        if usage is not None:
+            body["usage"] = usage
+        return f"data: {json.dumps(body)}\n\n"
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield chunk({"role": "assistant", "content": ""})
+        # Paced against the start time rather than per chunk, so sleep overhead doesn't add up
+        started = loop.time()
+        sent = 0
+        for start in range(0, len(content), STREAM_CHUNK_CHARS):
+            if FAKE_OPENAI_TOKENS_PER_SECOND > 0:
+                due = started + sent / FAKE_OPENAI_TOKENS_PER_SECOND
+                if due > loop.time():
+                    await asyncio.sleep(due - loop.time())
+            piece = content[start:start + STREAM_CHUNK_CHARS]
+            sent += len(piece) / 4
+            yield chunk({"content": piece})
+        yield chunk({}, finish=finish_reason)
+        if include_usage:
+            completion_tokens = count_tokens(content)
+            yield chunk(None, usage={
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            })
+        yield "data: [DONE]\n\n"
+
+    return events()
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    messages = body.get("messages") or []
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    model = body.get("model", "fake")
+    content = fake_completion(str(messages[-1].get("content", "")) if messages else "")
+    prompt_tokens = count_tokens(prompt)
+
+    # Account limits are checked before anything else, as the real API does
+    wait, limit = faults.limit_wait(prompt_tokens + count_tokens(content))
+    if wait > 0:
+        return rate_limit_response(wait, limit)
+
+    fault = faults.fault()
+    delay = faults.first_token_delay()
+    if fault == "rate_limit":
+        return rate_limit_response(1.0, "requests")
+    if fault == "error":
+        stats["errors"] += 1
+        await asyncio.sleep(delay)
+        return error_response(500, "The server had an error while processing your request.", "server_error", None)
+
+    finish_reason = "stop"
+    if fault == "truncate":
+        # Cut somewhere in the second half: some sections are missing, like a max_tokens cutoff
+        stats["truncated"] += 1
+        content = content[:faults.rng.randint(len(content) // 2, len(content) - 1)]
+        finish_reason = "length"
+
+    completion_id = "chatcmpl-" + hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:24]
+    stats["prompt_tokens"] += prompt_tokens
+    stats["completion_tokens"] += count_tokens(content)
+    if body.get("stream"):
+        stats["streams"] += 1
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        return StreamingResponse(
+            stream_events(completion_id, model, content, prompt_tokens, finish_reason, include_usage, delay),
+            media_type="text/event-stream"
+        )
+
+    if FAKE_OPENAI_TOKENS_PER_SECOND > 0:
+        delay += count_tokens(content) / FAKE_OPENAI_TOKENS_PER_SECOND
+    if delay > 0:
+        await asyncio.sleep(delay)
+    stats["completions"] += 1
+    return JSONResponse(completion_body(completion_id, model, content, prompt_tokens, finish_reason))
+
+
+@app.get("/health")
+async def health_check():
+    return {
+        "status": "healthy",
+        "config": {
+            "latency_dist": FAKE_OPENAI_LATENCY_DIST,
+            "latency_ms": FAKE_OPENAI_LATENCY_MS,
+            "latency_spread": FAKE_OPENAI_LATENCY_SPREAD,
+            "tokens_per_second": FAKE_OPENAI_TOKENS_PER_SECOND,
+            "error_rate": FAKE_OPENAI_ERROR_RATE,
+            "rate_limit_rate": FAKE_OPENAI_RATE_LIMIT_RATE,
+            "truncate_rate": FAKE_OPENAI_TRUNCATE_RATE,
+            "rpm": FAKE_OPENAI_RPM,
+            "tpm": FAKE_OPENAI_TPM,
+            "seed": FAKE_OPENAI_SEED,
+        },
+        "stats": stats,
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+    port = int(os.getenv("FAKE_OPENAI_PORT", "8010"))
+    host = os.getenv("HOST", "127.0.0.1")
+    # Several workers for very high request rates; each has its own limits and random sequence
+    uvicorn.run("fake_openai:app", app_dir=os.path.dirname(os.path.abspath(__file__)), host=host, port=port,
+                workers=FAKE_OPENAI_WORKERS, log_level="warning")
@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+def cache_key(input_data: Dict[str, Any], mbti_description: str, prompt_version: str, model: str) -> str:
+    # Only what reaches the prompt. Scores only get there as the band text in mbti_description, so
+    # keying on that text puts every score in the same band on one entry and never mixes two bands
+    normalized = {
+        "pet_name": str(input_data["pet_name"]).strip(),
+        "pet_type": str(input_data["pet_type"]).strip(),
+        "pet_breed": str(input_data["pet_breed"]).strip(),
+        "mbti_description": mbti_description,
+        "prompt_version": prompt_version,
+        "model": model,
+    }
+    encoded = json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CompletionCache:
+    """Two-tier cache (in-process LRU, then Redis) for raw completion text, keyed on the normalized input."""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 86400, redis_url: Optional[str] = None,
+                 redis_ttl: float = 7 * 86400, key_prefix: str = "ai_cache:"):
+        self.memory = LRUCache(max_size, ttl)
+        self.redis_url = redis_url
+        self.redis_ttl = redis_ttl
+        self.key_prefix = key_prefix
+        self._redis = None
+        # Identical requests that arrive while the first one is still running share its result
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.counters = {"memory_hits": 0, "redis_hits": 0, "inflight_hits": 0, "misses": 0, "redis_errors": 0}
+
+    def _get_redis(self):
+        if self._redis is None and self.redis_url:
+            import redis.asyncio as aioredis
+            self._redis = aioredis.from_url(self.redis_url, decode_responses=True)
+        return self._redis
+
+    async def _redis_get(self, key: str) -> Optional[str]:
+        client = self._get_redis()
+        if client is None:
+            return None
+        try:
+            return await client.get(self.key_prefix + key)
+        except Exception as e:
+            self.counters["redis_errors"] += 1
+            print(f"AI cache redis get failed: {e}")
+            return None
+
+    async def _redis_set(self, key: str, value: str):
+        client = self._get_redis()
+        if client is None:
+            return
+        try:
+            await client.set(self.key_prefix + key, value, ex=int(self.redis_ttl))
+        except Exception as e:
+            self.counters["redis_errors"] += 1
+            print(f"AI cache redis set failed: {e}")
+
+    async def get(self, key: str) -> Tuple[Optional[str], str]:
+        # Plain lookup for callers that produce the value themselves (e.g. streaming); source is "miss" on a miss
+        value = self.memory.get(key)
+        if value is not None:
+            self.counters["memory_hits"] += 1
+            return value, "memory"
+        value = await self._redis_get(key)
+        if value is not None:
+            self.counters["redis_hits"] += 1
+            self.memory.set(key, value)
+            return value, "redis"
+        self.counters["misses"] += 1
+        return None, "miss"
+
+    async def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        await self._redis_set(key, value)
+
+    async def get_or_create(self, key: str, create: Callable[[], Awaitable[str]]) -> Tuple[str, str]:
+        # Returns (value, source) where source is "memory", "redis", "inflight" or "miss"
+        value = self.memory.get(key)
+        if value is not None:
+            self.counters["memory_hits"] += 1
+            return value, "memory"
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                value = await asyncio.shield(inflight)
+                self.counters["inflight_hits"] += 1
+                return value, "inflight"
+            except asyncio.CancelledError:
+                # The request we were piggybacking on went away; run our own unless we were cancelled too
+                if not inflight.cancelled():
+                    raise
+                return await self.get_or_create(key, create)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._redis_get(key)
+            if value is not None:
+                self.counters["redis_hits"] += 1
+                source = "redis"
+            else:
+                self.counters["misses"] += 1
+                source = "miss"
+                value = await create()
+                await self._redis_set(key, value)
+            self.memory.set(key, value)
+            future.set_result(value)
+            return value, source
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            # Waiters get the same failure; nothing is cached
+            future.set_exception(e)
+            # Avoid "exception was never retrieved" warnings when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = sum(self.counters.values()) - self.counters["redis_errors"]
+        hits = lookups - self.counters["misses"]
+        return {
+            **self.counters,
+            "memory_entries": len(self.memory),
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "redis_enabled": bool(self.redis_url),
+        }
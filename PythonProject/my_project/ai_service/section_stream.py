@@ -0,0 +1,72 @@
+from typing import Dict, List, Sequence, Tuple
+
+
+class SectionStreamParser:
+    """Incrementally finds "[Section Name]" blocks in a completion as it streams in.
+
+    A section is reported as soon as the blank line that ends it has arrived, using the same boundaries as
+    extract_section: the text starts on the line after the header and runs to the next "\\n\\n" (or the end of
+    the completion). Each section is reported once, and scanning resumes where the previous chunk left off
+    instead of searching the whole completion again.
+    """
+
+    def __init__(self, section_names: Sequence[str]):
+        self._text = ""
+        self._state: Dict[str, Dict[str, int]] = {
+            name: {"search_from": 0, "header": -1, "start": -1, "end_search_from": -1}
+            for name in section_names
+        }
+        self._emitted: Dict[str, str] = {}
+
+    def _advance(self, name: str, state: Dict[str, int], final: bool):
+        text = self._text
+        header = f"[{name}]"
+        if state["header"] == -1:
+            position = text.find(header, state["search_from"])
+            if position == -1:
+                # The header may be split across chunks, so keep a short overlap
+                state["search_from"] = max(0, len(text) - len(header) + 1)
+                return None
+            state["header"] = position
+
+        if state["start"] == -1:
+            newline = text.find("\n", state["header"])
+            if newline == -1:
+                return None
+            state["start"] = newline + 1
+            state["end_search_from"] = newline + 1
+
+        end = text.find("\n\n", state["end_search_from"])
+        if end == -1:
+            if not final:
+                state["end_search_from"] = max(state["start"], len(text) - 1)
+                return None
+            end = len(text)
+        return text[state["start"]:end].strip()
+
+    def _collect(self, final: bool) -> List[Tuple[str, str]]:
+        completed = []
+        for name, state in self._state.items():
+            if name in self._emitted:
+                continue
+            section = self._advance(name, state, final)
+            if section is not None:
+                self._emitted[name] = section
+                completed.append((name, section))
+        # Report in the order the sections appear in the completion
+        completed.sort(key=lambda item: self._state[item[0]]["header"])
+        return completed
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        if not chunk:
+            return []
+        self._text += chunk
+        return self._collect(final=False)
+
+    def finish(self) -> List[Tuple[str, str]]:
+        # Sections still open when the stream ends run to the end of the completion
+        return self._collect(final=True)
+
+    @property
+    def text(self) -> str:
+        return self._text
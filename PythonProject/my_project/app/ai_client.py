@@ -0,0 +1,124 @@
+import os
+import random
+import threading
+import time
+from typing import Dict, Any, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from config import (
+    AI_SERVER_URL, AI_CONNECT_TIMEOUT, AI_READ_TIMEOUT, AI_MAX_CONCURRENCY,
+    AI_MAX_RETRIES, AI_RETRY_BACKOFF, AI_RETRY_BACKOFF_MAX
+)
+from instrumentation import AI_HTTP_SECONDS, AI_HTTP_RETRIES
+from tracing import current_traceparent, tracer
+
+# 和 tasks.request_ai 视为可重试的集合一致；500 等其他错误重试也不会好，直接返回给调用方
+RETRYABLE_STATUS = (502, 503, 504)
+RETRYABLE_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+class AIServiceClient:
+    """每个 worker 进程一个到 AI 服务的 HTTP 客户端：复用 keep-alive 连接、限制并发、只对网关错误、连接错误和超时重试。"""
+
+    def __init__(self, base_url: str, connect_timeout: float = 3.0, read_timeout: float = 30.0,
+                 max_concurrency: int = 8, max_retries: int = 2, backoff: float = 0.5, backoff_max: float = 8.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._session: Optional[requests.Session] = None
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._pid: Optional[int] = None
+        self._retries = 0
+        self._failures = 0
+
+    def _get_session(self) -> requests.Session:
+        # prefork 子进程不能共用父进程的 socket，按 pid 重新创建
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=0)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+                    self._slots = threading.BoundedSemaphore(self.max_concurrency)
+                    self._pid = os.getpid()
+        return self._session
+
+    def _sleep_before_retry(self, attempt: int):
+        # full jitter：在 [0, min(上限, backoff * 2^attempt)] 之间随机等待
+        time.sleep(random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt))))
+        AI_HTTP_RETRIES.inc()
+        with self._lock:
+            self._retries += 1
+
+    def post(self, path: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        session = self._get_session()
+        try:
+            with tracer.span("ai.call", path=path) as call_span, self._slots:
+                for attempt in range(self.max_retries + 1):
+                    attempt_started = time.perf_counter()
+                    try:
+                        response = self._send(session, path, payload, headers, attempt)
+                    except RETRYABLE_ERRORS as e:
+                        AI_HTTP_SECONDS.labels(
+                            "timeout" if isinstance(e, requests.exceptions.Timeout) else "connection_error"
+                        ).observe(time.perf_counter() - attempt_started)
+                        if attempt == self.max_retries:
+                            raise
+                        self._sleep_before_retry(attempt)
+                        continue
+                    AI_HTTP_SECONDS.labels(f"{response.status_code // 100}xx").observe(
+                        time.perf_counter() - attempt_started
+                    )
+                    if response.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                        response.close()
+                        self._sleep_before_retry(attempt)
+                        continue
+                    if response.status_code >= 500:
+                        with self._lock:
+                            self._failures += 1
+                    call_span.set(attempts=attempt + 1, status_code=response.status_code)
+                    return response
+        except Exception:
+            with self._lock:
+                self._failures += 1
+            raise
+
+    def _send(self, session: requests.Session, path: str, payload: Dict[str, Any],
+              headers: Optional[Dict[str, str]], attempt: int) -> requests.Response:
+        # 每次尝试一个 span；traceparent 指向这次尝试，AI 服务那边的 span 挂在它下面
+        with tracer.span("ai.http", attempt=attempt) as span:
+            traceparent = current_traceparent()
+            if traceparent is not None:
+                headers = {**(headers or {}), "traceparent": traceparent}
+            response = session.post(f"{self.base_url}{path}", json=payload, headers=headers, timeout=self.timeout)
+            span.set(status_code=response.status_code)
+            return response
+
+    def analyze(self, ai_input: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        return self.post("/ai", {"input_data": ai_input}, headers=headers)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            retries, failures = self._retries, self._failures
+        return {
+            "max_concurrency": self.max_concurrency,
+            "retries": retries,
+            "failures": failures
+        }
+
+
+ai_client = AIServiceClient(
+    AI_SERVER_URL,
+    connect_timeout=AI_CONNECT_TIMEOUT,
+    read_timeout=AI_READ_TIMEOUT,
+    max_concurrency=AI_MAX_CONCURRENCY,
+    max_retries=AI_MAX_RETRIES,
+    backoff=AI_RETRY_BACKOFF,
+    backoff_max=AI_RETRY_BACKOFF_MAX
+)
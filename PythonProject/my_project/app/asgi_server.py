@@ -0,0 +1,204 @@
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+import asyncpg
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from config import DB_CONFIG, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, RESULT_CACHE_CONTROL
+from instrumentation import DB_CONNECT_SECONDS, DB_QUERY_SECONDS, HTTP_REQUEST_SECONDS, log_event, metrics_response
+from mbti_calculator import DIMENSIONS
+from percentile_index import percentile_index
+from prior_tables import prior_tables
+from scheduler import queue_depths
+from submission_cache import submission_cache
+from tasks import process_ai_task
+from tracing import tracer
+
+# server.py 的 ASGI 版本：/receive_data 和 /get_result 的请求和响应格式不变，
+# 数据库用 asyncpg 连接池，等待 Postgres 和 Redis 时不占用线程。
+#   python asgi_server.py    （默认端口 5002，可和 Flask 版本同时运行做对比）
+
+pool: Optional[asyncpg.Pool] = None
+
+# json_populate_record 按 survey_data 的列类型转换每个字段，和 psycopg2 传字面量的效果一致
+INSERT_SURVEY_SQL = """
+    INSERT INTO survey_data (
+        email, ip, pet_type, pet_name, pet_breed,
+        pet_gender, pet_age, personality_behavior
+    )
+    SELECT email, ip, pet_type, pet_name, pet_breed,
+           pet_gender, pet_age, personality_behavior
+    FROM json_populate_record(NULL::survey_data, $1::json)
+    RETURNING submission_id;
+"""
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global pool
+    pool = await asyncpg.create_pool(
+        database=DB_CONFIG["dbname"],
+        user=DB_CONFIG["user"],
+        password=DB_CONFIG["password"],
+        host=DB_CONFIG["host"],
+        port=int(DB_CONFIG["port"]),
+        min_size=DB_POOL_MIN,
+        max_size=DB_POOL_MAX,
+    )
+    # 每个 worker 启动时就开始建百分位索引，不等第一次 /percentiles 请求
+    percentile_index.start()
+    try:
+        yield
+    finally:
+        await pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # 按路由模板统计（/get_result/{submission_id}），不按具体 id
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.labels(
+        route.path if route is not None else "unmatched", request.method, response.status_code
+    ).observe(time.perf_counter() - started)
+    return response
+
+
+@asynccontextmanager
+async def acquire(query: str):
+    # 取连接和执行语句分开计时，与 Flask 版本的 db_connect_seconds / db_query_seconds 对应
+    started = time.perf_counter()
+    async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        waited = time.perf_counter() - started
+        DB_CONNECT_SECONDS.observe(waited)
+        now = time.time()
+        tracer.record("db.connect", now - waited, now)
+        with tracer.span(f"db.{query}"), DB_QUERY_SECONDS.labels(query).time():
+            yield conn
+
+
+async def enqueue(submission_id: int):
+    # Celery 的 apply_async 是阻塞调用，放到线程池里执行，不阻塞事件循环（to_thread 会带上当前 trace）
+    with tracer.span("celery.enqueue", count=1):
+        await asyncio.to_thread(process_ai_task.delay, submission_id)
+
+
+@app.post("/receive_data")
+async def receive_data(request: Request):
+    data = await request.json()
+    with tracer.span("receive_data", root=True, ingest_mode="asgi") as span:
+        # 1. Store Data in PostgreSQL
+        record = {
+            "email": data["survey_data"]["user_info"]["email"],
+            "ip": data["survey_data"]["user_info"]["ip"],
+            "pet_type": data["survey_data"]["pet_info"]["PetSpecies"],
+            "pet_name": data["survey_data"]["pet_info"]["PetName"],
+            "pet_breed": data["survey_data"]["pet_info"]["PetBreed"],
+            "pet_gender": data["survey_data"]["pet_info"]["PetGender"],
+            "pet_age": data["survey_data"]["pet_info"]["PetAge"],
+            "personality_behavior": data["survey_data"]["personality_and_behavior"],
+        }
+        async with acquire("insert_surveys") as conn:
+            submission_id = await conn.fetchval(INSERT_SURVEY_SQL, json.dumps(record))
+
+        # 2. Queue Task for Celery to Process AI
+        await enqueue(submission_id)
+        span.set(submission_id=submission_id, pet_type=record["pet_type"])
+
+    log_event("receive_data", submission_id=submission_id, pet_type=record["pet_type"], ingest_mode="asgi",
+              trace_id=span.context.trace_id if span.context is not None else None)
+    return JSONResponse({"status": "processing", "submission_id": submission_id}, status_code=202)
+
+
+def completed_response(entry, request: Request):
+    # 结果生成后不会再变，带上 ETag 让浏览器可以用 If-None-Match 复用
+    headers = {"ETag": f'"{entry["etag"]}"', "Cache-Control": RESULT_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    tags = [tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")]
+    if entry["etag"] in tags or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse({
+        "status": "completed",
+        "ai_output": {
+            "text": entry["text"],
+            "generated_at": entry["generated_at"]
+        }
+    }, headers=headers)
+
+
+@app.get("/get_result/{submission_id}")
+async def get_result(submission_id: int, request: Request):
+    # 和 Flask 版一样先查结果缓存（进程内LRU + Redis层），未命中再查库并回填；Redis 是同步客户端，放到线程里
+    entry = await asyncio.to_thread(submission_cache.get, submission_id)
+    if entry is None:
+        async with acquire("fetch_result") as conn:
+            result = await conn.fetchrow("""
+                SELECT ai_output_text, generated_at
+                FROM survey_data
+                WHERE submission_id = $1;
+            """, submission_id)
+        log_event("get_result", submission_id=submission_id, completed=bool(result and result["ai_output_text"]))
+        if not result or not result["ai_output_text"]:
+            return JSONResponse({"status": "processing"}, status_code=202, headers={"Cache-Control": "no-store"})
+        generated_at = result["generated_at"].isoformat() if result["generated_at"] else None
+        entry = await asyncio.to_thread(submission_cache.set, submission_id, result["ai_output_text"], generated_at)
+
+    return completed_response(entry, request)
+
+
+@app.get("/percentiles/{submission_id}")
+async def get_percentiles(submission_id: int):
+    async with acquire("fetch_scores") as conn:
+        row = await conn.fetchrow("""
+            SELECT pet_type, pet_breed, mbti_e_i, mbti_s_n, mbti_t_f, mbti_j_p
+            FROM survey_data
+            WHERE submission_id = $1;
+        """, submission_id)
+    if not row:
+        return JSONResponse({"status": "error", "error": "Submission not found"}, status_code=404)
+    scores = [row["mbti_e_i"], row["mbti_s_n"], row["mbti_t_f"], row["mbti_j_p"]]
+    if any(score is None for score in scores):
+        return JSONResponse({"status": "processing"}, status_code=202, headers={"Cache-Control": "no-store"})
+
+    # 索引查询是纯内存的二分查找，直接在事件循环里执行
+    percentiles = percentile_index.lookup(dict(zip(DIMENSIONS, scores)), row["pet_type"], row["pet_breed"])
+    if percentiles is None:
+        return JSONResponse({"status": "unavailable"}, status_code=503, headers={"Retry-After": "5"})
+    return {"status": "completed", "percentiles": percentiles}
+
+
+@app.get("/metrics")
+async def metrics():
+    # 队列长度在抓取时从 broker 读
+    await asyncio.to_thread(queue_depths)
+    body, content_type = metrics_response()
+    return Response(body, headers={"Content-Type": content_type})
+
+
+@app.get("/health")
+async def health_check():
+    return {
+        "status": "healthy",
+        "db_pool": {
+            "max_size": pool.get_max_size(),
+            "size": pool.get_size(),
+            "idle": pool.get_idle_size(),
+        },
+        "percentile_index": percentile_index.stats(),
+        "prior_tables": prior_tables.stats(),
+        "tracing": tracer.stats(),
+        "queues": await asyncio.to_thread(queue_depths)
+    }
+
+
+if __name__ == "__main__":
+    import os
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("ASGI_PORT", "5002")))
@@ -0,0 +1,184 @@
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from instrumentation import log_event
+
+# 把用户填写的品种名解析成品种分数表里的品种：规范化后精确匹配 -> 别名表 -> 三元组模糊匹配。
+# 混血（"Lab mix"、"Golden Retriever / Poodle"、"Goldendoodle"）解析成几个亲本品种。
+# 每个物种一个解析器；其他物种的宠物直接返回 other_species，不查表。
+
+# 表示混血的词，出现时按混血处理
+MIXED_WORDS = {"mix", "mixed", "mutt", "cross", "crossbreed", "crossbred", "hybrid", "x"}
+# 用户不知道品种时常填的内容
+UNKNOWN_KEYS = {"unknown", "not sure", "dont know", "idk", "none", "other", "na", "n a", "no idea"}
+# 可以省略的词："German Shepherd Dog" 和 "German Shepherd" 视为同一个品种
+OPTIONAL_WORDS = {"dog", "breed"}
+# 混血品种名中分隔亲本的写法
+MIX_SEPARATORS = re.compile(r"\s*(?:/|&|\+|,|\band\b|\bx\b|\bmix(?:ed)?\b|\bcross(?:bred|breed)?\b)\s*")
+
+
+def canonical_key(name: str) -> str:
+    # 去掉重音、忽略大小写，标点和连字符都当作空格："Golden-retriever " -> "golden retriever"
+    text = unicodedata.normalize("NFKD", str(name))
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    return " ".join(re.findall(r"[^\W_]+", text))
+
+
+def key_variants(key: str) -> List[str]:
+    # 同一个名字的几种等价写法：原样、去掉可省略的词、单词排序后（"Retriever Golden"）
+    words = key.split()
+    core = [word for word in words if word not in OPTIONAL_WORDS] or words
+    variants = [key, " ".join(core), " ".join(sorted(core))]
+    return list(dict.fromkeys(variants))
+
+
+def trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Resolution(NamedTuple):
+    # exact / alias / fuzzy / mixed / unknown / ambiguous / empty / other_species
+    kind: str
+    breeds: Tuple[str, ...]
+    confidence: float
+
+
+class BreedResolver:
+    """启动（或分数表重新加载）时构建一次；之后每个不同的输入只解析一次，结果缓存，重复查询只需一次字典查询。"""
+
+    def __init__(self, breeds: Iterable[str], aliases: Optional[Dict[str, Sequence[str]]] = None,
+                 threshold: float = 0.6, margin: float = 0.05, cache_size: int = 10000, log_decisions: bool = True,
+                 species: str = "Dog"):
+        self.breeds = list(dict.fromkeys(breeds))
+        self.species = species
+        self.threshold = threshold
+        self.margin = margin
+        self.cache_size = cache_size
+        self.log_decisions = log_decisions
+        self._exact: Dict[str, str] = {}
+        self._aliases: Dict[str, Tuple[str, ...]] = {}
+        for breed in self.breeds:
+            for variant in key_variants(canonical_key(breed)):
+                self._exact.setdefault(variant, breed)
+        for alias, targets in (aliases or {}).items():
+            targets = tuple(target for target in targets if target in self._exact.values())
+            if targets:
+                for variant in key_variants(canonical_key(alias)):
+                    self._aliases.setdefault(variant, targets)
+
+        # 模糊匹配的候选：品种名和别名，三元组倒排索引
+        self._candidates: List[Tuple[str, Tuple[str, ...], str]] = []
+        for breed in self.breeds:
+            self._candidates.append((canonical_key(breed), (breed,), "fuzzy"))
+        for key, targets in self._aliases.items():
+            self._candidates.append((key, targets, "fuzzy" if len(targets) == 1 else "mixed"))
+        self._sizes: List[int] = []
+        self._index: Dict[str, List[int]] = {}
+        for i, (key, _, _) in enumerate(self._candidates):
+            grams = trigrams(key)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._index.setdefault(gram, []).append(i)
+
+        self._cache: Dict[Tuple[str, str], Resolution] = {}
+        self._lock = threading.Lock()
+        self.decisions = Counter()
+
+    def resolve(self, breed: Optional[str], pet_type: Optional[str] = None) -> Resolution:
+        # pet_type 为 None 时视为本解析器的物种
+        pet_type = self.species if pet_type is None else pet_type
+        cache_key = (pet_type, breed or "")
+        resolution = self._cache.get(cache_key)
+        if resolution is None:
+            resolution = self._resolve(breed, pet_type)
+            with self._lock:
+                if len(self._cache) >= self.cache_size:
+                    # 先进先出淘汰，防止异常输入撑爆内存
+                    self._cache.pop(next(iter(self._cache)))
+                self._cache[cache_key] = resolution
+            if self.log_decisions and resolution.kind not in ("exact", "empty", "other_species"):
+                # 只在缓存未命中时记录，每个新写法最多一次，仍然抽样
+                log_event("breed_resolution", species=self.species, breed=breed, breeds=list(resolution.breeds),
+                          kind=resolution.kind, confidence=round(resolution.confidence, 2))
+        with self._lock:
+            self.decisions[resolution.kind] += 1
+        return resolution
+
+    def _resolve(self, breed: Optional[str], pet_type: str) -> Resolution:
+        if str(pet_type).strip().casefold() != self.species.casefold():
+            # 这张表不是这个物种的，不查表
+            return Resolution("other_species", (), 1.0)
+        key = canonical_key(breed) if breed else ""
+        if not key:
+            return Resolution("empty", (), 1.0)
+        if key in UNKNOWN_KEYS:
+            return Resolution("unknown", (), 1.0)
+
+        single = self._match(key)
+        if single is not None and single.kind != "fuzzy":
+            return single
+        words = set(key.split())
+        if words & MIXED_WORDS or re.search(r"[/&+,]", breed):
+            return self._resolve_mixed(breed)
+        if single is not None:
+            return single
+        return Resolution("unknown", (), 0.0)
+
+    def _match(self, key: str) -> Optional[Resolution]:
+        for variant in key_variants(key):
+            if variant in self._exact:
+                return Resolution("exact", (self._exact[variant],), 1.0)
+        for variant in key_variants(key):
+            if variant in self._aliases:
+                targets = self._aliases[variant]
+                return Resolution("alias" if len(targets) == 1 else "mixed", targets, 1.0)
+        return self._fuzzy(key)
+
+    def _fuzzy(self, key: str) -> Optional[Resolution]:
+        # Dice 系数：2 * 共同三元组数 / (两边三元组数之和)，只看至少共享一个三元组的候选
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            for i in self._index.get(gram, ()):
+                shared[i] += 1
+        if not shared:
+            return None
+        scored = sorted(
+            ((2.0 * count / (len(grams) + self._sizes[i]), i) for i, count in shared.items()),
+            reverse=True
+        )
+        best_score, best = scored[0]
+        if best_score < self.threshold:
+            return None
+        _, targets, kind = self._candidates[best]
+        # 第二名是别的品种且分数几乎一样时不猜
+        for score, i in scored[1:]:
+            if best_score - score > self.margin:
+                break
+            if self._candidates[i][1] != targets:
+                return Resolution("ambiguous", (), round(best_score, 3))
+        return Resolution(kind, targets, round(best_score, 3))
+
+    def _resolve_mixed(self, breed: str) -> Resolution:
+        # "Lab mix" -> Labrador Retriever；"Golden Retriever / Poodle" -> 两个亲本；认不出亲本时只用行为分数
+        parents: List[str] = []
+        confidence = 1.0
+        for part in MIX_SEPARATORS.split(breed):
+            key = canonical_key(part)
+            if not key or key in MIXED_WORDS or key in UNKNOWN_KEYS:
+                continue
+            match = self._match(key)
+            if match is None or not match.breeds:
+                continue
+            confidence = min(confidence, match.confidence)
+            parents.extend(parent for parent in match.breeds if parent not in parents)
+        if not parents:
+            return Resolution("mixed", (), 0.0)
+        return Resolution("mixed", tuple(parents), confidence)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {"cached": len(self._cache), "decisions": dict(self.decisions)}
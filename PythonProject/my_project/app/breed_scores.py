@@ -0,0 +1,239 @@
+import csv
+import glob
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from breed_resolver import BreedResolver, Resolution
+
+# CSV列与MBTI维度的对应关系
+DIMENSION_COLUMNS = {
+    "E/I": "m_score",
+    "S/N": "b_score",
+    "T/F": "t_score",
+    "J/P": "i_score"
+}
+
+# 最多记录多少个不同的未知品种名，防止异常输入撑爆内存
+MAX_UNKNOWN_BREEDS = 1000
+
+
+def normalize_breed(breed: str) -> str:
+    # 去掉首尾空格、合并中间空格并忽略大小写
+    return " ".join(str(breed).split()).casefold()
+
+
+def load_aliases(path: Optional[str]) -> Dict[str, Tuple[str, ...]]:
+    # 别名表：alias,breed；混血品种的 breed 用 | 分隔多个亲本
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, newline="", encoding="utf-8") as f:
+        return {row["alias"]: tuple(row["breed"].split("|")) for row in csv.DictReader(f)}
+
+
+def file_mtime(path: Optional[str]) -> Optional[float]:
+    return os.stat(path).st_mtime if path and os.path.exists(path) else None
+
+
+def read_score_csv(path: str) -> Tuple[List[str], np.ndarray]:
+    # 品种名列表和 (品种数, 4) 的分数矩阵，列顺序同 DIMENSION_COLUMNS
+    names: List[str] = []
+    rows: List[List[float]] = []
+    seen = set()
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            breed = row["breed"].strip()
+            # 与原来的 .iloc[0] 一致：重复品种取第一行
+            if breed in seen:
+                continue
+            seen.add(breed)
+            names.append(breed)
+            rows.append([float(row[column]) for column in DIMENSION_COLUMNS.values()])
+    return names, np.array(rows, dtype=np.float64).reshape(len(rows), len(DIMENSION_COLUMNS))
+
+
+class BreedScoreRegistry:
+    """进程内的品种分数表：首次查询时才加载，用 BreedResolver 把填写的品种名解析成表里的品种，CSV修改后在后台重新加载。
+
+    分数存成一个 (品种数, 4) 的 float64 矩阵加品种名到行号的字典。品种数达到 mmap_min_rows 时，
+    解析结果以 .npy 缓存在 cache_dir（文件名带 CSV 的修改时间和大小），之后各进程直接内存映射，不再解析 CSV。
+    """
+
+    def __init__(self, csv_path: str, reload_interval: float = 30.0, aliases_path: Optional[str] = None,
+                 match_threshold: float = 0.6, species: str = "Dog", mmap_min_rows: int = 5000,
+                 cache_dir: Optional[str] = None):
+        self.csv_path = csv_path
+        self.aliases_path = aliases_path
+        self.match_threshold = match_threshold
+        self.reload_interval = reload_interval
+        self.species = species
+        self.mmap_min_rows = mmap_min_rows
+        self.cache_dir = cache_dir
+        # (品种名 -> 行号, 分数矩阵)，整体替换
+        self._data: Tuple[Dict[str, int], np.ndarray] = ({}, np.empty((0, len(DIMENSION_COLUMNS))))
+        self._mapped = False
+        self._load_seconds: Optional[float] = None
+        self._resolver: Optional[BreedResolver] = None
+        self._mtime: Optional[Tuple[float, Optional[float]]] = None
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._watcher_pid: Optional[int] = None
+        self._stop = threading.Event()
+        self._hits = 0
+        self._misses = 0
+        self._reloads = 0
+        self._unknown = Counter()
+
+    def _mtimes(self) -> Tuple[float, Optional[float]]:
+        return os.stat(self.csv_path).st_mtime, file_mtime(self.aliases_path)
+
+    def _load(self):
+        started = time.perf_counter()
+        mtime = self._mtimes()
+        names, matrix, mapped = self._read_table()
+        resolver = BreedResolver(names, load_aliases(self.aliases_path), threshold=self.match_threshold,
+                                 species=self.species)
+        # 整体替换引用，读者不需要加锁
+        self._data, self._resolver = ({name: i for i, name in enumerate(names)}, matrix), resolver
+        self._mapped = mapped
+        self._mtime = mtime
+        self._reloads += 1
+        self._load_seconds = round(time.perf_counter() - started, 4)
+        print(f"Loaded {self.species} breed scores: {len(names)} breeds in {self._load_seconds}s"
+              f"{' (memory-mapped)' if mapped else ''}")
+
+    def _cache_stem(self) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        stat = os.stat(self.csv_path)
+        name = os.path.splitext(os.path.basename(self.csv_path))[0]
+        return os.path.join(self.cache_dir, f"{name}-{stat.st_mtime_ns}-{stat.st_size}")
+
+    def _read_table(self) -> Tuple[List[str], np.ndarray, bool]:
+        stem = self._cache_stem()
+        if stem is not None and os.path.exists(stem + ".npy"):
+            # 其他进程已经转换过这个版本的 CSV
+            with open(stem + ".names.json", encoding="utf-8") as f:
+                names = json.load(f)
+            return names, np.load(stem + ".npy", mmap_mode="r"), True
+        names, matrix = read_score_csv(self.csv_path)
+        if stem is None or len(names) < self.mmap_min_rows:
+            return names, matrix, False
+        try:
+            self._write_cache(stem, names, matrix)
+        except OSError as e:
+            print(f"Error caching breed scores for {self.csv_path}: {str(e)}")
+            return names, matrix, False
+        return names, np.load(stem + ".npy", mmap_mode="r"), True
+
+    @staticmethod
+    def _write_cache(stem: str, names: List[str], matrix: np.ndarray):
+        # 先写临时文件再改名，.npy 出现时品种名文件一定已经写好
+        os.makedirs(os.path.dirname(stem), exist_ok=True)
+        prefix = stem.rsplit("-", 2)[0]
+        for old in glob.glob(glob.escape(prefix) + "-*-*.*"):
+            if not old.startswith(stem):
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        temp = f"{stem}.{os.getpid()}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(names, f, ensure_ascii=False)
+        os.replace(temp, stem + ".names.json")
+        with open(temp, "wb") as f:
+            np.save(f, matrix)
+        os.replace(temp, stem + ".npy")
+
+    def _ensure_loaded(self):
+        if self._mtime is None:
+            with self._load_lock:
+                if self._mtime is None:
+                    self._load()
+        # Celery prefork 子进程不会继承父进程的线程，按 pid 判断是否需要重新启动
+        if self.reload_interval > 0 and self._watcher_pid != os.getpid():
+            with self._load_lock:
+                if self._watcher_pid != os.getpid():
+                    self._start_watcher()
+
+    def _start_watcher(self):
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="breed-score-reloader", daemon=True)
+        self._watcher_pid = os.getpid()
+        self._watcher.start()
+
+    def _watch(self):
+        while not self._stop.wait(self.reload_interval):
+            try:
+                mtime = self._mtimes()
+                if mtime != self._mtime:
+                    with self._load_lock:
+                        self._load()
+            except (OSError, KeyError, ValueError) as e:
+                # 文件正在被替换或格式错误时保留旧的表，下次再试
+                print(f"Error reloading breed scores from {self.csv_path}: {str(e)}")
+
+    def stop(self):
+        self._stop.set()
+
+    def reload(self):
+        with self._load_lock:
+            self._load()
+
+    def resolve(self, breed: Optional[str], pet_type: Optional[str] = None) -> Resolution:
+        self._ensure_loaded()
+        return self._resolver.resolve(breed, pet_type)
+
+    def get_vector(self, breed: Optional[str], record: bool = True,
+                   pet_type: Optional[str] = None) -> Optional[Tuple[float, float, float, float]]:
+        # 混血取各亲本分数的平均；record=False 时不计入命中统计（例如只为计算输入哈希而查询）
+        self._ensure_loaded()
+        resolution = self._resolver.resolve(breed, pet_type)
+        if resolution.kind == "other_species":
+            return None
+        index, matrix = self._data
+        vectors = [matrix[index[parent]].tolist() for parent in resolution.breeds]
+        scores = tuple(sum(column) / len(vectors) for column in zip(*vectors)) if vectors else None
+        if not record:
+            return scores
+        with self._stats_lock:
+            if scores is None:
+                self._misses += 1
+                if breed and (breed in self._unknown or len(self._unknown) < MAX_UNKNOWN_BREEDS):
+                    self._unknown[breed] += 1
+            else:
+                self._hits += 1
+        return scores
+
+    def get(self, breed: str) -> Optional[Dict[str, float]]:
+        scores = self.get_vector(breed)
+        if scores is None:
+            return None
+        return dict(zip(DIMENSION_COLUMNS, scores))
+
+    def breeds(self):
+        self._ensure_loaded()
+        return list(self._data[0])
+
+    def stats(self) -> Dict[str, object]:
+        # 不触发加载：没用到这个物种的进程显示 loaded=False
+        index, matrix = self._data
+        with self._stats_lock:
+            return {
+                "species": self.species,
+                "loaded": self._mtime is not None,
+                "breeds": len(index),
+                "bytes": int(matrix.nbytes),
+                "mmap": self._mapped,
+                "load_seconds": self._load_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+                "reloads": self._reloads,
+                "loaded_mtime": self._mtime,
+                "unknown_breeds": dict(self._unknown.most_common(50)),
+                "resolver": self._resolver.stats() if self._resolver is not None else None
+            }
@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -12,11 +13,121 @@ DB_CONFIG = {
     "port": "5432"
 }
 
+# 数据库连接池配置（每个进程/每个Celery子进程一个池）
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv('DB_POOL_HEALTHCHECK_IDLE', '30'))
+
+# 提交入库方式：direct 每个请求单独插入；buffered 几毫秒内的请求合并成一次多行插入
+INGEST_MODE = os.getenv('INGEST_MODE', 'direct')
+INGEST_BATCH_MAX_SIZE = int(os.getenv('INGEST_BATCH_MAX_SIZE', '100'))
+INGEST_BATCH_WAIT_MS = float(os.getenv('INGEST_BATCH_WAIT_MS', '5'))
+INGEST_SUBMIT_TIMEOUT = float(os.getenv('INGEST_SUBMIT_TIMEOUT', '10'))
+RECEIVE_BATCH_MAX_SIZE = int(os.getenv('RECEIVE_BATCH_MAX_SIZE', '500'))
+
 # AI服务URL（在AWS上运行）
 AI_SERVER_URL = os.getenv('AI_SERVER_URL', 'http://localhost:8001')
 
+# AI服务HTTP客户端配置（每个worker进程共用一个连接池）
+# 读超时要大于AI服务的 OPENAI_TIMEOUT（默认60秒，是一次 /ai 请求的总时限），否则AI服务还在调用时 worker 就重试了
+AI_CONNECT_TIMEOUT = float(os.getenv('AI_CONNECT_TIMEOUT', '3'))
+AI_READ_TIMEOUT = float(os.getenv('AI_READ_TIMEOUT', '75'))
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '8'))
+AI_MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', '2'))
+AI_RETRY_BACKOFF = float(os.getenv('AI_RETRY_BACKOFF', '0.5'))
+AI_RETRY_BACKOFF_MAX = float(os.getenv('AI_RETRY_BACKOFF_MAX', '8'))
+
+# 批量AI任务：每个任务处理的提交数、失败后最多重试几次，以及定时分发积压提交的参数（间隔为0时不启用）
+AI_TASK_CHUNK_SIZE = int(os.getenv('AI_TASK_CHUNK_SIZE', '50'))
+AI_TASK_MAX_ATTEMPTS = int(os.getenv('AI_TASK_MAX_ATTEMPTS', '3'))
+PENDING_DISPATCH_INTERVAL = float(os.getenv('PENDING_DISPATCH_INTERVAL', '0'))
+PENDING_DISPATCH_MIN_AGE = float(os.getenv('PENDING_DISPATCH_MIN_AGE', '60'))
+PENDING_DISPATCH_REDISPATCH_AFTER = float(os.getenv('PENDING_DISPATCH_REDISPATCH_AFTER', '600'))
+PENDING_DISPATCH_LIMIT = int(os.getenv('PENDING_DISPATCH_LIMIT', '1000'))
+
+# AI任务队列：单条提交走交互式队列，批量回填走回填队列（worker 先取交互式队列）
+AI_INTERACTIVE_QUEUE = os.getenv('AI_INTERACTIVE_QUEUE', 'ai_interactive')
+AI_BACKFILL_QUEUE = os.getenv('AI_BACKFILL_QUEUE', 'ai_backfill')
+# 限流、AI服务暂时不可用时任务延后重试的次数和退避时间（秒）
+AI_TASK_MAX_RETRIES = int(os.getenv('AI_TASK_MAX_RETRIES', '5'))
+AI_TASK_RETRY_BACKOFF = float(os.getenv('AI_TASK_RETRY_BACKOFF', '2'))
+AI_TASK_RETRY_BACKOFF_MAX = float(os.getenv('AI_TASK_RETRY_BACKOFF_MAX', '300'))
+
+# OpenAI 限额：所有 worker 通过 Redis 共用的令牌桶，按模型的每分钟请求数和 token 数设置（0 表示不限制）。
+# 每次分析按 AI_ESTIMATED_TOKENS 个 token（提示词+输出）扣减；额度不够时最多等 AI_RATE_LIMIT_MAX_WAIT 秒，
+# 再久就延后重试。回填任务只用高于 AI_RATE_BACKFILL_RESERVE 比例的额度，其余留给交互式提交
+AI_RATE_LIMIT_RPM = int(os.getenv('AI_RATE_LIMIT_RPM', '500'))
+AI_RATE_LIMIT_TPM = int(os.getenv('AI_RATE_LIMIT_TPM', '200000'))
+AI_RATE_LIMIT_BURST_SECONDS = float(os.getenv('AI_RATE_LIMIT_BURST_SECONDS', '6'))
+AI_RATE_LIMIT_MAX_WAIT = float(os.getenv('AI_RATE_LIMIT_MAX_WAIT', '2'))
+AI_RATE_BACKFILL_RESERVE = float(os.getenv('AI_RATE_BACKFILL_RESERVE', '0.2'))
+AI_ESTIMATED_TOKENS = int(os.getenv('AI_ESTIMATED_TOKENS', '1200'))
+
+# 监控：热点路径的结构化日志抽样比例（1 表示全部输出），Celery worker 暴露 Prometheus 指标的端口（0 表示不开）
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+CELERY_METRICS_PORT = int(os.getenv('CELERY_METRICS_PORT', '9102'))
+
+# 全链路追踪：记录完整链路的提交比例（0 表示不追踪），span 导出位置：
+# 本地文件路径（每行一个 JSON），或 OTLP/HTTP collector 地址，例如 http://localhost:4318/v1/traces
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_EXPORT = os.getenv(
+    'TRACE_EXPORT',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'traces', 'spans.jsonl')
+)
+
 # Redis配置（用于Celery）
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 
+# 任务完成通知（Redis pub/sub）和长轮询配置
+RESULT_CHANNEL_PREFIX = os.getenv('RESULT_CHANNEL_PREFIX', 'survey_result:')
+WAIT_RESULT_DEFAULT_TIMEOUT = float(os.getenv('WAIT_RESULT_DEFAULT_TIMEOUT', '25'))
+WAIT_RESULT_MAX_TIMEOUT = float(os.getenv('WAIT_RESULT_MAX_TIMEOUT', '55'))
+
+# 人群百分位索引：定时从库里重建，任务完成时通过 Redis 频道增量更新
+SCORES_CHANNEL = os.getenv('SCORES_CHANNEL', 'mbti_scores')
+PERCENTILE_REBUILD_INTERVAL = float(os.getenv('PERCENTILE_REBUILD_INTERVAL', '3600'))
+PERCENTILE_MIN_BREED_COUNT = int(os.getenv('PERCENTILE_MIN_BREED_COUNT', '20'))
+PERCENTILE_PENDING_MAX = int(os.getenv('PERCENTILE_PENDING_MAX', '1024'))
+
+# 已完成结果的缓存（进程内LRU + Redis），以及返回给浏览器的缓存头
+SUBMISSION_CACHE_MAX_ENTRIES = int(os.getenv('SUBMISSION_CACHE_MAX_ENTRIES', '10000'))
+SUBMISSION_CACHE_TTL = float(os.getenv('SUBMISSION_CACHE_TTL', '300'))
+SUBMISSION_CACHE_REDIS = os.getenv('SUBMISSION_CACHE_REDIS', 'true').lower() == 'true'
+SUBMISSION_CACHE_REDIS_TTL = float(os.getenv('SUBMISSION_CACHE_REDIS_TTL', '86400'))
+RESULT_CACHE_CONTROL = os.getenv('RESULT_CACHE_CONTROL', 'private, max-age=3600')
 
+# 列式特征库（按日期分区的 .npy 或 Parquet 文件，供离线分析和重算分数使用）
+FEATURE_STORE_DIR = os.getenv(
+    'FEATURE_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'feature_store')
+)
 
+# 狗品种MBTI分数表（进程内缓存，文件修改后自动重新加载）
+BREED_SCORES_CSV = os.getenv(
+    'BREED_SCORES_CSV',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dog_raw_mbti_scores.csv')
+)
+BREED_SCORES_RELOAD_INTERVAL = float(os.getenv('BREED_SCORES_RELOAD_INTERVAL', '30'))
+
+# 品种别名表（俗称、混血品种 -> 分数表中的品种）和模糊匹配的最低相似度
+BREED_ALIASES_CSV = os.getenv(
+    'BREED_ALIASES_CSV',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dog_breed_aliases.csv')
+)
+BREED_MATCH_THRESHOLD = float(os.getenv('BREED_MATCH_THRESHOLD', '0.6'))
+
+# 各物种的品种先验分数表和混合权重，JSON，按物种覆盖默认值，例如
+#   {"Cat": {"csv": "cat_raw_mbti_scores.csv", "breed_weight": 0.3}}
+# 相对路径相对于项目目录；没有配置表的物种只用行为分数
+PRIOR_TABLES = {
+    "Dog": {"csv": BREED_SCORES_CSV, "aliases": BREED_ALIASES_CSV, "breed_weight": 0.4, "behavior_weight": 0.6},
+}
+for _species, _table in json.loads(os.getenv('PRIOR_TABLES', '{}')).items():
+    PRIOR_TABLES[_species] = {**PRIOR_TABLES.get(_species, {}), **_table}
+# 品种数达到这个值的表缓存成 .npy 并内存映射，多个worker进程共享同一份页缓存
+PRIOR_MMAP_MIN_ROWS = int(os.getenv('PRIOR_MMAP_MIN_ROWS', '5000'))
+PRIOR_CACHE_DIR = os.getenv(
+    'PRIOR_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'prior_cache')
+)
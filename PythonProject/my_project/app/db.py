@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2 import extensions
+from config import DB_CONFIG, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_IDLE
+from instrumentation import DB_CONNECT_SECONDS
+from tracing import tracer
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """每个进程一个 psycopg2 连接池：取连接时做健康检查，连接数有上限，满了就排队等待。"""
+
+    def __init__(self, db_config: Dict[str, str], minconn: int = 1, maxconn: int = 10,
+                 timeout: float = 10.0, healthcheck_idle: float = 30.0):
+        self.db_config = db_config
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        # 连接空闲超过这么多秒，取出时先执行 SELECT 1；0 表示每次都检查
+        self.healthcheck_idle = healthcheck_idle
+        self._lock = threading.Lock()
+        self._pool: Optional[pg_pool.ThreadedConnectionPool] = None
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._pid: Optional[int] = None
+        self._last_used: Dict[int, float] = {}
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._in_use = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._healthcheck_failures = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _get_pool(self) -> pg_pool.ThreadedConnectionPool:
+        # fork 出来的 Celery 子进程不能复用父进程的连接，按 pid 重新建池
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = pg_pool.ThreadedConnectionPool(self.minconn, self.maxconn, **self.db_config)
+                    self._slots = threading.BoundedSemaphore(self.maxconn)
+                    self._last_used = {}
+                    self._reset_stats()
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if idle < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self, pool):
+        for _ in range(self.maxconn + 1):
+            conn = pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            with self._lock:
+                self._healthcheck_failures += 1
+            self._last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Could not get a healthy database connection from the pool")
+
+    @contextmanager
+    def connection(self):
+        pool = self._get_pool()
+        slots = self._slots
+        started = time.perf_counter()
+        if not slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"Timed out after {self.timeout}s waiting for a database connection")
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        conn = None
+        try:
+            conn = self._checkout(pool)
+            waited = time.perf_counter() - started
+            DB_CONNECT_SECONDS.observe(waited)
+            now = time.time()
+            tracer.record("db.connect", now - waited, now)
+            yield conn
+        finally:
+            if conn is not None:
+                self._release(pool, conn)
+            with self._lock:
+                self._in_use -= 1
+            slots.release()
+
+    def _release(self, pool, conn):
+        # 没提交的事务一律回滚；回滚失败说明连接已坏，直接关闭不放回池中
+        broken = bool(conn.closed)
+        if not broken and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        pool.putconn(conn, close=broken)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "max_size": self.maxconn,
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "healthcheck_failures": self._healthcheck_failures,
+                "wait_seconds_total": round(self._wait_total, 6),
+                "wait_seconds_max": round(self._wait_max, 6),
+                "wait_seconds_avg": round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0
+            }
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+            self._pid = None
+
+
+# Flask 进程和每个 Celery 子进程各自懒加载一个连接池
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    minconn=DB_POOL_MIN,
+    maxconn=DB_POOL_MAX,
+    timeout=DB_POOL_TIMEOUT,
+    healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE
+)
+
+
+def get_db():
+    return db_pool.connection()
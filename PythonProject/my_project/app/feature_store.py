@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import psycopg2
+from config import DB_CONFIG, FEATURE_STORE_DIR
+from mbti_calculator import (
+    BEHAVIOR_FIELDS, DIMENSIONS, SCORE_COLUMNS, SCORING_VERSION, calculate_mbti_batch, parse_behavior_matrix
+)
+from rescore import read_checkpoint, write_checkpoint
+
+# 把 survey_data 物化成列式特征库，离线分析和批量计算不用再逐行解析 JSON：
+#   feature_store/date=2025-03-01/part-000000001234/   每个分块一个目录，每列一个 .npy 文件
+#   feature_store/_checkpoint                          已导出的最大 submission_id
+#   python feature_store.py export --chunk-size 50000
+#   python feature_store.py summary --start 2025-03-01
+# 读取时用 np.load(mmap_mode='r')，数组直接映射文件，不复制到内存。
+# 安装了 pyarrow 时可以用 --format parquet 导出为 Parquet（列相同，分数和题目各自成列）。
+
+CHECKPOINT_FILE = "_checkpoint"
+META_FILE = "meta.json"
+
+# 每个分块目录中的数值列：文件名 -> dtype
+NUMERIC_COLUMNS = {
+    "submission_id": np.int64,
+    "created_at": "datetime64[us]",
+    "generated_at": "datetime64[us]",   # 还没有AI结果的行为 NaT
+    "features": np.float32,             # (N, 12)，列顺序同 BEHAVIOR_FIELDS，解析失败的行为 NaN
+    "scores": np.float32,               # (N, 4)，列顺序同 DIMENSIONS
+    "pet_type": np.int16,               # 字典编码，值表在 meta.json，-1 表示空
+    "pet_breed": np.int32,
+}
+FEATURE_NAMES = [f"{group}.{question}" for group, question in BEHAVIOR_FIELDS]
+
+
+def encode(values: Sequence[Optional[str]], dtype) -> Tuple[np.ndarray, List[str]]:
+    # 字典编码：每个分块自己的值表，品种这类低基数字符串只存一个整数
+    dictionary: Dict[str, int] = {}
+    codes = np.empty(len(values), dtype=dtype)
+    for i, value in enumerate(values):
+        if value is None:
+            codes[i] = -1
+        else:
+            codes[i] = dictionary.setdefault(value, len(dictionary))
+    return codes, list(dictionary)
+
+
+def build_columns(rows: Sequence[tuple]) -> Dict[str, Any]:
+    # rows: (submission_id, created_at, generated_at, pet_type, pet_breed, personality_behavior, 四个分数)
+    pet_types = [row[3] for row in rows]
+    pet_breeds = [row[4] for row in rows]
+    features = parse_behavior_matrix([row[5] for row in rows], on_error="skip")
+    stored = np.array([row[6:10] for row in rows], dtype=np.float64).reshape(len(rows), len(DIMENSIONS))
+    # 库里已经有分数的行直接用，没有的（旧数据、还没处理的）现算
+    missing = np.isnan(stored).any(axis=1)
+    if missing.any():
+        index = np.flatnonzero(missing)
+        stored[index] = calculate_mbti_batch(
+            [rows[i][5] for i in index], [pet_types[i] for i in index], [pet_breeds[i] for i in index],
+            on_error="skip"
+        )
+    pet_type_codes, pet_type_values = encode(pet_types, NUMERIC_COLUMNS["pet_type"])
+    pet_breed_codes, pet_breed_values = encode(pet_breeds, NUMERIC_COLUMNS["pet_breed"])
+    return {
+        "submission_id": np.array([row[0] for row in rows], dtype=NUMERIC_COLUMNS["submission_id"]),
+        "created_at": np.array([row[1] for row in rows], dtype=NUMERIC_COLUMNS["created_at"]),
+        "generated_at": np.array([row[2] for row in rows], dtype=NUMERIC_COLUMNS["generated_at"]),
+        "features": features.astype(NUMERIC_COLUMNS["features"]),
+        "scores": stored.astype(NUMERIC_COLUMNS["scores"]),
+        "pet_type": pet_type_codes,
+        "pet_breed": pet_breed_codes,
+        "dictionaries": {"pet_type": pet_type_values, "pet_breed": pet_breed_values},
+    }
+
+
+def take(columns: Dict[str, Any], index: np.ndarray) -> Dict[str, Any]:
+    part = {name: columns[name][index] for name in NUMERIC_COLUMNS}
+    part["dictionaries"] = columns["dictionaries"]
+    return part
+
+
+def part_name(columns: Dict[str, Any]) -> str:
+    # 以分块的第一个 submission_id 命名；中断后从检查点重跑会得到同名分块并覆盖它
+    return f"part-{int(columns['submission_id'][0]):012d}"
+
+
+def replace_dir(tmp_path: str, path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def write_npy_part(directory: str, columns: Dict[str, Any]) -> str:
+    path = os.path.join(directory, part_name(columns))
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for name in NUMERIC_COLUMNS:
+        np.save(os.path.join(tmp_path, f"{name}.npy"), columns[name])
+    with open(os.path.join(tmp_path, META_FILE), "w") as f:
+        json.dump({
+            "rows": len(columns["submission_id"]),
+            "features": FEATURE_NAMES,
+            "dimensions": DIMENSIONS,
+            "scoring_version": SCORING_VERSION,
+            "dictionaries": columns["dictionaries"],
+        }, f, ensure_ascii=False)
+    # 整个目录写完再改名，读者不会看到写了一半的分块
+    replace_dir(tmp_path, path)
+    return path
+
+
+def write_parquet_part(directory: str, columns: Dict[str, Any]) -> str:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrays = {
+        "submission_id": pa.array(columns["submission_id"]),
+        "created_at": pa.array(columns["created_at"]),
+        "generated_at": pa.array(columns["generated_at"], mask=np.isnat(columns["generated_at"])),
+    }
+    for name in ("pet_type", "pet_breed"):
+        codes = columns[name]
+        arrays[name] = pa.DictionaryArray.from_arrays(
+            pa.array(codes, mask=codes < 0).cast(pa.int32()), pa.array(columns["dictionaries"][name], pa.string())
+        )
+    for i, name in enumerate(FEATURE_NAMES):
+        arrays[name] = pa.array(columns["features"][:, i])
+    for i, name in enumerate(SCORE_COLUMNS):
+        arrays[name] = pa.array(columns["scores"][:, i])
+    table = pa.table(arrays).replace_schema_metadata({"scoring_version": str(SCORING_VERSION)})
+
+    path = os.path.join(directory, part_name(columns) + ".parquet")
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    replace_dir(tmp_path, path)
+    return path
+
+
+def write_partitions(root: str, columns: Dict[str, Any], fmt: str = "npy") -> List[str]:
+    # 按 created_at 的日期拆成分区，每个分区写一个分块
+    days = columns["created_at"].astype("datetime64[D]")
+    written = []
+    for day in np.unique(days):
+        directory = os.path.join(root, f"date={day}")
+        os.makedirs(directory, exist_ok=True)
+        part = take(columns, np.flatnonzero(days == day))
+        if fmt == "parquet":
+            written.append(write_parquet_part(directory, part))
+        else:
+            written.append(write_npy_part(directory, part))
+    return written
+
+
+def export(root: str = FEATURE_STORE_DIR, chunk_size: int = 50000, min_age: float = 3600, fmt: str = "npy",
+           limit: int = None) -> Dict[str, Any]:
+    """从检查点之后按 submission_id 顺序增量导出；太新的提交（可能还在等AI结果）留到下次。"""
+    os.makedirs(root, exist_ok=True)
+    checkpoint_path = os.path.join(root, CHECKPOINT_FILE)
+    last_id = read_checkpoint(checkpoint_path)
+    print(f"Exporting survey_data after submission_id {last_id} to {root}")
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    total = 0
+    parts = 0
+    started = time.perf_counter()
+    try:
+        # 命名游标 = 服务端游标，每次只把一个分块拉到内存
+        cur = conn.cursor(name="export_survey_features")
+        cur.itersize = chunk_size
+        cur.execute("""
+            SELECT submission_id, created_at, generated_at, pet_type, pet_breed, personality_behavior,
+                   mbti_e_i, mbti_s_n, mbti_t_f, mbti_j_p
+            FROM survey_data
+            WHERE submission_id > %s
+              AND created_at < NOW() - make_interval(secs => %s)
+            ORDER BY submission_id
+        """, (last_id, min_age))
+
+        while True:
+            chunk = cur.fetchmany(chunk_size)
+            if not chunk:
+                break
+            parts += len(write_partitions(root, build_columns(chunk), fmt))
+            last_id = chunk[-1][0]
+            write_checkpoint(checkpoint_path, last_id)
+
+            total += len(chunk)
+            elapsed = time.perf_counter() - started
+            print(f"Exported {total} rows into {parts} parts, last submission_id {last_id}, "
+                  f"{total / elapsed:.0f} rows/s")
+            if limit is not None and total >= limit:
+                break
+        cur.close()
+    finally:
+        conn.close()
+
+    return {"rows": total, "parts": parts, "last_submission_id": last_id}
+
+
+def partition_dirs(root: str, start: str = None, end: str = None) -> List[str]:
+    # start/end 为 YYYY-MM-DD，包含两端
+    days = []
+    for name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        if name.startswith("date="):
+            day = name[len("date="):]
+            if (start is None or day >= start) and (end is None or day <= end):
+                days.append(os.path.join(root, name))
+    return days
+
+
+def iter_parts(root: str = FEATURE_STORE_DIR, start: str = None, end: str = None) -> Iterator[Dict[str, Any]]:
+    """逐个分块返回内存映射的列（.npy），不复制数据；meta 中有题目名、维度名和字典值表。"""
+    for directory in partition_dirs(root, start, end):
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not name.startswith("part-") or name.endswith(".tmp") or not os.path.isdir(path):
+                continue
+            with open(os.path.join(path, META_FILE)) as f:
+                meta = json.load(f)
+            part = {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r") for column in NUMERIC_COLUMNS}
+            part["meta"] = meta
+            yield part
+
+
+def breed_summary(root: str = FEATURE_STORE_DIR, start: str = None, end: str = None) -> Dict[str, Dict[str, Any]]:
+    # 例子：按品种统计提交数和四个维度的平均分，只读 scores 和 pet_breed 两列
+    sums: Dict[str, np.ndarray] = {}
+    counts: Dict[str, int] = {}
+    for part in iter_parts(root, start, end):
+        breeds = part["meta"]["dictionaries"]["pet_breed"]
+        codes = np.asarray(part["pet_breed"])
+        scores = np.asarray(part["scores"], dtype=np.float64)
+        valid = (codes >= 0) & ~np.isnan(scores).any(axis=1)
+        for code in np.unique(codes[valid]):
+            mask = valid & (codes == code)
+            breed = breeds[code]
+            sums[breed] = sums.get(breed, np.zeros(len(DIMENSIONS))) + scores[mask].sum(axis=0)
+            counts[breed] = counts.get(breed, 0) + int(mask.sum())
+    return {
+        breed: {"count": counts[breed], **dict(zip(DIMENSIONS, np.round(sums[breed] / counts[breed], 2).tolist()))}
+        for breed in sorted(counts, key=counts.get, reverse=True)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialize survey_data into a date-partitioned columnar store")
+    parser.add_argument("--root", default=FEATURE_STORE_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Append rows after the last exported submission_id")
+    export_parser.add_argument("--chunk-size", type=int, default=50000)
+    export_parser.add_argument("--min-age", type=float, default=3600,
+                               help="Only export submissions older than this many seconds")
+    export_parser.add_argument("--format", choices=["npy", "parquet"], default="npy")
+    export_parser.add_argument("--limit", type=int, default=None, help="Stop after roughly this many rows")
+
+    summary_parser = commands.add_parser("summary", help="Per-breed counts and mean scores from the npy store")
+    summary_parser.add_argument("--start", default=None, help="First date, YYYY-MM-DD")
+    summary_parser.add_argument("--end", default=None, help="Last date, YYYY-MM-DD")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        print(json.dumps(export(args.root, args.chunk_size, args.min_age, args.format, args.limit)))
+    else:
+        print(json.dumps(breed_summary(args.root, args.start, args.end), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from celery import group
+from psycopg2.extras import execute_values
+from config import INGEST_BATCH_MAX_SIZE, INGEST_BATCH_WAIT_MS
+from db import get_db
+from instrumentation import log_event
+from tracing import SpanContext, current, timed_query, tracer
+from tasks import process_ai_task
+
+INSERT_SURVEYS_SQL = """
+    INSERT INTO survey_data (
+        email, ip, pet_type, pet_name, pet_breed,
+        pet_gender, pet_age, personality_behavior
+    )
+    VALUES %s
+    RETURNING submission_id;
+"""
+
+
+def survey_row(data: Dict[str, Any]) -> Tuple:
+    # 与 /receive_data 的请求体格式一致
+    return (
+        data["survey_data"]["user_info"]["email"],
+        data["survey_data"]["user_info"]["ip"],
+        data["survey_data"]["pet_info"]["PetSpecies"],
+        data["survey_data"]["pet_info"]["PetName"],
+        data["survey_data"]["pet_info"]["PetBreed"],
+        data["survey_data"]["pet_info"]["PetGender"],
+        data["survey_data"]["pet_info"]["PetAge"],
+        json.dumps(data["survey_data"]["personality_and_behavior"])
+    )
+
+
+def insert_surveys(rows: Sequence[Tuple]) -> List[int]:
+    # 一条多行 INSERT ... RETURNING，一个事务；返回的 submission_id 与 rows 顺序一致
+    with get_db() as conn, conn.cursor() as cursor:
+        with timed_query("insert_surveys"):
+            result = execute_values(cursor, INSERT_SURVEYS_SQL, rows, page_size=len(rows), fetch=True)
+            conn.commit()
+    return [row[0] for row in result]
+
+
+def enqueue_submissions(submission_ids: Sequence[int], traceparents: Optional[Sequence[Optional[str]]] = None):
+    # 整批一次发给 broker。traceparents 与 submission_ids 一一对应（缓冲写入时每条提交属于各自的 trace），
+    # 不传时由 Celery 发布信号带上当前 trace
+    signatures = [process_ai_task.s(submission_id) for submission_id in submission_ids]
+    for signature, traceparent in zip(signatures, traceparents or ()):
+        if traceparent is not None:
+            signature.set(headers={"traceparent": traceparent})
+    with tracer.span("celery.enqueue", count=len(signatures)):
+        if len(signatures) == 1:
+            signatures[0].apply_async()
+        else:
+            group(signatures).apply_async()
+
+
+class IngestBuffer:
+    """写后缓冲：把几毫秒内到达的提交合并成一次多行插入，提交成功后才唤醒各个请求返回202。"""
+
+    def __init__(self, max_batch_size: int = 100, max_wait: float = 0.005):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Tuple[Tuple, Future, Optional[SpanContext]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self.counters = {"submissions": 0, "batches": 0, "fallback_rows": 0, "failed": 0}
+
+    def _ensure_worker(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._worker = threading.Thread(target=self._run, name="ingest-buffer", daemon=True)
+                    self._pid = os.getpid()
+                    self._worker.start()
+
+    def submit(self, row: Tuple) -> Future:
+        # 记下提交方的 trace，插入和入队在后台线程里完成，span 按各自的 trace 补记
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((row, future, current()))
+        return future
+
+    def _collect(self) -> List[Tuple[Tuple, Future, Optional[SpanContext]]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._flush(batch)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _flush(self, batch: List[Tuple[Tuple, Future, Optional[SpanContext]]]):
+        rows = [row for row, _, _ in batch]
+        self.counters["batches"] += 1
+        insert_started = time.time()
+        try:
+            submission_ids = insert_surveys(rows)
+        except Exception as e:
+            # 整批失败时逐行重试，坏数据只影响它自己的请求
+            log_event("ingest_batch_fallback", sample_rate=1, rows=len(rows), error=str(e))
+            self.counters["fallback_rows"] += len(rows)
+            submission_ids = []
+            for row, future, _ in batch:
+                try:
+                    submission_ids.append(insert_surveys([row])[0])
+                except Exception as row_error:
+                    self.counters["failed"] += 1
+                    future.set_exception(row_error)
+                    submission_ids.append(None)
+
+        committed = [(submission_id, future, context)
+                     for submission_id, (_, future, context) in zip(submission_ids, batch) if submission_id is not None]
+        self.counters["submissions"] += len(committed)
+        enqueue_started = time.time()
+        for _, _, context in batch:
+            tracer.record("db.insert_surveys", insert_started, enqueue_started, context, batch_size=len(rows))
+        if not committed:
+            return
+        try:
+            enqueue_submissions([submission_id for submission_id, _, _ in committed],
+                                [context.traceparent if context is not None else None for _, _, context in committed])
+        except Exception as e:
+            # 和单条路径一样：数据已经入库，但入队失败要让请求报错
+            for _, future, _ in committed:
+                future.set_exception(e)
+            return
+        enqueued = time.time()
+        for submission_id, future, context in committed:
+            tracer.record("celery.enqueue", enqueue_started, enqueued, context, batch_size=len(committed))
+            future.set_result(submission_id)
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self.counters["batches"]
+        return {
+            **self.counters,
+            "queued": self._queue.qsize(),
+            "avg_batch_size": round(self.counters["submissions"] / batches, 2) if batches else 0.0
+        }
+
+
+ingest_buffer = IngestBuffer(max_batch_size=INGEST_BATCH_MAX_SIZE, max_wait=INGEST_BATCH_WAIT_MS / 1000)
@@ -0,0 +1,112 @@
+import json
+import os
+import random
+import time
+from datetime import datetime
+from typing import Any, Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+    start_http_server
+)
+from config import LOG_SAMPLE_RATE, CELERY_METRICS_PORT
+
+# API 进程、Celery worker 共用的 Prometheus 指标和抽样日志。
+# gunicorn / Celery prefork 多进程时设置 PROMETHEUS_MULTIPROC_DIR，各进程的指标写到这个目录，/metrics 汇总。
+
+# 秒级延迟的桶：数据库和计分在毫秒级，AI 调用在秒级
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "API request duration", ["route", "method", "status"], buckets=FAST_BUCKETS + (30, 60)
+)
+DB_CONNECT_SECONDS = Histogram(
+    "db_connect_seconds", "Time to get a healthy connection from the pool, including waiting", buckets=FAST_BUCKETS
+)
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Database statement duration", ["query"], buckets=FAST_BUCKETS)
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    "task_queue_wait_seconds", "Time from enqueue to task start", ["task", "queue"],
+    buckets=FAST_BUCKETS + SLOW_BUCKETS[8:]
+)
+TASK_RETRIES = Counter("task_retries_total", "Tasks deferred for a delayed retry", ["task", "reason"])
+CELERY_QUEUE_DEPTH = Gauge(
+    "celery_queue_depth", "Messages waiting in each Celery queue", ["queue"], multiprocess_mode="livemax"
+)
+AI_RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "ai_rate_limit_wait_seconds", "Time spent waiting for rate limit budget", ["priority"], buckets=FAST_BUCKETS
+)
+AI_RATE_LIMITED = Counter("ai_rate_limited_total", "AI calls deferred because the rate limit budget ran out",
+                          ["priority"])
+TASK_SECONDS = Histogram("task_seconds", "Celery task duration", ["task", "status"], buckets=SLOW_BUCKETS)
+SCORING_SECONDS = Histogram("scoring_seconds", "MBTI scoring duration", ["mode"], buckets=FAST_BUCKETS)
+SCORING_ROWS = Counter("scoring_rows_total", "Surveys scored", ["mode"])
+AI_HTTP_SECONDS = Histogram(
+    "ai_http_seconds", "Duration of one HTTP attempt to the AI service", ["outcome"], buckets=SLOW_BUCKETS
+)
+AI_HTTP_RETRIES = Counter("ai_http_retries_total", "Retried AI service requests")
+
+
+def metrics_response() -> Tuple[bytes, str]:
+    # 多进程模式下每次从目录里汇总所有进程（包括已退出的）的指标
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def log_event(event: str, sample_rate: float = LOG_SAMPLE_RATE, **fields: Any):
+    # 抽样的结构化日志（一行JSON）；热点路径上代替逐条 print 请求和结果
+    if sample_rate >= 1 or random.random() < sample_rate:
+        print(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, ensure_ascii=False, default=str))
+
+
+def install_celery_metrics(celery_app):
+    """给 Celery 加上排队时间和任务耗时：发布时在消息头里记下入队时间，开始执行时算出等了多久。"""
+    from celery import signals
+
+    @signals.before_task_publish.connect(weak=False)
+    def record_enqueue_time(headers=None, **kwargs):
+        if headers is not None:
+            # 延后重试的任务重新发布时会复制原来的消息头，这里总是覆盖成这次发布的时间
+            headers["enqueued_at"] = time.time()
+
+    @signals.task_prerun.connect(weak=False)
+    def record_start(task=None, **kwargs):
+        task.request.started_at = time.perf_counter()
+        enqueued_at = getattr(task.request, "enqueued_at", None)
+        if enqueued_at:
+            # 带 countdown 的任务（延后重试）从预定执行时间开始算，退避时间本身不算排队
+            ready_at = float(enqueued_at)
+            if task.request.eta:
+                ready_at = max(ready_at, datetime.fromisoformat(str(task.request.eta)).timestamp())
+            queue = (task.request.delivery_info or {}).get("routing_key") or "unknown"
+            TASK_QUEUE_WAIT_SECONDS.labels(task.name, queue).observe(max(0.0, time.time() - ready_at))
+
+    @signals.task_postrun.connect(weak=False)
+    def record_duration(task=None, retval=None, state=None, **kwargs):
+        started_at = getattr(task.request, "started_at", None)
+        if started_at is None:
+            return
+        # 任务捕获异常后返回状态字典，按字典里的 status 区分
+        status = retval.get("status", state) if isinstance(retval, dict) else state
+        TASK_SECONDS.labels(task.name, str(status).lower()).observe(time.perf_counter() - started_at)
+
+    @signals.worker_ready.connect(weak=False)
+    def serve_metrics(**kwargs):
+        # worker 没有 HTTP 服务，单独开一个端口给 Prometheus 抓取；prefork 时任务在子进程里执行，
+        # 需要设置 PROMETHEUS_MULTIPROC_DIR 才能看到子进程的指标
+        if CELERY_METRICS_PORT > 0:
+            if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+                registry = CollectorRegistry()
+                multiprocess.MultiProcessCollector(registry)
+                start_http_server(CELERY_METRICS_PORT, registry=registry)
+            else:
+                start_http_server(CELERY_METRICS_PORT)
+
+    @signals.worker_process_shutdown.connect(weak=False)
+    def mark_dead(pid=None, **kwargs):
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            multiprocess.mark_process_dead(pid or os.getpid())
+
+    return celery_app
@@ -1,96 +1,132 @@
-from typing import Dict, Any
-import pandas as pd
-import os
+import hashlib
+import json
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+import numpy as np
+from config import BREED_SCORES_CSV
+from prior_tables import prior_tables
+from survey_schema import DIMENSIONS, SURVEY_SCHEMA, SurveySchemaError, behavior_extractor, parse_percent
 
-# 读取狗的MBTI分数数据
+# survey_data 中保存各维度分数的列，顺序同 DIMENSIONS
+SCORE_COLUMNS = ["mbti_e_i", "mbti_s_n", "mbti_t_f", "mbti_j_p"]
+
+# 计分规则（题目、权重、公式）变化时加1，让已保存的分数和输入哈希全部失效
+SCORING_VERSION = 1
+
+# 每道题（分组名, 题目名），顺序与 behavior_extractor 输出向量的列一致
+BEHAVIOR_FIELDS = [(q.group, q.key) for q in SURVEY_SCHEMA]
+
+# 狗的默认权重：品种预设分数占40%，行为数据占60%；各物种的权重在 PRIOR_TABLES 中配置
+BREED_WEIGHT = 0.4
+BEHAVIOR_WEIGHT = 0.6
+
+# 进程内的狗品种分数表（prior_tables 中狗的那张表），首次查询时加载一次
+dog_breed_registry = prior_tables.table("Dog")
+
+# 读取狗的MBTI分数数据（完整DataFrame，仅用于离线分析）
 def load_dog_mbti_scores():
-    csv_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'dog_raw_mbti_scores.csv')
-    return pd.read_csv(csv_path)
+    import pandas as pd
+    return pd.read_csv(BREED_SCORES_CSV)
 
 # 获取狗的品种MBTI分数
 def get_dog_breed_scores(breed: str) -> Dict[str, float]:
-    df = load_dog_mbti_scores()
-    breed_data = df[df['breed'] == breed].iloc[0] if not df[df['breed'] == breed].empty else None
+    return dog_breed_registry.get(breed)
 
+def safe_float(value: Any) -> float:
+    return parse_percent(value)
 
-    if breed_data is None:
-        return None
-        
-    return {
-        "E/I": breed_data['m_score'],
-        "S/N": breed_data['b_score'],
-        "T/F": breed_data['t_score'],
-        "J/P": breed_data['i_score']
-    }
+def parse_behavior_row(personality_behavior: Dict[str, Any]) -> List[float]:
+    return behavior_extractor(personality_behavior)
 
-def calculate_behavior_scores(personality_behavior: Dict[str, Any]) -> Dict[str, float]:
-    result = {}
-
-    def safe_float(value: Any) -> float:
-        if value is None or value == "" or value == 0 or value == "Null":
-            return 0
-        if isinstance(value, str):
-            value = value.strip(')')
+def parse_behavior_matrix(personality_behaviors: Sequence[Dict[str, Any]], on_error: str = "raise") -> np.ndarray:
+    # 把N份问卷解析成 (N, 12) 的矩阵；on_error="skip" 时解析失败的行整行为NaN
+    values = np.empty((len(personality_behaviors), len(BEHAVIOR_FIELDS)), dtype=np.float64)
+    for i, personality_behavior in enumerate(personality_behaviors):
         try:
-            return float(value)
-        except ValueError:
-            return 0
-
-    def calculate_dimension(scores: list) -> float:
-        valid_scores = [score for score in scores if score > 0]
-        if not valid_scores:
-            return 50  # 如果没有有效分数，返回中性值
-        return sum(valid_scores) / len(valid_scores)  # 直接使用原始分数
-
-    # Energy & Socialization (E vs. I)
-    e_vs_i_scores = [
-        safe_float(personality_behavior["Energy_Socialization"]["seek_attention"]),
-        safe_float(personality_behavior["Energy_Socialization"]["interact_with_toys"]),
-        safe_float(personality_behavior["Energy_Socialization"]["stranger_enter_territory"])
-    ]
-    result["E/I"] = calculate_dimension(e_vs_i_scores)
-
-    # Routine vs. Curiosity (S vs. N)
-    s_vs_n_scores = [
-        safe_float(personality_behavior["Routin_Curiosity"]["prefer_routine"]),
-        safe_float(personality_behavior["Routin_Curiosity"]["friend_visit_behaviors"]),
-        safe_float(personality_behavior["Routin_Curiosity"]["fur_care_7days"])
-    ]
-    result["S/N"] = calculate_dimension(s_vs_n_scores)
-
-    # Decision-Making (T vs. F)
-    t_vs_f_scores = [
-        safe_float(personality_behavior["Decision_Making"]["react_when_sad"]),
-        100 if personality_behavior["Decision_Making"]["toy_out_of_reach"] == "Keep trying" else 0,
-        safe_float(personality_behavior["Decision_Making"]["react_new_friend"])
-    ]
-    result["T/F"] = calculate_dimension(t_vs_f_scores)
-
-    # Structure vs. Spontaneity (J vs. P)
-    j_vs_p_scores = [
-        safe_float(personality_behavior["Structure_Spontaneity"]["react_new_environment"]),
-        safe_float(personality_behavior["Structure_Spontaneity"]["respond_to_scold"]),
-        safe_float(personality_behavior["Structure_Spontaneity"]["follow_commands"])
-    ]
-    result["J/P"] = calculate_dimension(j_vs_p_scores)
-
-    return result
+            values[i] = parse_behavior_row(personality_behavior)
+        except (SurveySchemaError, TypeError, AttributeError):
+            if on_error == "raise":
+                raise
+            values[i] = np.nan
+    return values
+
+def score_behavior_matrix(values: np.ndarray) -> np.ndarray:
+    # 每个维度只取大于0的有效分数求平均，没有有效分数时返回中性值50
+    scores = np.empty((len(values), len(DIMENSIONS)), dtype=np.float64)
+    for d, dimension in enumerate(DIMENSIONS):
+        grouped = values[:, behavior_extractor.dimension_columns[dimension]]
+        valid = grouped > 0
+        counts = valid.sum(axis=1)
+        sums = np.where(valid, grouped, 0).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores[:, d] = np.where(counts > 0, sums / np.maximum(counts, 1), 50.0)
+    # 解析失败的行保持NaN，方便调用方识别
+    failed = np.isnan(values).all(axis=1)
+    scores[failed] = np.nan
+    return scores
+
+def breed_prior_matrix(
+    pet_types: Sequence[Optional[str]], pet_breeds: Sequence[Optional[str]]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # 按物种查预设分数（品种名经过别名和模糊匹配，混血取亲本平均），返回分数矩阵和每行的两个权重；
+    # 没有配置表的物种或查不到的品种分数为NaN
+    n = len(pet_breeds)
+    breed_scores = np.full((n, len(DIMENSIONS)), np.nan)
+    breed_weights = np.zeros(n)
+    behavior_weights = np.ones(n)
+    for i, (pet_type, pet_breed) in enumerate(zip(pet_types, pet_breeds)):
+        if not pet_breed:
+            continue
+        prior = prior_tables.get(pet_type)
+        if prior is None:
+            continue
+        scores = prior.table.get_vector(pet_breed)
+        if scores is not None:
+            breed_scores[i] = scores
+            breed_weights[i], behavior_weights[i] = prior.weights
+    return breed_scores, breed_weights, behavior_weights
+
+def breed_score_matrix(pet_types: Sequence[Optional[str]], pet_breeds: Sequence[Optional[str]]) -> np.ndarray:
+    return breed_prior_matrix(pet_types, pet_breeds)[0]
+
+def calculate_mbti_batch(
+    personality_behaviors: Sequence[Dict[str, Any]],
+    pet_types: Optional[Sequence[Optional[str]]] = None,
+    pet_breeds: Optional[Sequence[Optional[str]]] = None,
+    on_error: str = "raise"
+) -> np.ndarray:
+    # 一次计算N份问卷，返回 (N, 4) 的分数矩阵，列顺序同 DIMENSIONS
+    behavior_scores = score_behavior_matrix(parse_behavior_matrix(personality_behaviors, on_error))
+    if pet_types is None or pet_breeds is None:
+        return behavior_scores
+
+    breed_scores, breed_weights, behavior_weights = breed_prior_matrix(pet_types, pet_breeds)
+    has_breed = ~np.isnan(breed_scores).any(axis=1)
+    blended = breed_scores * breed_weights[:, None] + behavior_scores * behavior_weights[:, None]
+    return np.where(has_breed[:, None], blended, behavior_scores)
+
+def scores_to_dicts(scores: np.ndarray) -> List[Dict[str, float]]:
+    return [dict(zip(DIMENSIONS, row)) for row in scores.tolist()]
+
+def mbti_input_hash(personality_behavior: Any, pet_type: Optional[str], pet_breed: Optional[str]) -> str:
+    # 计分所依赖的全部输入：问卷、宠物类型、实际用到的品种分数（及其权重）和计分版本
+    prior = prior_tables.get(pet_type) if pet_breed else None
+    breed_scores = prior.table.get_vector(pet_breed, record=False) if prior is not None else None
+    if breed_scores is not None and prior.weights != (BREED_WEIGHT, BEHAVIOR_WEIGHT):
+        # 默认权重不写进哈希，已保存的狗的哈希保持有效
+        breed_scores = [prior.weights, breed_scores]
+    payload = json.dumps(
+        [SCORING_VERSION, pet_type, breed_scores, personality_behavior],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def score_row_values(scores: Dict[str, float]) -> List[Optional[float]]:
+    # 写库用：按 SCORE_COLUMNS 顺序，NaN 写成 NULL
+    return [None if scores[dimension] != scores[dimension] else scores[dimension] for dimension in DIMENSIONS]
+
+def calculate_behavior_scores(personality_behavior: Dict[str, Any]) -> Dict[str, float]:
+    return scores_to_dicts(calculate_mbti_batch([personality_behavior]))[0]
 
 def calculate_mbti(personality_behavior: Dict[str, Any], pet_type: str = None, pet_breed: str = None) -> Dict[str, float]:
-    # 计算行为数据分数
-    behavior_scores = calculate_behavior_scores(personality_behavior)
-    
-    # 如果是狗且有品种信息，结合品种预设分数
-    if pet_type == "Dog" and pet_breed:
-        breed_scores = get_dog_breed_scores(pet_breed)
-        if breed_scores:
-            # 使用权重计算：品种预设分数占40%，行为数据占60%
-            result = {}
-            for dimension in ["E/I", "S/N", "T/F", "J/P"]:
-                breed_score = breed_scores[dimension]
-                behavior_score = behavior_scores[dimension]
-                result[dimension] = breed_score * 0.4 + behavior_score * 0.6
-            return result
-    
-    # 如果不是狗或没有品种信息，只使用行为数据
-    return behavior_scores 
\ No newline at end of file
+    # 单份问卷是批量计算 N=1 的特例；如果这个物种有品种分数表且有品种信息，结合品种预设分数
+    return scores_to_dicts(calculate_mbti_batch([personality_behavior], [pet_type], [pet_breed]))[0]
@@ -0,0 +1,65 @@
+import json
+import time
+from typing import Any, Dict, Optional
+import redis
+from config import REDIS_URL, RESULT_CHANNEL_PREFIX, SCORES_CHANNEL
+
+# redis-py 的连接池会在 fork 后自动重建，Flask 和 Celery 子进程都可以直接用
+redis_client = redis.Redis.from_url(REDIS_URL)
+
+
+def result_channel(submission_id: int) -> str:
+    return f"{RESULT_CHANNEL_PREFIX}{submission_id}"
+
+
+def publish_result(submission_id: int, ai_output_text: str, generated_at: Optional[str]):
+    # 结果已提交到数据库后再发布；发布失败不影响任务，客户端还可以轮询 /get_result
+    try:
+        redis_client.publish(result_channel(submission_id), json.dumps({
+            "submission_id": submission_id,
+            "text": ai_output_text,
+            "generated_at": generated_at
+        }))
+    except redis.RedisError as e:
+        print(f"Error publishing result for submission {submission_id}: {str(e)}")
+
+
+def publish_scores(submission_id: int, pet_type: Optional[str], pet_breed: Optional[str], scores: Dict[str, float]):
+    # 新算出的分数广播给各个API进程的百分位索引（percentile_index）；丢失只会让索引晚一点更新
+    try:
+        redis_client.publish(SCORES_CHANNEL, json.dumps({
+            "submission_id": submission_id,
+            "pet_type": pet_type,
+            "pet_breed": pet_breed,
+            "scores": scores
+        }))
+    except redis.RedisError as e:
+        print(f"Error publishing scores for submission {submission_id}: {str(e)}")
+
+
+class ResultSubscription:
+    """先订阅再查库，避免任务在订阅之前就已经完成而错过通知。"""
+
+    def __init__(self, submission_id: int):
+        self.submission_id = submission_id
+        self._pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+
+    def __enter__(self):
+        self._pubsub.subscribe(result_channel(self.submission_id))
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self._pubsub.unsubscribe()
+        finally:
+            self._pubsub.close()
+
+    def wait(self, timeout: float) -> Optional[Dict[str, Any]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = self._pubsub.get_message(timeout=remaining)
+            if message and message["type"] == "message":
+                return json.loads(message["data"])
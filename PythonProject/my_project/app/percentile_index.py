@@ -0,0 +1,276 @@
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import redis
+from config import (
+    SCORES_CHANNEL, PERCENTILE_REBUILD_INTERVAL, PERCENTILE_MIN_BREED_COUNT, PERCENTILE_PENDING_MAX
+)
+from breed_scores import normalize_breed
+from db import get_db
+from mbti_calculator import DIMENSIONS
+from prior_tables import prior_tables
+from notifications import redis_client
+
+# 总体人群的分组键；品种分组的键是 (pet_type, 品种)，有品种分数表的物种先解析成表里的品种名
+ALL_PETS = ("*", "*")
+# 重建时每次从服务端游标取的行数
+LOAD_CHUNK_SIZE = 10000
+
+
+def group_key(pet_type: Optional[str], pet_breed: Optional[str]) -> Optional[Tuple[str, str]]:
+    if not pet_type or not pet_breed:
+        return None
+    table = prior_tables.table(pet_type)
+    if table is not None:
+        resolution = table.resolve(pet_breed)
+        if len(resolution.breeds) == 1 and resolution.kind != "mixed":
+            return (table.species.casefold(), resolution.breeds[0].casefold())
+    return (str(pet_type).strip().casefold(), normalize_breed(pet_breed))
+
+
+class ScoreDistribution:
+    """一个分组的分数分布：每个维度一个排好序的数组，加上重建之后新到的少量分数（有序列表）。"""
+
+    def __init__(self, sorted_scores: np.ndarray):
+        # sorted_scores: (len(DIMENSIONS), n)，每一行单独排序
+        self.sorted_scores = sorted_scores
+        self.pending: List[List[float]] = [[] for _ in DIMENSIONS]
+
+    def __len__(self) -> int:
+        return self.sorted_scores.shape[1] + len(self.pending[0])
+
+    def add(self, values: Sequence[float]):
+        for column, value in zip(self.pending, values):
+            bisect.insort(column, value)
+
+    def merge_pending(self):
+        # 新分数积累到一定数量后并回有序数组，保持查询是两次二分
+        if not self.pending[0]:
+            return
+        merged = np.concatenate([self.sorted_scores, np.array(self.pending, dtype=np.float64)], axis=1)
+        merged.sort(axis=1)
+        self.sorted_scores = merged
+        self.pending = [[] for _ in DIMENSIONS]
+
+    def percentile(self, d: int, score: float) -> float:
+        # 中位秩：分数低于它的个数 + 相同分数个数的一半，O(log n)
+        column = self.sorted_scores[d]
+        pending = self.pending[d]
+        below = int(np.searchsorted(column, score, "left")) + bisect.bisect_left(pending, score)
+        not_above = int(np.searchsorted(column, score, "right")) + bisect.bisect_right(pending, score)
+        return round(100.0 * (below + not_above) / 2 / len(self), 1)
+
+
+class PercentileIndex:
+    """进程内的人群百分位索引：总体和每个品种各一份分数分布。
+
+    后台线程按 rebuild_interval 从 survey_data 已保存的分数重建；两次重建之间订阅 SCORES_CHANNEL，
+    任务每算出一份分数就增量加入。已经计入的提交（重试、重新计分）不再加入，新分数等下次重建生效。
+    服务进程启动时调用 start() 开始第一次重建，索引建好之前查询返回 None。
+    """
+
+    def __init__(self, rebuild_interval: float = 3600, min_breed_count: int = 20, pending_max: int = 1024,
+                 channel: str = SCORES_CHANNEL, redis_client: Optional[redis.Redis] = None):
+        self.rebuild_interval = rebuild_interval
+        self.min_breed_count = min_breed_count
+        self.pending_max = pending_max
+        self.channel = channel
+        self.redis_client = redis_client
+        self._groups: Dict[Tuple[str, str], ScoreDistribution] = {}
+        # 已计入的提交：重建时读到的（排好序的数组）和之后增量加入的
+        self._ids = np.empty(0, dtype=np.int64)
+        self._added: set = set()
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        # 重建期间收到的分数：重建的查询可能看不到它们，换上新索引后重新加入
+        self._rebuilding = False
+        self._recent: List[Tuple[Optional[int], Optional[Tuple[str, str]], List[float]]] = []
+        self.counters = {"rebuilds": 0, "rebuild_errors": 0, "updates": 0, "duplicates": 0, "lookups": 0,
+                         "subscriber_errors": 0}
+        self.last_rebuild_seconds: Optional[float] = None
+
+    def start(self):
+        # 按 pid 启动后台线程；gunicorn --preload fork 出的子进程不会继承线程，第一次查询时再补启动
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._rebuild_loop, name="percentile-rebuild", daemon=True).start()
+                    if self.redis_client is not None:
+                        threading.Thread(target=self._subscribe_loop, name="percentile-updates", daemon=True).start()
+
+    def _rebuild_loop(self):
+        while True:
+            try:
+                self.rebuild()
+            except Exception as e:
+                self.counters["rebuild_errors"] += 1
+                print(f"Error rebuilding percentile index: {str(e)}")
+            if self.rebuild_interval <= 0:
+                return
+            time.sleep(self.rebuild_interval)
+
+    def _subscribe_loop(self):
+        while True:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message["type"] == "message":
+                        event = json.loads(message["data"])
+                        self.add(event["pet_type"], event["pet_breed"], event["scores"], event.get("submission_id"))
+            except (redis.RedisError, ValueError, KeyError) as e:
+                self.counters["subscriber_errors"] += 1
+                print(f"Error receiving score updates: {str(e)}")
+                time.sleep(5)
+            finally:
+                pubsub.close()
+
+    @staticmethod
+    def load_scores(chunk_size: int = LOAD_CHUNK_SIZE) -> Tuple[np.ndarray, List[Optional[str]], List[Optional[str]],
+                                                                 np.ndarray]:
+        # 命名游标 = 服务端游标，每次只把一个分块拉到内存，分数直接转成数组
+        submission_ids: List[np.ndarray] = []
+        pet_types: List[Optional[str]] = []
+        pet_breeds: List[Optional[str]] = []
+        chunks: List[np.ndarray] = []
+        with get_db() as conn, conn.cursor(name="percentile_index_scores") as cur:
+            cur.itersize = chunk_size
+            cur.execute("""
+                SELECT submission_id, pet_type, pet_breed, mbti_e_i, mbti_s_n, mbti_t_f, mbti_j_p
+                FROM survey_data
+                WHERE mbti_e_i IS NOT NULL AND mbti_s_n IS NOT NULL
+                  AND mbti_t_f IS NOT NULL AND mbti_j_p IS NOT NULL
+            """)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                submission_ids.append(np.array([row[0] for row in rows], dtype=np.int64))
+                pet_types.extend(row[1] for row in rows)
+                pet_breeds.extend(row[2] for row in rows)
+                chunks.append(np.array([row[3:] for row in rows], dtype=np.float64))
+        ids = np.concatenate(submission_ids) if submission_ids else np.empty(0, dtype=np.int64)
+        scores = np.concatenate(chunks) if chunks else np.empty((0, len(DIMENSIONS)))
+        return ids, pet_types, pet_breeds, scores
+
+    @staticmethod
+    def build_groups(pet_types: Sequence[Optional[str]], pet_breeds: Sequence[Optional[str]],
+                     scores: np.ndarray) -> Dict[Tuple[str, str], ScoreDistribution]:
+        groups = {ALL_PETS: ScoreDistribution(np.sort(scores.T, axis=1))}
+        keys = [group_key(pet_type, pet_breed) for pet_type, pet_breed in zip(pet_types, pet_breeds)]
+        rows_by_key: Dict[Tuple[str, str], List[int]] = {}
+        for i, key in enumerate(keys):
+            if key is not None:
+                rows_by_key.setdefault(key, []).append(i)
+        for key, rows in rows_by_key.items():
+            groups[key] = ScoreDistribution(np.sort(scores[rows].T, axis=1))
+        return groups
+
+    def rebuild(self):
+        started = time.monotonic()
+        with self._lock:
+            self._rebuilding = True
+            self._recent = []
+        try:
+            ids, pet_types, pet_breeds, scores = self.load_scores()
+            groups = self.build_groups(pet_types, pet_breeds, scores)
+            ids.sort()
+        except Exception:
+            with self._lock:
+                self._rebuilding = False
+            raise
+        with self._lock:
+            # 重建开始之后收到的更新可能不在查询结果里，不在的补回去
+            self._groups, self._ids, self._added = groups, ids, set()
+            for submission_id, key, values in self._recent:
+                if not self._counted(submission_id):
+                    self._add_locked(groups, submission_id, key, values)
+            self._rebuilding = False
+            self._recent = []
+        self.counters["rebuilds"] += 1
+        self.last_rebuild_seconds = round(time.monotonic() - started, 3)
+        self._ready.set()
+
+    def _counted(self, submission_id: Optional[int]) -> bool:
+        if submission_id is None:
+            return False
+        position = int(np.searchsorted(self._ids, submission_id))
+        return (position < len(self._ids) and self._ids[position] == submission_id) or submission_id in self._added
+
+    def add(self, pet_type: Optional[str], pet_breed: Optional[str], scores: Dict[str, float],
+            submission_id: Optional[int] = None):
+        values = [float(scores[dimension]) for dimension in DIMENSIONS]
+        if any(value != value for value in values):
+            return
+        key = group_key(pet_type, pet_breed)
+        with self._lock:
+            if self._rebuilding:
+                self._recent.append((submission_id, key, values))
+            if self._counted(submission_id):
+                # 同一个提交只计一次；重新计分的新分数等下次重建
+                self.counters["duplicates"] += 1
+                return
+            self._add_locked(self._groups, submission_id, key, values)
+        self.counters["updates"] += 1
+
+    def _add_locked(self, groups: Dict[Tuple[str, str], ScoreDistribution], submission_id: Optional[int],
+                    key: Optional[Tuple[str, str]], values: List[float]):
+        if submission_id is not None:
+            self._added.add(submission_id)
+        for group in (ALL_PETS, key):
+            if group is None:
+                continue
+            distribution = groups.setdefault(group, ScoreDistribution(np.empty((len(DIMENSIONS), 0))))
+            distribution.add(values)
+            if len(distribution.pending[0]) >= self.pending_max:
+                distribution.merge_pending()
+
+    def lookup(self, scores: Dict[str, float], pet_type: Optional[str] = None,
+               pet_breed: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """分数在总体和同品种中的百分位（0-100，越大表示比越多的宠物分数高）。"""
+        self.start()
+        if not self._ready.is_set():
+            return None
+        self.counters["lookups"] += 1
+        key = group_key(pet_type, pet_breed)
+        with self._lock:
+            overall = self._groups.get(ALL_PETS)
+            breed = self._groups.get(key) if key is not None else None
+            if breed is not None and len(breed) < self.min_breed_count:
+                breed = None
+            return {
+                "overall": {
+                    dimension: overall.percentile(d, float(scores[dimension])) for d, dimension in enumerate(DIMENSIONS)
+                } if overall is not None and len(overall) else None,
+                "overall_count": len(overall) if overall is not None else 0,
+                "breed": {
+                    dimension: breed.percentile(d, float(scores[dimension])) for d, dimension in enumerate(DIMENSIONS)
+                } if breed is not None else None,
+                "breed_count": len(breed) if breed is not None else 0,
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            overall = self._groups.get(ALL_PETS)
+            return {
+                **self.counters,
+                "ready": self._ready.is_set(),
+                "groups": len(self._groups),
+                "population": len(overall) if overall is not None else 0,
+                "last_rebuild_seconds": self.last_rebuild_seconds,
+            }
+
+
+percentile_index = PercentileIndex(
+    rebuild_interval=PERCENTILE_REBUILD_INTERVAL,
+    min_breed_count=PERCENTILE_MIN_BREED_COUNT,
+    pending_max=PERCENTILE_PENDING_MAX,
+    redis_client=redis_client
+)
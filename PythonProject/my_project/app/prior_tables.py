@@ -0,0 +1,84 @@
+import os
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+from config import (
+    PRIOR_TABLES, PRIOR_MMAP_MIN_ROWS, PRIOR_CACHE_DIR, BREED_SCORES_RELOAD_INTERVAL, BREED_MATCH_THRESHOLD
+)
+from breed_scores import BreedScoreRegistry
+
+# 按物种注册的品种先验分数表。注册时只记下路径和权重，表在这个物种第一次被查询时才加载，
+# 所以只处理狗的worker不会读猫的表。
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def species_key(pet_type: Optional[str]) -> str:
+    return str(pet_type or "").strip().casefold()
+
+
+class SpeciesPrior(NamedTuple):
+    species: str
+    table: BreedScoreRegistry
+    # 有品种分数时：最终分数 = 品种分数 * breed_weight + 行为分数 * behavior_weight
+    breed_weight: float
+    behavior_weight: float
+
+    @property
+    def weights(self) -> Tuple[float, float]:
+        return self.breed_weight, self.behavior_weight
+
+
+class PriorTableRegistry:
+    """物种 -> 品种先验分数表和混合权重。配置错误在启动时报错，而不是等到第一次查询。"""
+
+    def __init__(self, tables: Dict[str, Dict[str, Any]], reload_interval: float = 30.0,
+                 match_threshold: float = 0.6, mmap_min_rows: int = 5000, cache_dir: Optional[str] = None):
+        self._priors: Dict[str, SpeciesPrior] = {}
+        for species, options in tables.items():
+            if "csv" not in options:
+                raise ValueError(f"Prior table for {species!r} has no csv path")
+            breed_weight = float(options.get("breed_weight", 0.4))
+            behavior_weight = float(options.get("behavior_weight", 1.0 - breed_weight))
+            if not (0 <= breed_weight <= 1 and 0 <= behavior_weight <= 1):
+                raise ValueError(f"Prior weights for {species!r} must be between 0 and 1")
+            table = BreedScoreRegistry(
+                self._path(options["csv"]),
+                float(options.get("reload_interval", reload_interval)),
+                aliases_path=self._path(options.get("aliases")),
+                match_threshold=float(options.get("match_threshold", match_threshold)),
+                species=species,
+                mmap_min_rows=mmap_min_rows,
+                cache_dir=cache_dir
+            )
+            self._priors[species_key(species)] = SpeciesPrior(species, table, breed_weight, behavior_weight)
+
+    @staticmethod
+    def _path(path: Optional[str]) -> Optional[str]:
+        if not path:
+            return None
+        return path if os.path.isabs(path) else os.path.join(PROJECT_DIR, path)
+
+    def get(self, pet_type: Optional[str]) -> Optional[SpeciesPrior]:
+        return self._priors.get(species_key(pet_type))
+
+    def table(self, pet_type: Optional[str]) -> Optional[BreedScoreRegistry]:
+        prior = self.get(pet_type)
+        return prior.table if prior is not None else None
+
+    def species(self):
+        return [prior.species for prior in self._priors.values()]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            prior.species: {**prior.table.stats(), "breed_weight": prior.breed_weight,
+                            "behavior_weight": prior.behavior_weight}
+            for prior in self._priors.values()
+        }
+
+
+prior_tables = PriorTableRegistry(
+    PRIOR_TABLES,
+    reload_interval=BREED_SCORES_RELOAD_INTERVAL,
+    match_threshold=BREED_MATCH_THRESHOLD,
+    mmap_min_rows=PRIOR_MMAP_MIN_ROWS,
+    cache_dir=PRIOR_CACHE_DIR
+)
@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+from config import DB_CONFIG
+from mbti_calculator import calculate_mbti_batch, scores_to_dicts, mbti_input_hash, score_row_values
+
+# 批量重新计算 survey_data 中所有提交的 mbti_scores（同时更新分数列和 mbti_input_hash）
+#   python rescore.py --chunk-size 5000 --checkpoint rescore.checkpoint
+# 中断后用同样的参数重新运行即可从上次提交的 submission_id 之后继续
+
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rescore.checkpoint')
+
+
+def read_checkpoint(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        content = f.read().strip()
+    return int(content) if content else 0
+
+
+def write_checkpoint(path: str, submission_id: int):
+    # 先写临时文件再替换，避免中途崩溃留下半个文件
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(str(submission_id))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_scores(conn, rows):
+    # 一条 UPDATE ... FROM (VALUES ...) 写回整个分块
+    with conn.cursor() as cur:
+        execute_values(cur, """
+            UPDATE survey_data AS s
+            SET mbti_scores = v.mbti_scores::jsonb,
+                mbti_e_i = v.mbti_e_i,
+                mbti_s_n = v.mbti_s_n,
+                mbti_t_f = v.mbti_t_f,
+                mbti_j_p = v.mbti_j_p,
+                mbti_input_hash = v.mbti_input_hash
+            FROM (VALUES %s) AS v(submission_id, mbti_scores, mbti_e_i, mbti_s_n, mbti_t_f, mbti_j_p, mbti_input_hash)
+            WHERE s.submission_id = v.submission_id
+        """, rows, template="(%s, %s, %s::float8, %s::float8, %s::float8, %s::float8, %s)", page_size=len(rows))
+    conn.commit()
+
+
+def rescore(chunk_size: int, checkpoint_path: str, start_after: int = None, limit: int = None):
+    last_id = read_checkpoint(checkpoint_path) if start_after is None else start_after
+    print(f"Rescoring survey_data after submission_id {last_id}")
+
+    read_conn = psycopg2.connect(**DB_CONFIG)
+    write_conn = psycopg2.connect(**DB_CONFIG)
+    total = 0
+    failed = 0
+    started = time.perf_counter()
+    try:
+        # 命名游标 = 服务端游标，每次只把一个分块拉到内存
+        cur = read_conn.cursor(name='rescore_survey_data')
+        cur.itersize = chunk_size
+        cur.execute("""
+            SELECT submission_id, pet_type, pet_breed, personality_behavior
+            FROM survey_data
+            WHERE submission_id > %s
+            ORDER BY submission_id
+        """, (last_id,))
+
+        while True:
+            chunk = cur.fetchmany(chunk_size)
+            if not chunk:
+                break
+            submission_ids = [row[0] for row in chunk]
+            scores = calculate_mbti_batch(
+                [row[3] for row in chunk],
+                [row[1] for row in chunk],
+                [row[2] for row in chunk],
+                on_error="skip"
+            )
+            ok = ~np.isnan(scores).any(axis=1)
+            updates = [
+                (submission_id, json.dumps(score), *score_row_values(score), mbti_input_hash(row[3], row[1], row[2]))
+                for submission_id, row, score, row_ok in zip(submission_ids, chunk, scores_to_dicts(scores), ok)
+                if row_ok
+            ]
+            if updates:
+                write_scores(write_conn, updates)
+
+            last_id = submission_ids[-1]
+            write_checkpoint(checkpoint_path, last_id)
+
+            total += len(chunk)
+            failed += len(chunk) - len(updates)
+            elapsed = time.perf_counter() - started
+            print(f"Rescored {total} rows ({failed} failed), last submission_id {last_id}, "
+                  f"{total / elapsed:.0f} rows/s")
+
+            if limit is not None and total >= limit:
+                break
+        cur.close()
+    finally:
+        read_conn.close()
+        write_conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Done: {total} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s), {failed} failed")
+    return {"rows": total, "failed": failed, "last_submission_id": last_id}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute mbti_scores for every row in survey_data")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT)
+    parser.add_argument('--start-after', type=int, default=None,
+                        help="Ignore the checkpoint and start after this submission_id")
+    parser.add_argument('--limit', type=int, default=None, help="Stop after roughly this many rows")
+    args = parser.parse_args()
+    rescore(args.chunk_size, args.checkpoint, args.start_after, args.limit)
+
+
+if __name__ == "__main__":
+    main()
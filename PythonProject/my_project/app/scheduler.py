@@ -0,0 +1,215 @@
+import random
+import time
+from typing import Dict, Optional
+import redis
+from kombu import Queue
+from config import (
+    AI_INTERACTIVE_QUEUE, AI_BACKFILL_QUEUE, AI_RATE_LIMIT_RPM, AI_RATE_LIMIT_TPM, AI_RATE_LIMIT_BURST_SECONDS,
+    AI_RATE_BACKFILL_RESERVE, AI_TASK_RETRY_BACKOFF, AI_TASK_RETRY_BACKOFF_MAX
+)
+from instrumentation import AI_RATE_LIMIT_WAIT_SECONDS, AI_RATE_LIMITED, CELERY_QUEUE_DEPTH
+from notifications import redis_client
+
+# AI 任务的调度：交互式提交和回填（积压分发、批量重算）走两个 Celery 队列，worker 总是先取交互式队列；
+# 调用 AI 服务前从 Redis 上的令牌桶取额度（每分钟请求数、每分钟 token 数，所有 worker 共用），
+# 额度不够、被限流或 AI 服务暂时不可用时任务延后重试，而不是直接失败。
+
+# 两个桶一起检查、一起扣减，时间用 Redis 服务器的时钟。桶满时可以一次用掉 burst_seconds 秒的额度。
+# 回填任务只能用到桶里高于 reserve 比例的部分，剩下的留给交互式提交。
+# 返回 0 表示已扣减，否则是需要等待的毫秒数
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local burst = tonumber(ARGV[1])
+local reserve = tonumber(ARGV[2])
+local cooldown = redis.call('PTTL', KEYS[3])
+if cooldown > 0 then
+    return cooldown
+end
+local wait = 0
+local levels = {}
+for i = 1, 2 do
+    local per_minute = tonumber(ARGV[i * 2 + 1])
+    local cost = tonumber(ARGV[i * 2 + 2])
+    if per_minute > 0 then
+        local rate = per_minute / 60000.0
+        local capacity = math.max(per_minute * burst / 60.0, 1)
+        cost = math.min(cost, capacity * (1 - reserve))
+        local state = redis.call('HMGET', KEYS[i], 'level', 'ts')
+        local level = tonumber(state[1]) or capacity
+        local ts = tonumber(state[2]) or now_ms
+        level = math.min(capacity, level + math.max(0, now_ms - ts) * rate)
+        levels[i] = level - cost
+        local short = cost + capacity * reserve - level
+        if short > 0 then
+            wait = math.max(wait, math.ceil(short / rate))
+        end
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i = 1, 2 do
+    if levels[i] ~= nil then
+        redis.call('HSET', KEYS[i], 'level', levels[i], 'ts', now_ms)
+        redis.call('PEXPIRE', KEYS[i], 120000)
+    end
+end
+return 0
+"""
+
+# 退还一次扣减（AI 服务从缓存回答，没有调用 OpenAI）：先按时间补充，再加回同样的扣减量，不超过桶容量。
+# 键已过期说明桶是满的，不用退
+REFUND_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local burst = tonumber(ARGV[1])
+local reserve = tonumber(ARGV[2])
+for i = 1, 2 do
+    local per_minute = tonumber(ARGV[i * 2 + 1])
+    local cost = tonumber(ARGV[i * 2 + 2])
+    if per_minute > 0 then
+        local rate = per_minute / 60000.0
+        local capacity = math.max(per_minute * burst / 60.0, 1)
+        cost = math.min(cost, capacity * (1 - reserve))
+        local state = redis.call('HMGET', KEYS[i], 'level', 'ts')
+        if state[1] then
+            local ts = tonumber(state[2]) or now_ms
+            local level = math.min(capacity, tonumber(state[1]) + math.max(0, now_ms - ts) * rate + cost)
+            redis.call('HSET', KEYS[i], 'level', level, 'ts', now_ms)
+            redis.call('PEXPIRE', KEYS[i], 120000)
+        end
+    end
+end
+return 0
+"""
+
+
+class RetryableError(Exception):
+    """可以稍后重试的失败：限流、AI 服务网关错误（502/503/504）、超时、连接失败。retry_after 为服务端要求的最短等待秒数。"""
+
+    def __init__(self, message: str, reason: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """OpenAI 限额的令牌桶，状态放在 Redis 里，所有 worker 进程共用。Redis 不可用时放行（和没有限流一样）。"""
+
+    def __init__(self, client: redis.Redis, rpm: int, tpm: int, burst_seconds: float = 6.0,
+                 backfill_reserve: float = 0.2, key_prefix: str = "ai_rate:"):
+        self.client = client
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst_seconds = burst_seconds
+        self.backfill_reserve = backfill_reserve
+        self.keys = [f"{key_prefix}requests", f"{key_prefix}tokens", f"{key_prefix}cooldown"]
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._refund_script = client.register_script(REFUND_SCRIPT)
+        self.counters = {"acquired": 0, "waited": 0, "deferred": 0, "refunded": 0, "redis_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.rpm > 0 or self.tpm > 0
+
+    def try_acquire(self, tokens: int, priority: str = "interactive") -> float:
+        """取一次请求和 tokens 个 token 的额度；成功返回 0，否则返回还要等多少秒。"""
+        if not self.enabled:
+            return 0.0
+        reserve = self.backfill_reserve if priority == "backfill" else 0.0
+        try:
+            wait_ms = self._script(keys=self.keys, args=[self.burst_seconds, reserve, self.rpm, 1, self.tpm, tokens])
+        except redis.RedisError as e:
+            self.counters["redis_errors"] += 1
+            print(f"Rate limiter unavailable, not limiting: {str(e)}")
+            return 0.0
+        return int(wait_ms) / 1000
+
+    def acquire(self, tokens: int, priority: str = "interactive", max_wait: float = 2.0):
+        """最多等 max_wait 秒；等不到时抛出 RetryableError，由任务延后重试，不占着 worker。"""
+        started = time.monotonic()
+        while True:
+            wait = self.try_acquire(tokens, priority)
+            if wait <= 0:
+                waited = time.monotonic() - started
+                AI_RATE_LIMIT_WAIT_SECONDS.labels(priority).observe(waited)
+                self.counters["acquired"] += 1
+                if waited > 0:
+                    self.counters["waited"] += 1
+                return
+            remaining = max_wait - (time.monotonic() - started)
+            if wait > remaining:
+                AI_RATE_LIMITED.labels(priority).inc()
+                self.counters["deferred"] += 1
+                raise RetryableError(f"Rate limit budget exhausted, next slot in {wait:.1f}s", "rate_limited", wait)
+            time.sleep(wait + random.uniform(0, 0.05))
+
+    def refund(self, tokens: int, priority: str = "interactive"):
+        """退还 acquire 取走的额度，参数和 acquire 时相同。"""
+        if not self.enabled:
+            return
+        reserve = self.backfill_reserve if priority == "backfill" else 0.0
+        try:
+            self._refund_script(keys=self.keys, args=[self.burst_seconds, reserve, self.rpm, 1, self.tpm, tokens])
+        except redis.RedisError as e:
+            self.counters["redis_errors"] += 1
+            print(f"Error refunding rate limit budget: {str(e)}")
+            return
+        self.counters["refunded"] += 1
+
+    def penalize(self, seconds: float):
+        # AI 服务返回 429 时让所有 worker 一起暂停，而不是各自撞一次限流
+        try:
+            self.client.set(self.keys[2], 1, px=max(1, int(seconds * 1000)))
+        except redis.RedisError as e:
+            self.counters["redis_errors"] += 1
+            print(f"Error setting rate limit cooldown: {str(e)}")
+
+    def stats(self) -> Dict[str, object]:
+        return {"rpm": self.rpm, "tpm": self.tpm, "burst_seconds": self.burst_seconds,
+                "backfill_reserve": self.backfill_reserve, **self.counters}
+
+
+def retry_countdown(retries: int, retry_after: Optional[float] = None) -> float:
+    # 指数退避加抖动（在 [d/2, d] 之间随机），不短于服务端给的 Retry-After
+    delay = min(AI_TASK_RETRY_BACKOFF_MAX, AI_TASK_RETRY_BACKOFF * (2 ** retries))
+    return max(retry_after or 0.0, random.uniform(delay / 2, delay))
+
+
+def configure_queues(celery_app):
+    """单条提交走交互式队列，批量回填走回填队列。worker 按 -Q 列出的顺序（默认按下面的顺序）取任务，
+    交互式队列里有任务时不会去取回填任务；每次只预取一个，回填任务不会堆在 worker 本地。"""
+    celery_app.conf.task_queues = (Queue(AI_INTERACTIVE_QUEUE), Queue(AI_BACKFILL_QUEUE))
+    celery_app.conf.task_default_queue = AI_INTERACTIVE_QUEUE
+    celery_app.conf.task_routes = {
+        "tasks.process_ai_task": {"queue": AI_INTERACTIVE_QUEUE},
+        "tasks.process_ai_batch": {"queue": AI_BACKFILL_QUEUE},
+        "tasks.dispatch_pending_submissions": {"queue": AI_BACKFILL_QUEUE},
+    }
+    celery_app.conf.broker_transport_options = {
+        **(celery_app.conf.broker_transport_options or {}), "queue_order_strategy": "priority"
+    }
+    celery_app.conf.worker_prefetch_multiplier = 1
+    return celery_app
+
+
+def queue_depths() -> Dict[str, Optional[int]]:
+    # Redis broker 里每个队列是一个列表；延后重试的任务由 worker 持有，不在列表里
+    depths = {}
+    for queue in (AI_INTERACTIVE_QUEUE, AI_BACKFILL_QUEUE):
+        try:
+            depths[queue] = redis_client.llen(queue)
+            CELERY_QUEUE_DEPTH.labels(queue).set(depths[queue])
+        except redis.RedisError:
+            depths[queue] = None
+    return depths
+
+
+rate_limiter = RateLimiter(
+    redis_client,
+    rpm=AI_RATE_LIMIT_RPM,
+    tpm=AI_RATE_LIMIT_TPM,
+    burst_seconds=AI_RATE_LIMIT_BURST_SECONDS,
+    backfill_reserve=AI_RATE_BACKFILL_RESERVE
+)
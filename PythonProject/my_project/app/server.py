@@ -1,73 +1,190 @@
-from flask import Flask, request, jsonify
-import json
-import psycopg2
-from config import DB_CONFIG
-from tasks import process_ai_task
+import time
+from flask import Flask, request, jsonify, g
+import redis
+from config import (
+    WAIT_RESULT_DEFAULT_TIMEOUT, WAIT_RESULT_MAX_TIMEOUT, RESULT_CACHE_CONTROL,
+    INGEST_MODE, INGEST_SUBMIT_TIMEOUT, RECEIVE_BATCH_MAX_SIZE
+)
+from db import db_pool, get_db
+from mbti_calculator import DIMENSIONS
+from ingest import enqueue_submissions, ingest_buffer, insert_surveys, survey_row
+from instrumentation import HTTP_REQUEST_SECONDS, log_event, metrics_response
+from notifications import ResultSubscription
+from percentile_index import percentile_index
+from prior_tables import prior_tables
+from scheduler import queue_depths
+from submission_cache import submission_cache
+from tracing import timed_query, tracer
 
 app = Flask(__name__)
 
-def connect_db():
-    return psycopg2.connect(**DB_CONFIG)
+# 进程启动就开始建百分位索引，不等第一次 /percentiles 请求
+percentile_index.start()
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # 按路由模板统计（/get_result/<int:submission_id>），不按具体 id
+    started = g.pop("started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(time.perf_counter() - started)
+    return response
 
 @app.route('/receive_data', methods=['POST'])
 def receive_data():
     data = request.json
-    conn = connect_db()
-    cursor = conn.cursor()
-    print(data)
-    # 1. Flask API Stores Data in PostgreSQL
-    cursor.execute("""
-        INSERT INTO survey_data (
-            email, ip, pet_type, pet_name, pet_breed, 
-            pet_gender, pet_age, personality_behavior
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING submission_id;
-    """, (
-        data["survey_data"]["user_info"]["email"], 
-        data["survey_data"]["user_info"]["ip"],
-        data["survey_data"]["pet_info"]["PetSpecies"],
-        data["survey_data"]["pet_info"]["PetName"],
-        data["survey_data"]["pet_info"]["PetBreed"],
-        data["survey_data"]["pet_info"]["PetGender"],
-        data["survey_data"]["pet_info"]["PetAge"],
-        json.dumps(data["survey_data"]["personality_and_behavior"])
-    ))
-
-    submission_id = cursor.fetchone()[0]
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-    # 2. Flask Queues Task for Celery to Process AI
-    process_ai_task.delay(submission_id)
+    # 每个提交一个 trace（按 TRACE_SAMPLE_RATE 抽样），经 Celery 任务一直传到 AI 服务
+    with tracer.span("receive_data", root=True, ingest_mode=INGEST_MODE) as span:
+        # 1. Flask API Stores Data in PostgreSQL
+        row = survey_row(data)
+        if INGEST_MODE == 'buffered':
+            # 和其他请求合并成一次多行插入；等到事务提交、任务入队后才返回
+            with tracer.span("ingest.buffer"):
+                submission_id = ingest_buffer.submit(row).result(timeout=INGEST_SUBMIT_TIMEOUT)
+        else:
+            submission_id = insert_surveys([row])[0]
 
+            # 2. Flask Queues Task for Celery to Process AI
+            enqueue_submissions([submission_id])
+        span.set(submission_id=submission_id, pet_type=row[2])
+
+    log_event("receive_data", submission_id=submission_id, pet_type=row[2], ingest_mode=INGEST_MODE,
+              trace_id=span.context.trace_id if span.context is not None else None)
     return jsonify({"status": "processing", "submission_id": submission_id}), 202
 
+@app.route('/receive_data_batch', methods=['POST'])
+def receive_data_batch():
+    # 请求体是 /receive_data 请求体组成的数组，一个事务插入，任务整批入队
+    surveys = request.json
+    if not isinstance(surveys, list) or not surveys:
+        return jsonify({"status": "error", "error": "Expected a non-empty JSON array of surveys"}), 400
+    if len(surveys) > RECEIVE_BATCH_MAX_SIZE:
+        return jsonify({"status": "error", "error": f"At most {RECEIVE_BATCH_MAX_SIZE} surveys per request"}), 413
+
+    rows = []
+    for index, data in enumerate(surveys):
+        try:
+            rows.append(survey_row(data))
+        except (KeyError, TypeError) as e:
+            return jsonify({"status": "error", "error": f"Invalid survey at index {index}: missing {str(e)}"}), 400
+
+    submission_ids = insert_surveys(rows)
+    enqueue_submissions(submission_ids)
+
+    return jsonify({"status": "processing", "submission_ids": submission_ids}), 202
+
+def fetch_result(submission_id):
+    with get_db() as conn, conn.cursor() as cursor, timed_query("fetch_result"):
+        cursor.execute("""
+            SELECT ai_output_text, generated_at 
+            FROM survey_data 
+            WHERE submission_id = %s;
+        """, (submission_id,))
+        return cursor.fetchone()
+
+def completed_response(entry):
+    # 结果生成后不会再变，带上 ETag 让浏览器可以用 If-None-Match 复用
+    if request.if_none_match.contains(entry["etag"]):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify({
+            "status": "completed", 
+            "ai_output": {
+                "text": entry["text"],
+                "generated_at": entry["generated_at"]
+            }
+        })
+    response.set_etag(entry["etag"])
+    response.headers["Cache-Control"] = RESULT_CACHE_CONTROL
+    return response
+
+def processing_response():
+    response = jsonify({"status": "processing"})
+    response.headers["Cache-Control"] = "no-store"
+    return response, 202
+
 @app.route('/get_result/<int:submission_id>', methods=['GET'])
 def get_result(submission_id):
-    conn = connect_db()
-    cursor = conn.cursor()
-
-    # 6. Frontend Requests AI Results from Flask
-    cursor.execute("""
-        SELECT ai_output_text, generated_at 
-        FROM survey_data 
-        WHERE submission_id = %s;
-    """, (submission_id,))
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    print(result)
-    if not result or not result[0]:
-        return jsonify({"status": "processing"}), 202
+    # 6. Frontend Requests AI Results from Flask（先查缓存，未命中再查库并回填）
+    entry = submission_cache.get(submission_id)
+    if entry is None:
+        result = fetch_result(submission_id)
+        log_event("get_result", submission_id=submission_id, completed=bool(result and result[0]))
+        if not result or not result[0]:
+            return processing_response()
+        entry = submission_cache.set(submission_id, result[0], result[1].isoformat() if result[1] else None)
+
+    return completed_response(entry)
+
+@app.route('/wait_result/<int:submission_id>', methods=['GET'])
+def wait_result(submission_id):
+    # 长轮询：等待 Celery 任务的完成通知，等待期间不查询数据库
+    timeout = min(request.args.get('timeout', WAIT_RESULT_DEFAULT_TIMEOUT, type=float), WAIT_RESULT_MAX_TIMEOUT)
+    entry = submission_cache.get(submission_id)
+    if entry is not None:
+        return completed_response(entry)
+    try:
+        with ResultSubscription(submission_id) as subscription:
+            # 订阅之后查一次库，防止任务在订阅前已经完成
+            result = fetch_result(submission_id)
+            if result and result[0]:
+                entry = submission_cache.set(submission_id, result[0], result[1].isoformat() if result[1] else None)
+                return completed_response(entry)
+
+            event = subscription.wait(max(timeout, 0))
+    except redis.RedisError as e:
+        # Redis 不可用时退化成普通的一次查询
+        log_event("result_wait_error", sample_rate=1, submission_id=submission_id, error=str(e))
+        return get_result(submission_id)
+    if event is None:
+        return processing_response()
+    # 任务已经写过Redis层，这里只放进本进程的LRU
+    return completed_response(submission_cache.set(submission_id, event["text"], event["generated_at"], local_only=True))
+
+@app.route('/percentiles/<int:submission_id>', methods=['GET'])
+def get_percentiles(submission_id):
+    # 宠物的四个维度分数在所有宠物和同品种宠物中的百分位；索引在内存里，只查一次主键
+    with get_db() as conn, conn.cursor() as cursor, timed_query("fetch_scores"):
+        cursor.execute("""
+            SELECT pet_type, pet_breed, mbti_e_i, mbti_s_n, mbti_t_f, mbti_j_p
+            FROM survey_data
+            WHERE submission_id = %s;
+        """, (submission_id,))
+        row = cursor.fetchone()
+    if not row:
+        return jsonify({"status": "error", "error": "Submission not found"}), 404
+    if any(score is None for score in row[2:]):
+        return processing_response()
+
+    percentiles = percentile_index.lookup(dict(zip(DIMENSIONS, row[2:])), row[0], row[1])
+    if percentiles is None:
+        response = jsonify({"status": "unavailable"})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+    return jsonify({"status": "completed", "percentiles": percentiles})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # 队列长度在抓取时从 broker 读
+    queue_depths()
+    body, content_type = metrics_response()
+    return app.response_class(body, content_type=content_type)
 
+@app.route('/health', methods=['GET'])
+def health_check():
     return jsonify({
-        "status": "completed", 
-        "ai_output": {
-            "text": result[0],
-            "generated_at": result[1].isoformat() if result[1] else None
-        }
+        "status": "healthy",
+        "db_pool": db_pool.stats(),
+        "result_cache": submission_cache.stats(),
+        "percentile_index": percentile_index.stats(),
+        "prior_tables": prior_tables.stats(),
+        "ingest": ingest_buffer.stats() if INGEST_MODE == 'buffered' else None,
+        "tracing": tracer.stats(),
+        "queues": queue_depths()
     })
 
 if __name__ == "__main__":
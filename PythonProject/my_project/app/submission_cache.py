@@ -0,0 +1,110 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import redis
+from config import (
+    SUBMISSION_CACHE_MAX_ENTRIES, SUBMISSION_CACHE_TTL,
+    SUBMISSION_CACHE_REDIS, SUBMISSION_CACHE_REDIS_TTL
+)
+from notifications import redis_client
+
+
+def make_etag(text: str, generated_at: Optional[str]) -> str:
+    return hashlib.sha1(f"{generated_at}\n{text}".encode("utf-8")).hexdigest()
+
+
+class SubmissionResultCache:
+    """已完成结果的读穿缓存：进程内LRU + 可选的Redis层，按 submission_id 存储。
+
+    只缓存已经生成完的结果；任务写库时会更新Redis层，进程内LRU靠较短的TTL过期。
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300, redis_client: Optional[redis.Redis] = None,
+                 redis_ttl: float = 86400, key_prefix: str = "submission_result:"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self.redis_ttl = redis_ttl
+        self.key_prefix = key_prefix
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "redis_hits": 0, "misses": 0, "redis_errors": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _get_local(self, submission_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._entries.get(submission_id)
+            if item is None:
+                return None
+            expires_at, entry = item
+            if expires_at < time.monotonic():
+                del self._entries[submission_id]
+                return None
+            self._entries.move_to_end(submission_id)
+            return entry
+
+    def _set_local(self, submission_id: int, entry: Dict[str, Any]):
+        with self._lock:
+            self._entries[submission_id] = (time.monotonic() + self.ttl, entry)
+            self._entries.move_to_end(submission_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, submission_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._get_local(submission_id)
+        if entry is not None:
+            self._count("memory_hits")
+            return entry
+        if self.redis_client is not None:
+            try:
+                raw = self.redis_client.get(self.key_prefix + str(submission_id))
+            except redis.RedisError as e:
+                self._count("redis_errors")
+                print(f"Error reading cached result {submission_id}: {str(e)}")
+                raw = None
+            if raw is not None:
+                entry = json.loads(raw)
+                self._set_local(submission_id, entry)
+                self._count("redis_hits")
+                return entry
+        self._count("misses")
+        return None
+
+    def set(self, submission_id: int, text: str, generated_at: Optional[str], local_only: bool = False) -> Dict[str, Any]:
+        entry = {"text": text, "generated_at": generated_at, "etag": make_etag(text, generated_at)}
+        self._set_local(submission_id, entry)
+        if self.redis_client is not None and not local_only:
+            try:
+                self.redis_client.set(self.key_prefix + str(submission_id), json.dumps(entry), ex=int(self.redis_ttl))
+            except redis.RedisError as e:
+                self._count("redis_errors")
+                print(f"Error caching result {submission_id}: {str(e)}")
+        return entry
+
+    def invalidate(self, submission_id: int):
+        with self._lock:
+            self._entries.pop(submission_id, None)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(self.key_prefix + str(submission_id))
+            except redis.RedisError as e:
+                self._count("redis_errors")
+                print(f"Error invalidating cached result {submission_id}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, "memory_entries": len(self._entries), "redis_enabled": self.redis_client is not None}
+
+
+submission_cache = SubmissionResultCache(
+    max_entries=SUBMISSION_CACHE_MAX_ENTRIES,
+    ttl=SUBMISSION_CACHE_TTL,
+    redis_client=redis_client if SUBMISSION_CACHE_REDIS else None,
+    redis_ttl=SUBMISSION_CACHE_REDIS_TTL
+)
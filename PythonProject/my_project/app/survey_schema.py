@@ -0,0 +1,164 @@
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+# personality_behavior 问卷的声明式定义：每道题属于哪个分组、对应哪个MBTI维度、怎么解析、方向如何。
+# 计分（mbti_calculator）从这里生成的解析器读取问卷。
+
+DIMENSIONS = ["E/I", "S/N", "T/F", "J/P"]
+
+
+class SurveySchemaError(ValueError):
+    """问卷缺少分组或题目，或者分组不是字典。"""
+
+
+def parse_percent(value: Any) -> float:
+    # 滑块题："55)" 这样的字符串或数字；空值、"Null" 和无法解析的值为0，视为未作答
+    if value is None or value == "" or value == 0 or value == "Null":
+        return 0.0
+    if isinstance(value, str):
+        value = value.strip(')')
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+def choice_parser(positive: str) -> Callable[[Any], float]:
+    # 二选一题：只有和 positive 完全相同的作答为100，其余都是0
+    def parse(value: Any) -> float:
+        return 100.0 if value == positive else 0.0
+    return parse
+
+
+class Question(NamedTuple):
+    group: str
+    key: str
+    dimension: str
+    parser: Callable[[Any], float] = parse_percent
+    # 1 表示分数越高越偏向维度右侧；-1 表示反向题，有效分数按 100 - 分数 计
+    polarity: int = 1
+
+
+# 列顺序就是解析结果向量的顺序，每个维度三道题
+SURVEY_SCHEMA: Tuple[Question, ...] = (
+    # Energy & Socialization (E vs. I)
+    Question("Energy_Socialization", "seek_attention", "E/I"),
+    Question("Energy_Socialization", "interact_with_toys", "E/I"),
+    Question("Energy_Socialization", "stranger_enter_territory", "E/I"),
+    # Routine vs. Curiosity (S vs. N)
+    Question("Routin_Curiosity", "prefer_routine", "S/N"),
+    Question("Routin_Curiosity", "friend_visit_behaviors", "S/N"),
+    Question("Routin_Curiosity", "fur_care_7days", "S/N"),
+    # Decision-Making (T vs. F)
+    Question("Decision_Making", "react_when_sad", "T/F"),
+    Question("Decision_Making", "toy_out_of_reach", "T/F", choice_parser("Keep trying")),
+    Question("Decision_Making", "react_new_friend", "T/F"),
+    # Structure vs. Spontaneity (J vs. P)
+    Question("Structure_Spontaneity", "react_new_environment", "J/P"),
+    Question("Structure_Spontaneity", "respond_to_scold", "J/P"),
+    Question("Structure_Spontaneity", "follow_commands", "J/P"),
+)
+
+# 分组名的其他写法：线上数据里是拼错的 Routin_Curiosity，也接受改正后的拼写
+GROUP_ALIASES = {
+    "Routin_Curiosity": ("Routin_Curiosity", "Routine_Curiosity"),
+}
+
+
+def reverse_score(value: float) -> float:
+    return 100.0 - value if value > 0 else value
+
+
+class SurveyExtractor:
+    """由问卷定义预先生成的解析器：按分组只查一次字典，一遍得到定长的分数向量。
+
+    构造时把问卷定义编译成一个直线代码的函数（没有循环和逐题的判断）；
+    遇到分组别名、缺题或类型不对时退回逐题检查的慢路径，给出具体的错误信息。
+    """
+
+    def __init__(self, schema: Sequence[Question] = SURVEY_SCHEMA, group_aliases: Dict[str, Tuple[str, ...]] = None):
+        self.schema = tuple(schema)
+        self.group_aliases = GROUP_ALIASES if group_aliases is None else group_aliases
+        self.width = len(self.schema)
+        self.dimensions = [dimension for dimension in DIMENSIONS if any(q.dimension == dimension for q in self.schema)]
+        # 每个维度在向量中的列号
+        self.dimension_columns = {
+            dimension: [i for i, q in enumerate(self.schema) if q.dimension == dimension]
+            for dimension in self.dimensions
+        }
+        # 按分组预先整理好 (题目名, 解析函数, 是否反向)，保持每组在向量中的列号
+        groups: Dict[str, List[Tuple[int, str, Callable[[Any], float], bool]]] = {}
+        for i, q in enumerate(self.schema):
+            groups.setdefault(q.group, []).append((i, q.key, q.parser, q.polarity < 0))
+        self._plan = tuple(
+            (group, self.group_aliases.get(group, (group,)), tuple(questions))
+            for group, questions in groups.items()
+        )
+        self._fast = self._compile(groups)
+
+    def _compile(self, groups) -> Callable[[Dict[str, Any]], List[float]]:
+        # 作答的取值很少（"0)".."100)"、空值、选项文字），每个解析函数配一个有上限的结果缓存，
+        # 命中时只需一次字典查询
+        namespace: Dict[str, Any] = {"reverse_score": reverse_score}
+        memo_names: Dict[Callable[[Any], float], str] = {}
+        lines = ["def extract(payload):"]
+        items = [""] * self.width
+        for g, (group, questions) in enumerate(groups.items()):
+            lines.append(f"    g{g} = payload[{group!r}]")
+            for i, key, parse, reverse in questions:
+                if parse not in memo_names:
+                    m = f"m{len(memo_names)}"
+                    memo_names[parse] = m
+                    namespace[m] = {}
+                    namespace[f"fill_{m}"] = self._memo_filler(parse, namespace[m])
+                m = memo_names[parse]
+                lines.append(f"    v = g{g}[{key!r}]")
+                lines.append(f"    x{i} = {m}.get(v)")
+                lines.append(f"    if x{i} is None:")
+                lines.append(f"        x{i} = fill_{m}(v)")
+                items[i] = f"reverse_score(x{i})" if reverse else f"x{i}"
+        lines.append("    return [" + ", ".join(items) + "]")
+        exec(compile("\n".join(lines), f"<survey extractor {id(self):x}>", "exec"), namespace)
+        return namespace["extract"]
+
+    @staticmethod
+    def _memo_filler(parse: Callable[[Any], float], memo: Dict[Any, float],
+                     max_entries: int = 4096) -> Callable[[Any], float]:
+        def fill(value: Any) -> float:
+            result = parse(value)
+            if len(memo) < max_entries:
+                memo[value] = result
+            return result
+        return fill
+
+    def _group(self, payload: Dict[str, Any], group: str, names: Tuple[str, ...]) -> Dict[str, Any]:
+        for name in names:
+            answers = payload.get(name)
+            if answers is not None:
+                if not isinstance(answers, dict):
+                    raise SurveySchemaError(f"personality_behavior group {group!r} is not an object")
+                return answers
+        raise SurveySchemaError(f"personality_behavior is missing group {group!r}")
+
+    def _extract(self, payload: Dict[str, Any]) -> List[float]:
+        if not isinstance(payload, dict):
+            raise SurveySchemaError("personality_behavior is not an object")
+        row = [0.0] * self.width
+        for group, names, questions in self._plan:
+            answers = self._group(payload, group, names)
+            for i, key, parse, reverse in questions:
+                try:
+                    value = parse(answers[key])
+                except KeyError:
+                    raise SurveySchemaError(f"personality_behavior is missing question {group}.{key}") from None
+                row[i] = reverse_score(value) if reverse else value
+        return row
+
+    def __call__(self, payload: Dict[str, Any]) -> List[float]:
+        # 计分用的向量：反向题已经翻转
+        try:
+            return self._fast(payload)
+        except (KeyError, TypeError, AttributeError):
+            return self._extract(payload)
+
+
+behavior_extractor = SurveyExtractor()
@@ -1,72 +1,174 @@
 from celery import Celery
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import RealDictCursor, execute_values
 import json
 import requests
-from typing import Dict, Any
-from config import DB_CONFIG, AI_SERVER_URL, REDIS_URL
-from mbti_calculator import calculate_mbti
+from typing import Dict, Any, List, Optional, Sequence
+from config import (
+    REDIS_URL, AI_MAX_CONCURRENCY, AI_TASK_CHUNK_SIZE, AI_TASK_MAX_ATTEMPTS, AI_TASK_MAX_RETRIES,
+    AI_ESTIMATED_TOKENS, AI_RATE_LIMIT_MAX_WAIT,
+    PENDING_DISPATCH_INTERVAL, PENDING_DISPATCH_MIN_AGE, PENDING_DISPATCH_REDISPATCH_AFTER, PENDING_DISPATCH_LIMIT
+)
+from ai_client import ai_client
+from db import get_db
+from instrumentation import SCORING_ROWS, SCORING_SECONDS, TASK_RETRIES, install_celery_metrics, log_event
+from notifications import publish_result, publish_scores
+from scheduler import RetryableError, configure_queues, rate_limiter, retry_countdown
+from submission_cache import submission_cache
+from tracing import install_celery_tracing, timed_query, tracer
+from mbti_calculator import (
+    DIMENSIONS, SCORE_COLUMNS, calculate_mbti, calculate_mbti_batch, scores_to_dicts, mbti_input_hash, score_row_values
+)
 
 app = Celery('tasks', broker=REDIS_URL)
+# 单条提交和批量回填分两个队列，worker 先取交互式队列：celery -A tasks worker -Q ai_interactive,ai_backfill
+configure_queues(app)
+# 排队时间（入队 -> 开始执行）和任务耗时；带 traceparent 的任务接着上游的 trace 记录 span
+install_celery_metrics(app)
+install_celery_tracing(app)
 
-@app.task
-def process_ai_task(task_id: int):
+if PENDING_DISPATCH_INTERVAL > 0:
+    # 需要同时运行 celery beat 才会定时触发
+    app.conf.beat_schedule = {
+        "dispatch-pending-submissions": {
+            "task": "tasks.dispatch_pending_submissions",
+            "schedule": PENDING_DISPATCH_INTERVAL,
+        }
+    }
+
+
+def build_ai_input(pet_data: Dict[str, Any], mbti_scores: Dict[str, float]) -> Dict[str, Any]:
+    return {
+        "pet_name": pet_data['pet_name'],
+        "pet_type": pet_data['pet_type'],
+        "pet_breed": pet_data['pet_breed'],
+        "mbti_scores": mbti_scores
+    }
+
+
+def stored_scores(pet_data: Dict[str, Any], input_hash: str) -> Optional[Dict[str, float]]:
+    # 输入哈希没变且分数齐全时直接用已保存的分数
+    if pet_data.get('mbti_input_hash') != input_hash:
+        return None
+    values = [pet_data.get(column) for column in SCORE_COLUMNS]
+    if any(value is None for value in values):
+        return None
+    return dict(zip(DIMENSIONS, values))
+
+
+def already_processed(pet_data: Dict[str, Any], input_hash: str) -> bool:
+    # 重复投递/重试：AI结果已经按同样的输入生成过
+    return bool(pet_data.get('ai_output_text')) and pet_data.get('ai_input_hash') == input_hash
+
+
+def parse_retry_after(value: Optional[str], default: float = 1.0) -> float:
     try:
-        # 1. 从数据库读取宠物信息
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # 读取宠物信息
-        # cur.execute("""
-        #     SELECT p.*, s.personality_behavior
-        #     FROM pet_info p
-        #     JOIN survey_data s ON p.id = s.pet_id
-        #     WHERE p.id = %s
-        # """, (task_id,))
-        cur.execute("""
-            SELECT 
-                submission_id,
-                pet_type,
-                pet_name,
-                pet_breed,
-                pet_gender,
-                pet_age,
-                personality_behavior
-            FROM survey_data
-            WHERE submission_id = %s
-        """, (task_id,))
-        
-        pet_data = cur.fetchone()
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def request_ai(ai_input: Dict[str, Any], priority: str) -> Dict[str, Any]:
+    """先从共享限额里取一份额度再调用AI服务，AI服务从缓存回答时退还。
+    限流、网关错误和超时抛出 RetryableError，由任务延后重试。"""
+    rate_limiter.acquire(AI_ESTIMATED_TOKENS, priority, max_wait=AI_RATE_LIMIT_MAX_WAIT)
+    try:
+        ai_response = ai_client.analyze(ai_input)
+    except requests.exceptions.RequestException as e:
+        raise RetryableError(f"AI service unreachable: {str(e)}", "unavailable")
+    if ai_response.status_code == 429:
+        # OpenAI 限流：所有 worker 一起暂停到 Retry-After 之后
+        retry_after = parse_retry_after(ai_response.headers.get("Retry-After"))
+        rate_limiter.penalize(retry_after)
+        raise RetryableError(f"AI service rate limited: {ai_response.text}", "rate_limited", retry_after)
+    if ai_response.status_code in (502, 503, 504):
+        # 500 是AI服务内部错误（例如输出校验失败），重试也不会好，不在这里
+        raise RetryableError(f"AI service error: {ai_response.text}", "unavailable")
+    if ai_response.status_code != 200:
+        raise Exception(f"AI service error: {ai_response.text}")
+    if ai_response.headers.get("X-Cache", "").upper() == "HIT":
+        # 缓存命中或合并到了同样输入正在进行的调用，没有用掉 OpenAI 的额度
+        rate_limiter.refund(AI_ESTIMATED_TOKENS, priority)
+    return ai_response.json()
+
+
+def record_failure(task_id: int, error: str):
+    # 记下错误和尝试次数，积压分发（dispatch_pending_submissions）会在次数用完前重新处理
+    try:
+        with get_db() as conn, conn.cursor() as cur, timed_query("save_error"):
+            cur.execute("""
+                UPDATE survey_data
+                SET ai_error = %s,
+                    ai_attempts = COALESCE(ai_attempts, 0) + 1
+                WHERE submission_id = %s
+            """, (error, task_id))
+            conn.commit()
+    except Exception as e:
+        print(f"Error recording failure for task {task_id}: {str(e)}")
+
+
+@app.task(bind=True)
+def process_ai_task(self, task_id: int):
+    try:
+        # 1. 从数据库读取宠物信息（连接池取连接，调用AI期间不占用连接）
+        with get_db() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur, \
+                timed_query("load_submission"):
+            # 读取宠物信息
+            # cur.execute("""
+            #     SELECT p.*, s.personality_behavior
+            #     FROM pet_info p
+            #     JOIN survey_data s ON p.id = s.pet_id
+            #     WHERE p.id = %s
+            # """, (task_id,))
+            cur.execute("""
+                SELECT 
+                    submission_id,
+                    pet_type,
+                    pet_name,
+                    pet_breed,
+                    pet_gender,
+                    pet_age,
+                    personality_behavior,
+                    ai_output_text,
+                    mbti_input_hash,
+                    ai_input_hash,
+                    mbti_e_i, mbti_s_n, mbti_t_f, mbti_j_p
+                FROM survey_data
+                WHERE submission_id = %s
+            """, (task_id,))
+            
+            pet_data = cur.fetchone()
         if not pet_data:
             raise Exception(f"Pet data not found for task_id: {task_id}")
             
-        # 2. 计算MBTI分数
-        mbti_scores = calculate_mbti(
+        # 2. 计算MBTI分数；输入没变时跳过计分，结果已生成时连AI调用一起跳过
+        input_hash = mbti_input_hash(
             pet_data['personality_behavior'],
             pet_data['pet_type'],
             pet_data['pet_breed']
         )
+        if already_processed(pet_data, input_hash):
+            log_event("ai_skipped", task_id=task_id)
+            return {"status": "skipped", "task_id": task_id}
+
+        mbti_scores = stored_scores(pet_data, input_hash)
+        newly_scored = mbti_scores is None
+        if newly_scored:
+            with tracer.span("scoring"), SCORING_SECONDS.labels("single").time():
+                mbti_scores = calculate_mbti(
+                    pet_data['personality_behavior'],
+                    pet_data['pet_type'],
+                    pet_data['pet_breed']
+                )
+            SCORING_ROWS.labels("single").inc()
         
         # 3. 准备发送给AI服务的数据
-        ai_input = {
-            "pet_name": pet_data['pet_name'],
-            "pet_type": pet_data['pet_type'],
-            "pet_breed": pet_data['pet_breed'],
-            "mbti_scores": mbti_scores
-        }
-        
-        # 4. 调用AI服务
-        ai_response = requests.post(
-            f"{AI_SERVER_URL}/ai",
-            json={"input_data": ai_input},
-            timeout=30  # 增加超时时间
-        )
+        ai_input = build_ai_input(pet_data, mbti_scores)
         
-        if ai_response.status_code != 200:
-            raise Exception(f"AI service error: {ai_response.text}")
-            
-        ai_result = ai_response.json()
-        print(ai_result)
+        # 4. 调用AI服务（复用连接，网关错误、连接错误和超时自动重试；限额不够或被限流时整个任务延后重试）
+        ai_result = request_ai(ai_input, "interactive")
+        log_event("ai_result", task_id=task_id, newly_scored=newly_scored,
+                  labels=[ai_result.get(key) for key in ("m_label", "b_label", "t_label", "i_label")])
         # 5. 更新数据库中的AI结果
         # cur.execute("""
         #     UPDATE survey_data 
@@ -97,25 +199,266 @@ def process_ai_task(task_id: int):
         #     task_id
         # ))
 
-        cur.execute("""
-            UPDATE survey_data 
-            SET ai_output_text  = %s,
-                ai_processed = true,
-                generated_at = NOW()
-            WHERE submission_id = %s
-        """, (
-            json.dumps(ai_result),
-            task_id
-        ))
-        
-        conn.commit()
+        ai_output_text = json.dumps(ai_result)
+        with get_db() as conn, conn.cursor() as cur, timed_query("save_result"):
+            cur.execute("""
+                UPDATE survey_data 
+                SET ai_output_text  = %s,
+                    ai_processed = true,
+                    generated_at = NOW(),
+                    mbti_e_i = %s,
+                    mbti_s_n = %s,
+                    mbti_t_f = %s,
+                    mbti_j_p = %s,
+                    mbti_input_hash = %s,
+                    ai_input_hash = %s
+                WHERE submission_id = %s
+                RETURNING generated_at
+            """, (
+                ai_output_text,
+                *score_row_values(mbti_scores),
+                input_hash,
+                input_hash,
+                task_id
+            ))
+            row = cur.fetchone()
+            generated_at = row[0] if row else None
+            
+            conn.commit()
+
+        # 6. 更新结果缓存，并通知正在等待结果的客户端（/wait_result）
+        generated_at = generated_at.isoformat() if generated_at else None
+        with tracer.span("notify"):
+            submission_cache.set(task_id, ai_output_text, generated_at)
+            publish_result(task_id, ai_output_text, generated_at)
+            if newly_scored:
+                # 新保存的分数加入各API进程的百分位索引
+                publish_scores(task_id, pet_data['pet_type'], pet_data['pet_breed'], mbti_scores)
         return {"status": "success", "task_id": task_id}
-        
+
+    except RetryableError as e:
+        if self.request.retries < AI_TASK_MAX_RETRIES:
+            countdown = retry_countdown(self.request.retries, e.retry_after)
+            TASK_RETRIES.labels(self.name, e.reason).inc()
+            log_event("task_retry", task_id=task_id, reason=e.reason, retries=self.request.retries,
+                      countdown=round(countdown, 1), error=str(e))
+            raise self.retry(exc=e, countdown=countdown, max_retries=AI_TASK_MAX_RETRIES)
+        # 失败不抽样，每条都记
+        log_event("ai_error", sample_rate=1, task_id=task_id, reason=e.reason, retries=self.request.retries,
+                  error=str(e))
+        record_failure(task_id, str(e))
+        return {"status": "error", "task_id": task_id, "error": str(e)}
     except Exception as e:
-        print(f"Error processing task {task_id}: {str(e)}")
+        log_event("ai_error", sample_rate=1, task_id=task_id, error=str(e))
+        record_failure(task_id, str(e))
         return {"status": "error", "task_id": task_id, "error": str(e)}
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
+
+
+# 成功的行写入结果并清空错误；失败的行保留旧结果，只记录错误。两种行都在同一条 UPDATE 里。
+# 算出了分数的行（包括AI失败的行）同时保存分数和输入哈希，重试时不用再计分
+UPDATE_BATCH_RESULTS_SQL = """
+    UPDATE survey_data AS s
+    SET ai_output_text = COALESCE(v.ai_output_text, s.ai_output_text),
+        ai_processed = (v.ai_output_text IS NOT NULL) OR COALESCE(s.ai_processed, false),
+        generated_at = CASE WHEN v.ai_output_text IS NOT NULL THEN NOW() ELSE s.generated_at END,
+        ai_error = v.ai_error,
+        ai_attempts = COALESCE(s.ai_attempts, 0) + 1,
+        mbti_e_i = COALESCE(v.mbti_e_i, s.mbti_e_i),
+        mbti_s_n = COALESCE(v.mbti_s_n, s.mbti_s_n),
+        mbti_t_f = COALESCE(v.mbti_t_f, s.mbti_t_f),
+        mbti_j_p = COALESCE(v.mbti_j_p, s.mbti_j_p),
+        mbti_input_hash = CASE WHEN v.mbti_e_i IS NOT NULL THEN v.input_hash ELSE s.mbti_input_hash END,
+        ai_input_hash = CASE WHEN v.ai_output_text IS NOT NULL THEN v.input_hash ELSE s.ai_input_hash END
+    FROM (VALUES %s) AS v(submission_id, ai_output_text, ai_error,
+                          mbti_e_i, mbti_s_n, mbti_t_f, mbti_j_p, input_hash)
+    WHERE s.submission_id = v.submission_id
+    RETURNING s.submission_id, s.generated_at
+"""
+
+
+def chunked(items: Sequence[int], size: int) -> List[List[int]]:
+    return [list(items[i:i + size]) for i in range(0, len(items), size)]
+
+
+def call_ai(ai_input: Dict[str, Any]) -> str:
+    return json.dumps(request_ai(ai_input, "backfill"))
+
+
+@app.task(bind=True)
+def process_ai_batch(self, submission_ids: List[int]):
+    """一次处理多条提交：一次查询、批量计算分数、并发调用AI、一条UPDATE写回。
+
+    单条失败（数据缺失、分数计算失败、AI报错）只记录到该行的 ai_error，不影响同批其他行；
+    输入哈希没变的行复用已保存的分数，已有结果的行直接跳过。
+    限额不够、被限流或AI服务暂时不可用的行不算一次尝试，写回其他行后单独延后重试。
+    """
+    submission_ids = list(dict.fromkeys(submission_ids))
+    try:
+        # 1. 一次读出整批数据
+        with get_db() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur, \
+                timed_query("load_batch"):
+            cur.execute("""
+                SELECT
+                    submission_id,
+                    pet_type,
+                    pet_name,
+                    pet_breed,
+                    pet_gender,
+                    pet_age,
+                    personality_behavior,
+                    ai_output_text,
+                    mbti_input_hash,
+                    ai_input_hash,
+                    mbti_e_i, mbti_s_n, mbti_t_f, mbti_j_p
+                FROM survey_data
+                WHERE submission_id = ANY(%s)
+            """, (submission_ids,))
+            rows = cur.fetchall()
+    except Exception as e:
+        print(f"Error loading batch {submission_ids[:1]}..({len(submission_ids)}): {str(e)}")
+        return {"status": "error", "task_ids": submission_ids, "error": str(e)}
+
+    found = {row['submission_id'] for row in rows}
+    errors: Dict[int, str] = {
+        task_id: f"Pet data not found for task_id: {task_id}" for task_id in submission_ids if task_id not in found
+    }
+
+    # 2. 已经按同样输入生成过结果的行跳过；其余行能复用已保存分数的直接用，剩下的整批计算
+    input_hashes = {
+        row['submission_id']: mbti_input_hash(row['personality_behavior'], row['pet_type'], row['pet_breed'])
+        for row in rows
+    }
+    skipped = [row['submission_id'] for row in rows if already_processed(row, input_hashes[row['submission_id']])]
+    rows = [row for row in rows if row['submission_id'] not in skipped]
+    mbti_scores = {row['submission_id']: stored_scores(row, input_hashes[row['submission_id']]) for row in rows}
+    to_score = [row for row in rows if mbti_scores[row['submission_id']] is None]
+    if to_score:
+        # 解析失败的行为NaN
+        with SCORING_SECONDS.labels("batch").time():
+            scores = calculate_mbti_batch(
+                [row['personality_behavior'] for row in to_score],
+                [row['pet_type'] for row in to_score],
+                [row['pet_breed'] for row in to_score],
+                on_error="skip"
+            )
+        SCORING_ROWS.labels("batch").inc(len(to_score))
+        for row, row_scores in zip(to_score, scores_to_dicts(scores)):
+            mbti_scores[row['submission_id']] = row_scores
+
+    ai_inputs = {}
+    for row in rows:
+        row_scores = mbti_scores[row['submission_id']]
+        if any(score != score for score in row_scores.values()):
+            errors[row['submission_id']] = "Invalid personality_behavior data"
+        else:
+            ai_inputs[row['submission_id']] = build_ai_input(row, row_scores)
+
+    # 3. 并发调用AI服务，ai_client 的信号量限制同时在途的请求数
+    outputs: Dict[int, str] = {}
+    deferred: Dict[int, RetryableError] = {}
+    if ai_inputs:
+        with ThreadPoolExecutor(max_workers=min(AI_MAX_CONCURRENCY, len(ai_inputs))) as pool:
+            futures = {task_id: pool.submit(call_ai, ai_input) for task_id, ai_input in ai_inputs.items()}
+        for task_id, future in futures.items():
+            try:
+                outputs[task_id] = future.result()
+            except RetryableError as e:
+                if self.request.retries < AI_TASK_MAX_RETRIES:
+                    deferred[task_id] = e
+                else:
+                    errors[task_id] = str(e)
+            except Exception as e:
+                errors[task_id] = str(e)
+
+    # 4. 成功和失败的行一起写回；延后的行不写，下次重新计分
+    values = [
+        (task_id, outputs.get(task_id), errors.get(task_id), *score_row_values(mbti_scores[task_id]),
+         input_hashes[task_id])
+        for task_id in mbti_scores if task_id not in deferred
+    ]
+    generated = {}
+    if values:
+        try:
+            with get_db() as conn, conn.cursor() as cur, timed_query("save_batch"):
+                result = execute_values(cur, UPDATE_BATCH_RESULTS_SQL, values, template="(%s, %s::text, %s::text, %s::float8, %s::float8, %s::float8, %s::float8, %s::text)",
+                                        page_size=len(values), fetch=True)
+                conn.commit()
+            generated = dict(result)
+        except Exception as e:
+            print(f"Error saving batch {submission_ids[:1]}..({len(submission_ids)}): {str(e)}")
+            return {"status": "error", "task_ids": submission_ids, "error": str(e)}
+
+    # 5. 提交后再更新缓存并通知等待中的客户端
+    for task_id, ai_output_text in outputs.items():
+        generated_at = generated.get(task_id)
+        generated_at = generated_at.isoformat() if generated_at else None
+        submission_cache.set(task_id, ai_output_text, generated_at)
+        publish_result(task_id, ai_output_text, generated_at)
+    for row in to_score:
+        # 本批新保存的分数（包括AI失败的行）加入各API进程的百分位索引
+        row_scores = mbti_scores[row['submission_id']]
+        if not any(score != score for score in row_scores.values()):
+            publish_scores(row['submission_id'], row['pet_type'], row['pet_breed'], row_scores)
+    if errors:
+        # 每批一行，错误本身已经写进各行的 ai_error
+        log_event("ai_batch_errors", sample_rate=1, failed=len(errors),
+                  errors=[{"task_id": task_id, "error": error} for task_id, error in list(errors.items())[:5]])
+
+    if deferred:
+        # 延后的行作为同一个任务重试（retries 计数延续），等待时间不短于其中最长的 Retry-After
+        reason = next(iter(deferred.values())).reason
+        retry_after = max(e.retry_after or 0.0 for e in deferred.values())
+        countdown = retry_countdown(self.request.retries, retry_after)
+        TASK_RETRIES.labels(self.name, reason).inc()
+        log_event("batch_deferred", deferred=len(deferred), reason=reason, retries=self.request.retries,
+                  countdown=round(countdown, 1))
+        raise self.retry(args=[list(deferred)], countdown=countdown, max_retries=AI_TASK_MAX_RETRIES)
+
+    return {
+        "status": "success" if not errors else "partial",
+        "succeeded": list(outputs),
+        "skipped": skipped,
+        "failed": [{"task_id": task_id, "error": error} for task_id, error in errors.items()]
+    }
+
+
+def dispatch_submissions(submission_ids: Sequence[int], chunk_size: int = AI_TASK_CHUNK_SIZE) -> int:
+    # 按 chunk_size 切块，每块发一个 process_ai_batch 任务
+    chunks = chunked(submission_ids, chunk_size)
+    for chunk in chunks:
+        process_ai_batch.delay(chunk)
+    return len(chunks)
+
+
+@app.task
+def dispatch_pending_submissions(limit: int = PENDING_DISPATCH_LIMIT):
+    """把还没有结果的提交（入队丢失、任务失败但还没超过重试次数）分块交给 process_ai_batch。
+
+    用 FOR UPDATE SKIP LOCKED 加 ai_dispatched_at 认领，多个 beat/worker 同时运行也不会重复分发。
+    """
+    try:
+        with get_db() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE survey_data
+                SET ai_dispatched_at = NOW()
+                WHERE submission_id IN (
+                    SELECT submission_id
+                    FROM survey_data
+                    WHERE ai_output_text IS NULL
+                      AND COALESCE(ai_attempts, 0) < %s
+                      AND created_at < NOW() - make_interval(secs => %s)
+                      AND (ai_dispatched_at IS NULL OR ai_dispatched_at < NOW() - make_interval(secs => %s))
+                    ORDER BY created_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING submission_id
+            """, (AI_TASK_MAX_ATTEMPTS, PENDING_DISPATCH_MIN_AGE, PENDING_DISPATCH_REDISPATCH_AFTER, limit))
+            submission_ids = sorted(row[0] for row in cur.fetchall())
+            conn.commit()
+    except Exception as e:
+        print(f"Error dispatching pending submissions: {str(e)}")
+        return {"status": "error", "error": str(e)}
+
+    chunks = dispatch_submissions(submission_ids) if submission_ids else 0
+    return {"status": "success", "dispatched": len(submission_ids), "chunks": chunks}
@@ -0,0 +1,234 @@
+import argparse
+import json
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from config import TRACE_EXPORT
+
+# 从 tracing 导出的 span 文件（每行一个 JSON，API、worker、AI 服务可以写同一个文件，也可以分开传多个）汇总：
+#   python trace_report.py                              各阶段耗时分位数 + 关键路径占比 + 最慢的几个提交
+#   python trace_report.py spans.jsonl ai.jsonl --slowest 20
+#   python trace_report.py --submission 12345            单个提交的关键路径和 span 树
+# 关键路径：从 trace 结束时刻往回走，每一段时间归给当时最晚结束的那个 span（子 span 优先），
+# 所以并发的、不影响总耗时的 span 不计入；不在任何 span 里的时间（例如 span 之间的空隙）记为 (gap)。
+
+GAP = "(gap)"
+
+
+def span_end(span: Dict[str, Any]) -> float:
+    return span["start"] + span["duration_ms"] / 1000
+
+
+def load_traces(paths: Iterable[str]) -> Dict[str, List[Dict[str, Any]]]:
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    span = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程被杀时可能留下半行
+                    continue
+                traces[span["trace_id"]].append(span)
+    return traces
+
+
+def submission_id(spans: List[Dict[str, Any]]) -> Optional[int]:
+    for span in sorted(spans, key=lambda s: s["start"]):
+        if span["attrs"].get("submission_id") is not None:
+            return span["attrs"]["submission_id"]
+    return None
+
+
+class TraceTree:
+    """一个 trace 的 span 树。父 span 不在文件里的 span（例如 AI 服务的 span 导出到了别处）挂在虚拟根节点下。"""
+
+    def __init__(self, spans: List[Dict[str, Any]]):
+        self.spans = {span["span_id"]: span for span in spans}
+        self.children: Dict[Optional[str], List[Dict[str, Any]]] = defaultdict(list)
+        for span in spans:
+            parent_id = span["parent_id"] if span["parent_id"] in self.spans else None
+            self.children[parent_id].append(span)
+        self.start = min(span["start"] for span in spans)
+        self._effective_end: Dict[Optional[str], float] = {}
+        self.end = self.effective_end(None)
+
+    def effective_end(self, span_id: Optional[str]) -> float:
+        # span 自己的结束时间和所有后代里最晚的结束时间（任务在 receive_data 返回之后才执行）
+        if span_id not in self._effective_end:
+            own = span_end(self.spans[span_id]) if span_id is not None else self.start
+            self._effective_end[span_id] = max(
+                [own] + [self.effective_end(child["span_id"]) for child in self.children[span_id]]
+            )
+        return self._effective_end[span_id]
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def critical_path(self) -> List[Tuple[str, float, float]]:
+        """关键路径上的 (阶段, 开始, 结束) 段，按时间顺序。"""
+        segments: List[Tuple[str, float, float]] = []
+        self._walk(None, self.start, self.end, segments)
+        segments.reverse()
+        return segments
+
+    def _walk(self, span_id: Optional[str], low: float, high: float, segments: List[Tuple[str, float, float]]):
+        span = self.spans.get(span_id)
+        cursor = high
+        for child in sorted(self.children[span_id], key=lambda c: self.effective_end(c["span_id"]), reverse=True):
+            child_high = min(self.effective_end(child["span_id"]), cursor)
+            child_low = max(child["start"], low)
+            if child_high <= child_low:
+                continue
+            self._own(span, child_high, cursor, segments)
+            self._walk(child["span_id"], child_low, child_high, segments)
+            cursor = child_low
+        self._own(span, low, cursor, segments)
+
+    @staticmethod
+    def _own(span: Optional[Dict[str, Any]], low: float, high: float, segments: List[Tuple[str, float, float]]):
+        # [low, high] 没有子 span 覆盖：在 span 自己的时间范围内归给它，超出的部分是 (gap)
+        if high <= low:
+            return
+        own_end = span_end(span) if span is not None else low
+        if high > own_end:
+            segments.append((GAP, max(low, own_end), high))
+        if own_end > low:
+            segments.append((span["name"], low, min(high, own_end)))
+
+
+def stage_totals(segments: List[Tuple[str, float, float]]) -> Dict[str, float]:
+    # 按阶段合计关键路径时间，保持第一次出现的顺序
+    totals: Dict[str, float] = {}
+    for name, low, high in segments:
+        totals[name] = totals.get(name, 0.0) + (high - low)
+    return totals
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    array = np.asarray(values, dtype=np.float64)
+    p50, p90, p99 = np.percentile(array, [50, 90, 99])
+    return {"p50": round(float(p50), 2), "p90": round(float(p90), 2), "p99": round(float(p99), 2),
+            "max": round(float(array.max()), 2)}
+
+
+def summarize(traces: Dict[str, List[Dict[str, Any]]], slowest: int = 10) -> Dict[str, Any]:
+    durations: Dict[str, List[float]] = defaultdict(list)
+    critical: Dict[str, List[float]] = defaultdict(list)
+    totals = []
+    per_trace = []
+    for trace_id, spans in traces.items():
+        for span in spans:
+            durations[span["name"]].append(span["duration_ms"])
+        tree = TraceTree(spans)
+        stages = stage_totals(tree.critical_path())
+        for name, seconds in stages.items():
+            critical[name].append(seconds * 1000)
+        totals.append(tree.duration * 1000)
+        per_trace.append({
+            "trace_id": trace_id,
+            "submission_id": submission_id(spans),
+            "total_ms": round(tree.duration * 1000, 2),
+            "critical_path_ms": {name: round(seconds * 1000, 2) for name, seconds in stages.items()},
+            "errors": [span["name"] for span in spans if span.get("error")],
+        })
+    if not totals:
+        return {"traces": 0, "end_to_end_ms": None, "stages": {}, "slowest": []}
+
+    total_ms = sum(totals)
+    stages = {
+        name: {
+            "spans": len(values),
+            "duration_ms": percentiles(values),
+            # 有多少个 trace 的关键路径经过这个阶段，以及它占所有 trace 总耗时的比例
+            "critical_traces": len(critical.get(name, [])),
+            "critical_ms": percentiles(critical[name]) if critical.get(name) else None,
+            "critical_share": round(sum(critical.get(name, [])) / total_ms, 4) if total_ms else 0.0,
+        }
+        for name, values in durations.items()
+    }
+    if critical.get(GAP):
+        stages[GAP] = {"spans": 0, "duration_ms": None, "critical_traces": len(critical[GAP]),
+                       "critical_ms": percentiles(critical[GAP]),
+                       "critical_share": round(sum(critical[GAP]) / total_ms, 4) if total_ms else 0.0}
+    return {
+        "traces": len(totals),
+        "end_to_end_ms": percentiles(totals),
+        "stages": dict(sorted(stages.items(), key=lambda item: item[1]["critical_share"], reverse=True)),
+        "slowest": sorted(per_trace, key=lambda trace: trace["total_ms"], reverse=True)[:slowest],
+    }
+
+
+def find_trace(traces: Dict[str, List[Dict[str, Any]]], submission: int) -> Optional[List[Dict[str, Any]]]:
+    for spans in traces.values():
+        if any(span["attrs"].get("submission_id") == submission for span in spans):
+            return spans
+    return None
+
+
+def print_summary(summary: Dict[str, Any]):
+    if not summary["traces"]:
+        print("No traces found")
+        return
+    e2e = summary["end_to_end_ms"]
+    print(f"{summary['traces']} traces, end to end p50 {e2e['p50']}ms  p90 {e2e['p90']}ms  "
+          f"p99 {e2e['p99']}ms  max {e2e['max']}ms\n")
+    print(f"{'stage':<28}{'spans':>7}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'crit p50':>10}{'crit %':>8}")
+    for name, stage in summary["stages"].items():
+        duration = stage["duration_ms"] or {}
+        critical = stage["critical_ms"] or {}
+        print(f"{name:<28}{stage['spans']:>7}{duration.get('p50', '-'):>10}{duration.get('p90', '-'):>10}"
+              f"{duration.get('p99', '-'):>10}{duration.get('max', '-'):>10}{critical.get('p50', '-'):>10}"
+              f"{stage['critical_share'] * 100:>7.1f}%")
+    print("\nSlowest submissions (critical path, ms):")
+    for trace in summary["slowest"]:
+        path = "  ".join(f"{name} {ms}" for name, ms in trace["critical_path_ms"].items())
+        errors = f"  errors: {', '.join(trace['errors'])}" if trace["errors"] else ""
+        print(f"  {trace['submission_id']}  {trace['total_ms']}ms  {trace['trace_id']}\n    {path}{errors}")
+
+
+def print_trace(spans: List[Dict[str, Any]]):
+    tree = TraceTree(spans)
+    print(f"trace {spans[0]['trace_id']}  submission {submission_id(spans)}  total {tree.duration * 1000:.1f}ms\n")
+    print("Critical path:")
+    for name, low, high in tree.critical_path():
+        print(f"  +{(low - tree.start) * 1000:>9.1f}ms  {(high - low) * 1000:>9.1f}ms  {name}")
+    print("\nSpans:")
+
+    def show(span_id: Optional[str], depth: int):
+        for child in sorted(tree.children[span_id], key=lambda s: s["start"]):
+            attrs = " ".join(f"{key}={value}" for key, value in child["attrs"].items())
+            error = f"  ERROR {' '.join(child['error'].split())[:160]}" if child.get("error") else ""
+            print(f"  +{(child['start'] - tree.start) * 1000:>9.1f}ms  {child['duration_ms']:>9.1f}ms  "
+                  f"{'  ' * depth}{child['name']} [{child['service']}] {attrs}{error}")
+            show(child["span_id"], depth + 1)
+
+    show(None, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Critical-path and per-stage latency report for exported spans")
+    parser.add_argument("paths", nargs="*", default=[TRACE_EXPORT], help="Span files (JSON lines)")
+    parser.add_argument("--submission", type=int, default=None, help="Show one submission's critical path and spans")
+    parser.add_argument("--slowest", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    traces = load_traces(args.paths)
+    if args.submission is not None:
+        spans = find_trace(traces, args.submission)
+        if spans is None:
+            raise SystemExit(f"No trace for submission {args.submission}")
+        print_trace(spans)
+    elif args.json:
+        print(json.dumps(summarize(traces, args.slowest), indent=2))
+    else:
+        print_summary(summarize(traces, args.slowest))
+
+
+if __name__ == "__main__":
+    main()
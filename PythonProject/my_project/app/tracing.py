@@ -0,0 +1,328 @@
+import atexit
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, NamedTuple, Optional
+import requests
+from config import TRACE_SAMPLE_RATE, TRACE_EXPORT
+from instrumentation import DB_QUERY_SECONDS
+
+# 一次提交的全链路追踪：receive_data 开始一个 trace，trace 上下文（W3C traceparent）经 Celery 消息头
+# 和调用 AI 服务的 HTTP 头传下去，每个阶段记一个 span。抽样在 receive_data 决定，下游跟随 sampled 标志。
+# span 导出到 TRACE_EXPORT：本地文件（每行一个 JSON），或 http(s) 开头时按 OTLP/HTTP JSON 发给 collector。
+#   python trace_report.py ../traces/spans.jsonl     汇总每个提交的关键路径和各阶段的分位数
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    # 格式不对时返回 None，当作没有上游 trace
+    try:
+        _, trace_id, span_id, flags = str(value).strip().lower().split("-")[:4]
+        sampled = bool(int(flags, 16) & 1)
+        int(trace_id, 16), int(span_id, 16)
+    except ValueError:
+        return None
+    if len(trace_id) != 32 or len(span_id) != 16 or not int(trace_id, 16) or not int(span_id, 16):
+        return None
+    return SpanContext(trace_id, span_id, sampled)
+
+
+_current: ContextVar[Optional[SpanContext]] = ContextVar("trace_context", default=None)
+
+
+def current() -> Optional[SpanContext]:
+    return _current.get()
+
+
+def current_traceparent() -> Optional[str]:
+    # 没被抽样的 trace 也往下传，下游不会再自己抽样
+    context = _current.get()
+    return context.traceparent if context is not None else None
+
+
+def new_span_id() -> str:
+    return "%016x" % random.getrandbits(64)
+
+
+class Span:
+    __slots__ = ("name", "context", "parent_id", "start", "started", "attrs", "error")
+
+    def __init__(self, name: str, context: SpanContext, parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.attrs = attrs
+        self.error: Optional[str] = None
+
+    def set(self, **attrs: Any):
+        self.attrs.update(attrs)
+
+
+class _NoopSpan:
+    # 没有 trace 或没被抽样时 with 块拿到的对象，set() 什么都不做
+    context = None
+
+    def set(self, **attrs: Any):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    by_service: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        start_ns = int(record["start"] * 1e9)
+        by_service.setdefault(record["service"], []).append({
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "parentSpanId": record["parent_id"] or "",
+            "name": record["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(record["duration_ms"] * 1e6)),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in record["attrs"].items()],
+            "status": {"code": 2, "message": record["error"]} if record.get("error") else {"code": 1},
+        })
+    return {"resourceSpans": [
+        {
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+            "scopeSpans": [{"scope": {"name": "fursphere"}, "spans": spans}],
+        }
+        for service, spans in by_service.items()
+    ]}
+
+
+class SpanExporter:
+    """后台线程批量写出结束的 span。写文件用一次 O_APPEND 的 write，多个进程可以写同一个文件；fork 后按 pid 重启线程。"""
+
+    def __init__(self, target: str, max_queue: int = 10000, batch_size: int = 512, flush_interval: float = 1.0):
+        self.target = target
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self.counters = {"exported": 0, "dropped": 0, "export_errors": 0}
+
+    def _ensure_worker(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(self.max_queue)
+                    threading.Thread(target=self._run, name="span-exporter", daemon=True).start()
+                    self._pid = os.getpid()
+
+    def export(self, record: Dict[str, Any]):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.counters["dropped"] += 1
+
+    def _drain(self, first: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write(self._drain(first))
+
+    def flush(self):
+        # 进程退出前把队列里剩下的写完（atexit、Celery 子进程退出时调用）
+        if self._pid != os.getpid():
+            return
+        batch = self._drain()
+        while batch:
+            self._write(batch)
+            batch = self._drain()
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            with self._write_lock:
+                if self.target.startswith(("http://", "https://")):
+                    requests.post(self.target, json=otlp_payload(batch), timeout=5).raise_for_status()
+                else:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.target)), exist_ok=True)
+                    data = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in batch)
+                    fd = os.open(self.target, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                    try:
+                        os.write(fd, data.encode("utf-8"))
+                    finally:
+                        os.close(fd)
+            self.counters["exported"] += len(batch)
+        except Exception as e:
+            self.counters["export_errors"] += 1
+            print(f"Error exporting {len(batch)} spans to {self.target}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "target": self.target, "queued": self._queue.qsize()}
+
+
+class Tracer:
+    """创建 span 并维护当前上下文（contextvars，线程和 asyncio 任务各自独立）。"""
+
+    def __init__(self, exporter: SpanExporter, sample_rate: float = 0.01, service: str = "api"):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.service = service
+
+    def set_service(self, service: str):
+        self.service = service
+
+    def start_span(self, name: str, parent: Optional[SpanContext] = None, root: bool = False, **attrs: Any):
+        """开始一个 span 并设为当前上下文，返回 (span, token)，结束时调用 end_span(span, token)。
+
+        parent 为 None 时用当前上下文；也没有时只有 root=True 才开始新 trace（按 sample_rate 抽样），否则不记录。
+        """
+        parent = parent or _current.get()
+        if parent is None:
+            if not root:
+                return NOOP_SPAN, None
+            parent_id = None
+            context = SpanContext("%032x" % random.getrandbits(128), new_span_id(),
+                                  random.random() < self.sample_rate)
+        else:
+            parent_id = parent.span_id
+            context = SpanContext(parent.trace_id, new_span_id(), parent.sampled)
+        token = _current.set(context)
+        if not context.sampled:
+            return NOOP_SPAN, token
+        return Span(name, context, parent_id, attrs), token
+
+    def end_span(self, span, token, error: Optional[BaseException] = None):
+        if token is not None:
+            _current.reset(token)
+        if isinstance(span, Span):
+            if error is not None:
+                span.error = f"{type(error).__name__}: {error}"
+            self._export(span.name, span.context, span.parent_id, span.start,
+                         time.perf_counter() - span.started, span.attrs, span.error)
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[SpanContext] = None, root: bool = False, **attrs: Any):
+        span, token = self.start_span(name, parent, root, **attrs)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, token, e)
+            raise
+        self.end_span(span, token)
+
+    def record(self, name: str, start: float, end: float, parent: Optional[SpanContext] = None, **attrs: Any):
+        # 补记一个已经结束的阶段（排队时间、后台线程里合并执行的插入），start/end 为 time.time()
+        parent = parent or _current.get()
+        if parent is not None and parent.sampled:
+            self._export(name, SpanContext(parent.trace_id, new_span_id(), True), parent.span_id, start,
+                         max(0.0, end - start), attrs, None)
+
+    def _export(self, name, context, parent_id, start, duration, attrs, error):
+        self.exporter.export({
+            "trace_id": context.trace_id,
+            "span_id": context.span_id,
+            "parent_id": parent_id,
+            "name": name,
+            "service": self.service,
+            "start": round(start, 6),
+            "duration_ms": round(duration * 1000, 3),
+            "attrs": attrs,
+            "error": error,
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        return {"service": self.service, "sample_rate": self.sample_rate, **self.exporter.stats()}
+
+
+tracer = Tracer(SpanExporter(TRACE_EXPORT), sample_rate=TRACE_SAMPLE_RATE)
+atexit.register(tracer.exporter.flush)
+
+
+@contextmanager
+def timed_query(query: str):
+    # db_query_seconds 直方图，同时在当前 trace 里记一个 db.<query> span
+    with tracer.span(f"db.{query}"), DB_QUERY_SECONDS.labels(query).time():
+        yield
+
+
+def install_celery_tracing(celery_app):
+    """发布任务时把当前 trace 写进消息头；worker 执行任务时接着这个 trace 记录排队和执行两个 span。"""
+    from celery import signals
+
+    @signals.worker_init.connect(weak=False)
+    def mark_worker(**kwargs):
+        tracer.set_service("worker")
+
+    @signals.before_task_publish.connect(weak=False)
+    def inject(headers=None, **kwargs):
+        # 已经显式带了 traceparent 的消息（缓冲写入时每条提交各自的 trace）不覆盖
+        traceparent = current_traceparent()
+        if headers is not None and traceparent is not None:
+            headers.setdefault("traceparent", traceparent)
+
+    @signals.task_prerun.connect(weak=False)
+    def start_task_span(task=None, **kwargs):
+        parent = parse_traceparent(getattr(task.request, "traceparent", None))
+        if parent is None:
+            return
+        # enqueued_at 由 install_celery_metrics 在发布时写入
+        enqueued_at = getattr(task.request, "enqueued_at", None)
+        if enqueued_at:
+            tracer.record("celery.queue", float(enqueued_at), time.time(), parent, task=task.name)
+        task.request.trace_span = tracer.start_span(task.name, parent, retries=task.request.retries or 0)
+
+    @signals.task_postrun.connect(weak=False)
+    def end_task_span(task=None, retval=None, state=None, **kwargs):
+        started = getattr(task.request, "trace_span", None)
+        if started is None:
+            return
+        span, token = started
+        task.request.trace_span = None
+        status = retval.get("status", state) if isinstance(retval, dict) else state
+        span.set(status=str(status).lower())
+        if isinstance(span, Span) and isinstance(retval, dict) and retval.get("error"):
+            span.error = str(retval["error"])
+        tracer.end_span(span, token)
+
+    @signals.worker_process_shutdown.connect(weak=False)
+    def flush_spans(**kwargs):
+        # prefork 子进程用 os._exit 退出，不会执行 atexit
+        tracer.exporter.flush()
+
+    return celery_app
@@ -0,0 +1,77 @@
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from api_load_test import percentile
+
+# Measures /ai latency, throughput and prompt tokens per pet against a running ai_server.
+# Run it once with AI_BATCH_ENABLED=false and once with AI_BATCH_ENABLED=true (and AI_CACHE_ENABLED=false,
+# so repeated inputs are not served from the cache), then compare the two JSON summaries.
+#   python benchmarks/ai_batching.py --url http://localhost:8001 --requests 400 --concurrency 32
+
+
+def make_payload(index: int):
+    rng = random.Random(index)
+    return {
+        "input_data": {
+            "pet_name": f"Pet{index}",
+            "pet_type": rng.choice(["Dog", "Cat"]),
+            "pet_breed": rng.choice(["Akita", "Beagle", "Poodle (Toy)", "Mixed"]),
+            "mbti_scores": {dim: rng.randint(0, 100) for dim in ("E/I", "S/N", "T/F", "J/P")}
+        }
+    }
+
+
+def run(url: str, total: int, concurrency: int, timeout: float):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    before = session.get(f"{url}/health", timeout=timeout).json()
+
+    def call(index):
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{url}/ai", json=make_payload(index), timeout=timeout)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(total)))
+    elapsed = time.perf_counter() - started
+
+    after = session.get(f"{url}/health", timeout=timeout).json()
+    latencies = sorted(latency for ok, latency in results if ok)
+    llm_before, llm_after = before.get("llm") or {}, after.get("llm") or {}
+    completions = llm_after.get("completions", 0) - llm_before.get("completions", 0)
+    prompt_tokens = llm_after.get("prompt_tokens", 0) - llm_before.get("prompt_tokens", 0)
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "succeeded": len(latencies),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50_seconds": round(percentile(latencies, 0.50), 4),
+        "latency_p95_seconds": round(percentile(latencies, 0.95), 4),
+        "latency_p99_seconds": round(percentile(latencies, 0.99), 4),
+        "completions": completions,
+        "prompt_tokens_per_pet": round(prompt_tokens / len(latencies), 1) if latencies else 0.0,
+        "batching": after.get("batching"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load /ai and report latency, throughput and token usage")
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+    print(json.dumps(run(args.url.rstrip("/"), args.requests, args.concurrency, args.timeout), indent=2))
+
+
+if __name__ == "__main__":
+    main()
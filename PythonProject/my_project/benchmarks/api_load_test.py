@@ -0,0 +1,121 @@
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# Compares the Flask API (app/server.py, port 5001) and the ASGI API (app/asgi_server.py, port 5002)
+# on the same PostgreSQL/Redis. Each target gets the same number of /receive_data posts followed by
+# /get_result reads of the ids it created; requests/s and p50/p99 latency are reported per route.
+#   python benchmarks/api_load_test.py --target flask=http://localhost:5001 --target asgi=http://localhost:5002
+
+
+def make_survey(index: int):
+    rng = random.Random(index)
+
+    def answer():
+        return f"{rng.randint(0, 100)})"
+
+    return {
+        "survey_data": {
+            "user_info": {"email": f"load{index}@example.com", "ip": "127.0.0.1"},
+            "pet_info": {
+                "PetSpecies": rng.choice(["Dog", "Cat"]),
+                "PetName": f"Pet{index}",
+                "PetBreed": rng.choice(["Akita", "Beagle", "Poodle (Toy)"]),
+                "PetGender": rng.choice(["Boy", "Girl"]),
+                "PetAge": str(rng.randint(1, 15)),
+            },
+            "personality_and_behavior": {
+                "Energy_Socialization": {
+                    "seek_attention": answer(), "interact_with_toys": answer(), "stranger_enter_territory": answer()
+                },
+                "Routin_Curiosity": {
+                    "prefer_routine": answer(), "friend_visit_behaviors": answer(), "fur_care_7days": answer()
+                },
+                "Decision_Making": {
+                    "react_when_sad": answer(),
+                    "toy_out_of_reach": rng.choice(["Keep trying", "Give up"]),
+                    "react_new_friend": answer()
+                },
+                "Structure_Spontaneity": {
+                    "react_new_environment": answer(), "respond_to_scold": answer(), "follow_commands": answer()
+                },
+            },
+        }
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(results, elapsed):
+    latencies = sorted(latency for ok, latency, _ in results if ok)
+    return {
+        "requests": len(results),
+        "succeeded": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def run_phase(call, items, concurrency):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, items))
+    return results, time.perf_counter() - started
+
+
+def load_target(url: str, total: int, concurrency: int, timeout: float):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def post(index):
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{url}/receive_data", json=make_survey(index), timeout=timeout)
+            submission_id = response.json().get("submission_id") if response.status_code == 202 else None
+            return response.status_code == 202, time.perf_counter() - started, submission_id
+        except (requests.RequestException, ValueError):
+            return False, time.perf_counter() - started, None
+
+    def get(submission_id):
+        started = time.perf_counter()
+        try:
+            response = session.get(f"{url}/get_result/{submission_id}", timeout=timeout)
+            return response.status_code in (200, 202), time.perf_counter() - started, None
+        except requests.RequestException:
+            return False, time.perf_counter() - started, None
+
+    post_results, post_elapsed = run_phase(post, range(total), concurrency)
+    ids = [submission_id for ok, _, submission_id in post_results if ok and submission_id is not None]
+    get_results, get_elapsed = run_phase(get, ids or [0] * total, concurrency)
+    return {
+        "receive_data": summarize(post_results, post_elapsed),
+        "get_result": summarize(get_results, get_elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /receive_data and /get_result on one or more API servers")
+    parser.add_argument("--target", action="append", required=True, help="name=url, may be given several times")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    report = {"requests": args.requests, "concurrency": args.concurrency, "targets": {}}
+    for target in args.target:
+        name, _, url = target.partition("=")
+        report["targets"][name] = load_target(url.rstrip("/"), args.requests, args.concurrency, args.timeout)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PROJECT_DIR, 'app'))
+sys.path.append(os.path.join(PROJECT_DIR, 'ai_service'))
+from api_load_test import percentile
+
+# Reproducible benchmarks for the hot paths. Every run writes one JSON file (commit, machine and
+# the numbers below) so two commits can be compared:
+#   scoring         calculate_behavior_scores / calculate_mbti / calculate_mbti_batch throughput
+#   breed_lookup    breed score lookups, cold (first resolution) and warm (resolver cache)
+#   extract_section extract_section and build_output on section-tagged completions
+#   e2e             /receive_data -> process_ai_task -> /wait_result latency against local services
+#
+#   python benchmarks/suite.py run                              (in-process benchmarks only)
+#   python benchmarks/suite.py run --e2e --start-services       (also starts the fake LLM, ai_server, Flask, Celery)
+#   python benchmarks/suite.py compare benchmarks/results/a.json benchmarks/results/b.json
+#
+# e2e needs PostgreSQL and Redis running locally (DB_CONFIG / REDIS_URL from app/config.py). With
+# --start-services the AI service talks to ai_service/fake_openai.py, never to OpenAI.
+
+RESULTS_DIR = os.path.join(PROJECT_DIR, 'benchmarks', 'results')
+
+# Metrics where a larger number is better; everything else ("*_ms", "*_us", "*seconds") is a latency
+HIGHER_IS_BETTER = ("per_second",)
+
+
+def latency_summary(seconds, unit="ms"):
+    scale = 1000 if unit == "ms" else 1000000
+    values = sorted(seconds)
+    return {
+        f"p50_{unit}": round(percentile(values, 0.50) * scale, 2),
+        f"p90_{unit}": round(percentile(values, 0.90) * scale, 2),
+        f"p99_{unit}": round(percentile(values, 0.99) * scale, 2),
+        f"max_{unit}": round(values[-1] * scale, 2) if values else 0.0,
+    }
+
+
+def best_of(call, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def make_surveys(rows, seed):
+    from survey_parser import make_payload
+    from mbti_calculator import dog_breed_registry
+    rng = random.Random(seed)
+    breeds = dog_breed_registry.breeds()
+    surveys = []
+    for _ in range(rows):
+        pet_type = rng.choice(["Dog", "Dog", "Dog", "Cat"])
+        surveys.append((make_payload(rng, edge_rate=0)[0], pet_type, rng.choice(breeds) if pet_type == "Dog" else "Siamese"))
+    return surveys
+
+
+def bench_scoring(args):
+    from mbti_calculator import calculate_behavior_scores, calculate_mbti, calculate_mbti_batch
+    surveys = make_surveys(args.rows, args.seed)
+    behaviors = [behavior for behavior, _, _ in surveys]
+    pet_types = [pet_type for _, pet_type, _ in surveys]
+    pet_breeds = [pet_breed for _, _, pet_breed in surveys]
+
+    def rate(seconds):
+        return round(len(surveys) / seconds) if seconds else 0
+
+    behavior_seconds = best_of(lambda: [calculate_behavior_scores(b) for b in behaviors], args.repeat)
+    single_seconds = best_of(lambda: [calculate_mbti(*survey) for survey in surveys], args.repeat)
+    batch_seconds = best_of(lambda: calculate_mbti_batch(behaviors, pet_types, pet_breeds), args.repeat)
+    return {
+        "rows": len(surveys),
+        "calculate_behavior_scores_per_second": rate(behavior_seconds),
+        "calculate_mbti_per_second": rate(single_seconds),
+        "calculate_mbti_batch_rows_per_second": rate(batch_seconds),
+    }
+
+
+def bench_breed_lookup(args):
+    from config import BREED_SCORES_CSV, BREED_ALIASES_CSV
+    from breed_scores import BreedScoreRegistry, load_aliases
+    rng = random.Random(args.seed)
+    # A fresh registry so load time and first resolutions are measured, not whatever the process cached
+    registry = BreedScoreRegistry(BREED_SCORES_CSV, reload_interval=0, aliases_path=BREED_ALIASES_CSV)
+    started = time.perf_counter()
+    breeds = registry.breeds()
+    load_seconds = time.perf_counter() - started
+    aliases = list(load_aliases(BREED_ALIASES_CSV))
+    # What people actually type: exact names, odd casing and spacing, aliases, typos, mixes
+    inputs = []
+    for _ in range(args.lookups):
+        breed = rng.choice(breeds)
+        kind = rng.random()
+        if kind < 0.4:
+            inputs.append(breed)
+        elif kind < 0.55:
+            inputs.append(f"  {breed.upper()} ")
+        elif kind < 0.7 and aliases:
+            inputs.append(rng.choice(aliases))
+        elif kind < 0.85:
+            i = rng.randrange(len(breed))
+            inputs.append(breed[:i] + breed[i + 1:])
+        else:
+            inputs.append(f"{breed} / {rng.choice(breeds)}")
+
+    def measure():
+        seconds = []
+        for breed in inputs:
+            started = time.perf_counter()
+            registry.get_vector(breed, record=False)
+            seconds.append(time.perf_counter() - started)
+        return seconds
+
+    # Resolutions other than exact matches are logged; keep them out of the JSON on stdout
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        cold = measure()
+        warm = measure()
+    return {
+        "lookups": len(inputs),
+        "distinct_inputs": len(set(inputs)),
+        "load_ms": round(load_seconds * 1000, 2),
+        "cold": latency_summary(cold, "us"),
+        "warm": latency_summary(warm, "us"),
+        "warm_lookups_per_second": round(len(warm) / sum(warm)) if sum(warm) else 0,
+    }
+
+
+def bench_extract_section(args):
+    os.environ.setdefault("AI_CACHE_ENABLED", "false")
+    from ai_server import SECTION_NAMES, build_output, extract_section, build_prompt
+    from fake_openai import fake_completion
+    rng = random.Random(args.seed)
+    completions = [
+        fake_completion(build_prompt(f"Pet{i}", "Dog", "Beagle", str(rng.random()))) for i in range(args.completions)
+    ]
+    scores = {"E/I": 40, "S/N": 60, "T/F": 55, "J/P": 30}
+    empty = sum(1 for content in completions for name in SECTION_NAMES if not extract_section(content, name))
+
+    def extract_all():
+        for content in completions:
+            for name in SECTION_NAMES:
+                extract_section(content, name)
+
+    extract_seconds = best_of(extract_all, args.repeat)
+    output_seconds = best_of(lambda: [build_output(scores, content) for content in completions], args.repeat)
+    return {
+        "completions": len(completions),
+        "mean_completion_chars": round(sum(map(len, completions)) / len(completions)),
+        "empty_sections": empty,
+        "extract_section_per_second": round(len(completions) * len(SECTION_NAMES) / extract_seconds),
+        "build_output_per_second": round(len(completions) / output_seconds),
+    }
+
+
+def wait_for(url, timeout):
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become healthy within {timeout}s")
+
+
+def start_services(args):
+    # Fake LLM -> ai_server -> Celery worker + Flask, all as child processes of this run
+    logs = os.path.join(RESULTS_DIR, 'logs')
+    os.makedirs(logs, exist_ok=True)
+    env = dict(
+        os.environ,
+        FAKE_OPENAI_LATENCY_MS=str(args.llm_latency_ms),
+        FAKE_OPENAI_PORT="8010",
+        OPENAI_BASE_URL="http://127.0.0.1:8010/v1",
+        OPENAI_API_KEY="fake",
+        AI_CACHE_ENABLED="false",
+        PORT="8001",
+        AI_SERVER_URL="http://127.0.0.1:8001",
+        PYTHONUNBUFFERED="1",
+    )
+    commands = [
+        ("fake_openai", [sys.executable, "ai_service/fake_openai.py"], "http://127.0.0.1:8010/health"),
+        ("ai_server", [sys.executable, "ai_service/ai_server.py"], "http://127.0.0.1:8001/health"),
+        ("celery", [sys.executable, "-m", "celery", "-A", "tasks", "worker", "--loglevel=warning",
+                    f"--concurrency={args.workers}"], None),
+        ("flask", [sys.executable, "app/server.py"], f"{args.api_url}/health"),
+    ]
+    processes = []
+    try:
+        for name, command, health_url in commands:
+            cwd = os.path.join(PROJECT_DIR, "app") if name == "celery" else PROJECT_DIR
+            log = open(os.path.join(logs, f"{name}.log"), "w")
+            processes.append(subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT))
+            if health_url:
+                wait_for(health_url, 30)
+    except Exception:
+        stop_services(processes)
+        raise
+    return processes
+
+
+def stop_services(processes):
+    for process in reversed(processes):
+        process.send_signal(signal.SIGTERM)
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def bench_e2e(args):
+    import requests
+    from api_load_test import make_survey
+    processes = start_services(args) if args.start_services else []
+    try:
+        session = requests.Session()
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+        def submit(index):
+            started = time.perf_counter()
+            try:
+                response = session.post(f"{args.api_url}/receive_data", json=make_survey(index), timeout=30)
+                submission_id = response.json().get("submission_id") if response.status_code == 202 else None
+                if submission_id is None:
+                    return None
+                submitted = time.perf_counter()
+                deadline = started + args.result_timeout
+                while time.perf_counter() < deadline:
+                    response = session.get(
+                        f"{args.api_url}/wait_result/{submission_id}",
+                        params={"timeout": max(0.1, deadline - time.perf_counter())}, timeout=args.result_timeout + 5
+                    )
+                    if response.status_code == 200:
+                        return submitted - started, time.perf_counter() - started
+                return None
+            except (requests.RequestException, ValueError):
+                return None
+
+        # A few warm-up submissions so connection pools and worker imports are not in the numbers
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(submit, range(-min(10, args.requests), 0)))
+            started = time.perf_counter()
+            results = list(pool.map(submit, range(args.requests)))
+            elapsed = time.perf_counter() - started
+    finally:
+        stop_services(processes)
+
+    completed = [result for result in results if result is not None]
+    if not completed:
+        raise RuntimeError(f"No submission completed; is the API at {args.api_url} running with a Celery worker?")
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "llm_latency_ms": args.llm_latency_ms if args.start_services else None,
+        "completed": len(completed),
+        "failed": len(results) - len(completed),
+        "completed_per_second": round(len(completed) / elapsed, 2) if elapsed else 0.0,
+        "receive_data": latency_summary([submit_seconds for submit_seconds, _ in completed]),
+        "end_to_end": latency_summary([total for _, total in completed]),
+    }
+
+
+BENCHMARKS = {
+    "scoring": bench_scoring,
+    "breed_lookup": bench_breed_lookup,
+    "extract_section": bench_extract_section,
+    "e2e": bench_e2e,
+}
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PROJECT_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=PROJECT_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run(args):
+    names = args.only or [name for name in BENCHMARKS if name != "e2e" or args.e2e]
+    commit, dirty = git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "benchmarks": {},
+    }
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        try:
+            report["benchmarks"][name] = BENCHMARKS[name](args)
+        except Exception as e:
+            # One unavailable benchmark (no Postgres, missing package) should not lose the others
+            report["benchmarks"][name] = {"error": f"{type(e).__name__}: {e}"}
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{(commit or 'unknown')[:8]}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Wrote {output}", file=sys.stderr)
+
+
+def flatten(values, prefix=""):
+    for key, value in values.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, name + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print(f"baseline  {baseline.get('commit')} ({baseline.get('created_at')})")
+    print(f"candidate {candidate.get('commit')} ({candidate.get('created_at')})")
+    regressions = 0
+    for name, results in candidate["benchmarks"].items():
+        before = dict(flatten(baseline["benchmarks"].get(name, {})))
+        for metric, value in flatten(results):
+            if metric not in before or not before[metric] or not metric.endswith(HIGHER_IS_BETTER + ("_ms", "_us")):
+                continue
+            change = (value - before[metric]) / before[metric]
+            better = change > 0 if metric.endswith(HIGHER_IS_BETTER) else change < 0
+            flag = ""
+            if abs(change) >= args.threshold:
+                flag = "better" if better else "REGRESSION"
+                regressions += not better
+            print(f"{name + '.' + metric:<50} {before[metric]:>12} -> {value:>12} {change:+8.1%} {flag}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the hot-path benchmarks or compare two result files")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--only", action="append", choices=list(BENCHMARKS), help="may be given several times")
+    run_parser.add_argument("--output", help="result file (default benchmarks/results/<time>-<commit>.json)")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--rows", type=int, default=20000, help="surveys for the scoring benchmark")
+    run_parser.add_argument("--lookups", type=int, default=20000, help="breed lookups")
+    run_parser.add_argument("--completions", type=int, default=2000, help="completions to parse")
+    run_parser.add_argument("--e2e", action="store_true", help="include the end-to-end benchmark")
+    run_parser.add_argument("--start-services", action="store_true",
+                            help="start the fake LLM, ai_server, a Celery worker and Flask for the e2e run")
+    run_parser.add_argument("--api-url", default="http://127.0.0.1:5001")
+    run_parser.add_argument("--requests", type=int, default=500)
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--workers", type=int, default=8, help="Celery worker processes")
+    run_parser.add_argument("--llm-latency-ms", type=float, default=500)
+    run_parser.add_argument("--result-timeout", type=float, default=60)
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative change that is reported")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from survey_schema import behavior_extractor
+
+# Compares the schema-compiled personality_behavior extractor (app/survey_schema.py) with the
+# hand-written twelve-lookup walk that calculate_behavior_scores used before. Both parse the same
+# generated payloads; the report has rows/s for each and checks that they produce the same vectors.
+# Some answers are edge inputs that are easy to parse differently (non-printable characters, spaces
+# around the ")", "Null", bare numbers, numeric or differently cased toy_out_of_reach answers);
+# edge_input_rows says how many rows carry at least one, and any difference on any row is a mismatch.
+#   python benchmarks/survey_parser.py --rows 200000
+
+
+def legacy_safe_float(value):
+    if value is None or value == "" or value == 0 or value == "Null":
+        return 0
+    if isinstance(value, str):
+        value = value.strip(')')
+    try:
+        return float(value)
+    except ValueError:
+        return 0
+
+
+def legacy_parse(personality_behavior):
+    return [
+        legacy_safe_float(personality_behavior["Energy_Socialization"]["seek_attention"]),
+        legacy_safe_float(personality_behavior["Energy_Socialization"]["interact_with_toys"]),
+        legacy_safe_float(personality_behavior["Energy_Socialization"]["stranger_enter_territory"]),
+        legacy_safe_float(personality_behavior["Routin_Curiosity"]["prefer_routine"]),
+        legacy_safe_float(personality_behavior["Routin_Curiosity"]["friend_visit_behaviors"]),
+        legacy_safe_float(personality_behavior["Routin_Curiosity"]["fur_care_7days"]),
+        legacy_safe_float(personality_behavior["Decision_Making"]["react_when_sad"]),
+        100 if personality_behavior["Decision_Making"]["toy_out_of_reach"] == "Keep trying" else 0,
+        legacy_safe_float(personality_behavior["Decision_Making"]["react_new_friend"]),
+        legacy_safe_float(personality_behavior["Structure_Spontaneity"]["react_new_environment"]),
+        legacy_safe_float(personality_behavior["Structure_Spontaneity"]["respond_to_scold"]),
+        legacy_safe_float(personality_behavior["Structure_Spontaneity"]["follow_commands"]),
+    ]
+
+
+def edge_answer(rng):
+    n = rng.randint(0, 100)
+    return rng.choice([f"\u200b{n})", f"{n}\x00)", f"{n}) ", f" {n})", f"{n} )", "Null", n, float(n), "abc", 0])
+
+
+def edge_choice(rng):
+    return rng.choice([f"{rng.randint(0, 100)})", rng.randint(0, 100), "keep trying", "Keep trying ", "", None])
+
+
+def make_payload(rng, edge_rate=0.05):
+    """Returns (payload, has_edge_inputs). toy_out_of_reach is an option question and is generated separately."""
+    has_edge_inputs = False
+    payload = {}
+    for q in behavior_extractor.schema:
+        if q.key == "toy_out_of_reach":
+            continue
+        if edge_rate and rng.random() < edge_rate:
+            has_edge_inputs = True
+            value = edge_answer(rng)
+        else:
+            value = rng.choice([f"{rng.randint(1, 100)})", f"{rng.randint(1, 100)})", f"{rng.randint(1, 100)})", "", None])
+        payload.setdefault(q.group, {})[q.key] = value
+    if edge_rate and rng.random() < edge_rate:
+        has_edge_inputs = True
+        payload["Decision_Making"]["toy_out_of_reach"] = edge_choice(rng)
+    else:
+        payload["Decision_Making"]["toy_out_of_reach"] = rng.choice(["Keep trying", "Give up"])
+    return payload, has_edge_inputs
+
+
+def measure(parse, payloads, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for payload in payloads:
+            parse(payload)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {"seconds": round(best, 4), "rows_per_second": round(len(payloads) / best) if best else 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the personality_behavior extractor against the old walk")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--edge-rate", type=float, default=0.05, help="share of answers that are edge inputs")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    generated = [make_payload(rng, args.edge_rate) for _ in range(args.rows)]
+    payloads = [payload for payload, _ in generated]
+    differs = [(edge, legacy_parse(payload) != behavior_extractor(payload)) for payload, edge in generated]
+
+    legacy = measure(legacy_parse, payloads, args.repeat)
+    compiled = measure(behavior_extractor, payloads, args.repeat)
+    print(json.dumps({
+        "rows": args.rows,
+        "edge_input_rows": sum(1 for edge, _ in differs if edge),
+        "mismatches": sum(1 for _, differ in differs if differ),
+        "mismatches_on_edge_rows": sum(1 for edge, differ in differs if edge and differ),
+        "legacy_walk": legacy,
+        "schema_extractor": compiled,
+        "speedup": round(legacy["seconds"] / compiled["seconds"], 2) if compiled["seconds"] else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+-- 批量处理 AI 任务需要的状态列（process_ai_batch / dispatch_pending_submissions）
+ALTER TABLE survey_data ADD COLUMN IF NOT EXISTS ai_processed BOOLEAN DEFAULT FALSE;  -- AI 结果是否已写入
+ALTER TABLE survey_data ADD COLUMN IF NOT EXISTS ai_error TEXT;                       -- 最近一次处理失败的原因
+ALTER TABLE survey_data ADD COLUMN IF NOT EXISTS ai_attempts INT DEFAULT 0;           -- 已处理次数（成功或失败）
+ALTER TABLE survey_data ADD COLUMN IF NOT EXISTS ai_dispatched_at TIMESTAMP;          -- 最近一次被分发到批量任务的时间
+
+-- 只索引还没有结果的提交，分发任务按 created_at 顺序扫描
+CREATE INDEX IF NOT EXISTS survey_data_pending_idx
+    ON survey_data (created_at)
+    WHERE ai_output_text IS NULL;
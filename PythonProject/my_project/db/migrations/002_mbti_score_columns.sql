@@ -0,0 +1,8 @@
+-- 每个维度的分数单独成列，并记录计算分数和生成 AI 结果时的输入哈希
+-- （mbti_calculator.mbti_input_hash）。哈希没变的重复任务直接跳过计分和 AI 调用。
+ALTER TABLE survey_data ADD COLUMN IF NOT EXISTS mbti_e_i DOUBLE PRECISION;  -- E/I 分数
+ALTER TABLE survey_data ADD COLUMN IF NOT EXISTS mbti_s_n DOUBLE PRECISION;  -- S/N 分数
+ALTER TABLE survey_data ADD COLUMN IF NOT EXISTS mbti_t_f DOUBLE PRECISION;  -- T/F 分数
+ALTER TABLE survey_data ADD COLUMN IF NOT EXISTS mbti_j_p DOUBLE PRECISION;  -- J/P 分数
+ALTER TABLE survey_data ADD COLUMN IF NOT EXISTS mbti_input_hash TEXT;       -- 上面四个分数对应的输入哈希
+ALTER TABLE survey_data ADD COLUMN IF NOT EXISTS ai_input_hash TEXT;         -- ai_output_text 对应的输入哈希